@@ -0,0 +1,381 @@
+import os
+import gc
+import sys
+import json
+import time
+import platform
+import subprocess
+import tracemalloc
+import logging
+from datetime import datetime, timezone
+from dataclasses import dataclass
+from typing import Callable, List
+
+import hydra
+import numpy as np
+import pandas as pd
+from omegaconf import DictConfig, OmegaConf
+
+# The benchmarked scripts import their siblings and utils relative to their own directory
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path[:0] = [SRC_DIR] + [os.path.join(SRC_DIR, directory)
+                            for directory in ('preprocessing_scripts', 'clustering', 'analysis')]
+import simplify_data
+import tagging_script
+import one_hot_encode_tags
+import clustering
+import general_analysis
+import tag_analysis
+import ingredients_analysis
+from synthetic_catalog import write_synthetic_catalog
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Benchmark:
+    """
+    A benchmarked step of the pipeline or the analysis.
+
+    Attributes:
+    name (str): Name of the step, listed in 'benchmarks' in the config to time it.
+    inputs (list): Names of the steps whose outputs are passed to run, in order ('catalog' is the raw file).
+    run (callable): run(stages, *inputs) computes the output, stages is the config of every pipeline stage.
+    details (callable): details(output) returns extra measurements stored with the timings, or None.
+    """
+    name: str
+    inputs: List[str]
+    run: Callable
+    details: Callable = None
+
+
+def run_simplify(stages, catalog):
+    """Load the raw catalog and simplify it like the simplify stage of the pipeline."""
+    if stages.simplify.mode == 'streaming':
+        return pd.DataFrame([record for chunk in simplify_data.iter_simplified_chunks(catalog, stages.simplify.chunk_size)
+                             for record in chunk])
+    return simplify_data.simplify_cocktail_data(simplify_data.load_data(catalog))
+
+
+def run_tagging(stages, cocktails):
+    """Compile the tag rules and tag the simplified cocktails."""
+    rules = tagging_script.compile_tag_rules(stages.tagging.tags_definitions)
+    return cocktails.assign(tags=tagging_script.tag_cocktails(cocktails['ingredients'], rules, stages.tagging))
+
+
+def run_one_hot(stages, cocktails):
+    """One-hot encode the tags of the tagged cocktails."""
+    tags_indices = OmegaConf.to_container(stages.one_hot.tags_indices)
+    return one_hot_encode_tags.one_hot_encode_tags(cocktails[stages.one_hot.one_hot.tag_column], tags_indices)
+
+
+def prepare_features(stages, tags_matrix):
+    """Build the normalized and weighted features clustered by the k-sweep."""
+    features = clustering.normalize_tags(clustering.ensure_numeric_format(tags_matrix))
+    return clustering.apply_weights(features, clustering.compute_weights(features.sum(axis=0)))
+
+
+def run_k_sweep(stages, features):
+    """Fit and score K-means for every candidate number of clusters."""
+    clustering_cfg = stages.clustering.clustering
+    return clustering.find_optimal_clusters(features, max_clusters=clustering_cfg.n_clusters,
+                                            n_jobs=clustering_cfg.n_jobs,
+                                            evaluation=OmegaConf.to_container(clustering_cfg.evaluation))
+
+
+def sweep_details(output):
+    """Fit and score time of every candidate number of clusters."""
+    _, results = output
+    return {str(result.n_clusters): {'fit_seconds': result.fit_seconds, 'score_seconds': result.score_seconds}
+            for result in results}
+
+
+def run_clustering(stages, cocktails, tags_matrix):
+    """Cluster the tagged cocktails, including the k-sweep and the final evaluation."""
+    columns = one_hot_encode_tags.tag_columns(OmegaConf.to_container(stages.one_hot.tags_indices))
+    return clustering.cluster_cocktails(cocktails.copy(deep=False), tags_matrix, columns, stages.clustering.clustering,
+                                        stages.tagging)
+
+
+def run_general_analysis(stages, cocktails):
+    """Profile every column and derive the column statistics and the descriptive statistics."""
+    profile = general_analysis.profile_data(cocktails)
+    return general_analysis.analyze_columns(profile), general_analysis.generate_descriptive_stats(profile)
+
+
+def run_tag_analysis(stages, cocktails):
+    """Count the tags and list the unique tags."""
+    return tag_analysis.tag_counter(cocktails), tag_analysis.analyze_tags(cocktails)
+
+
+def run_ingredient_analysis(stages, cocktails):
+    """Flatten the nested ingredients and compute their statistics."""
+    return ingredients_analysis.analyze_ingredients(ingredients_analysis.flatten_ingredients(cocktails['ingredients']))
+
+
+def run_ingredient_report(stages, cocktails):
+    """Flatten the nested ingredients, build the alcohol report and run the three alcohol reports."""
+    ingredients = ingredients_analysis.aggregate_ingredients(
+        ingredients_analysis.flatten_ingredients(cocktails['ingredients']))
+    report = ingredients_analysis.build_ingredient_report(ingredients)
+    return (ingredients_analysis.print_ingredients_without_alcohol(report),
+            ingredients_analysis.print_strong_alcohol_ingredients(report),
+            ingredients_analysis.print_alcohol_ingredients(report))
+
+
+# Steps in topological order, the ones not listed in 'benchmarks' in the config only prepare inputs
+BENCHMARKS = {
+    'simplify': Benchmark('simplify', ['catalog'], run_simplify),
+    'tagging': Benchmark('tagging', ['simplify'], run_tagging),
+    'one_hot': Benchmark('one_hot', ['tagging'], run_one_hot),
+    'features': Benchmark('features', ['one_hot'], prepare_features),
+    'k_sweep': Benchmark('k_sweep', ['features'], run_k_sweep, details=sweep_details),
+    'clustering': Benchmark('clustering', ['tagging', 'one_hot'], run_clustering),
+    'general_analysis': Benchmark('general_analysis', ['tagging'], run_general_analysis),
+    'tag_analysis': Benchmark('tag_analysis', ['tagging'], run_tag_analysis),
+    'ingredient_analysis': Benchmark('ingredient_analysis', ['simplify'], run_ingredient_analysis),
+    'ingredient_report': Benchmark('ingredient_report', ['simplify'], run_ingredient_report),
+}
+
+
+def measure(function, repeats, profile_memory):
+    """
+    Time a function, and optionally record its peak memory in an extra traced run.
+
+    tracemalloc slows down Python code, so the timed runs are not traced. It
+    records the allocations of Python objects and NumPy arrays, but not the
+    buffers allocated by Arrow.
+
+    Parameters:
+    function (callable): Function without arguments.
+    repeats (int): Number of timed runs.
+    profile_memory (bool): Run the function once more under tracemalloc.
+
+    Returns:
+    tuple: (output, seconds, peak_bytes) - the output of the last run, the time
+           of every timed run and the peak traced memory (None if not profiled).
+    """
+    seconds = []
+    output = None
+    for _ in range(repeats):
+        # Release the previous output before the next run
+        output = None
+        gc.collect()
+        start = time.perf_counter()
+        output = function()
+        seconds.append(time.perf_counter() - start)
+
+    peak_bytes = None
+    if profile_memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            function()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return output, seconds, peak_bytes
+
+
+def catalog_path(cfg, size):
+    description = '' if cfg.description_length is None else f"_{cfg.description_length}"
+    return os.path.join(cfg.data_dir, f"synthetic_{size}_{cfg.n_ingredients}_{cfg.random_state}{description}.json")
+
+
+def run_size(cfg, size):
+    """
+    Run the enabled benchmarks on a synthetic catalog.
+
+    Parameters:
+    cfg (DictConfig): The benchmark configuration.
+    size (int): Number of synthetic cocktails.
+
+    Returns:
+    list: Result of every benchmark run on this size.
+    """
+    catalog = catalog_path(cfg, size)
+    if not os.path.exists(catalog):
+        logger.info("Generating a synthetic catalog of %d cocktails", size)
+        write_synthetic_catalog(catalog, size, n_ingredients=cfg.n_ingredients, random_state=cfg.random_state,
+                                description_length=cfg.description_length)
+
+    outputs = {'catalog': catalog}
+    results = []
+
+    def output(name):
+        # Inputs of the benchmarks that are not benchmarked themselves are computed once, untimed
+        if name not in outputs:
+            benchmark = BENCHMARKS[name]
+            outputs[name] = benchmark.run(cfg.stages, *[output(dependency) for dependency in benchmark.inputs])
+        return outputs[name]
+
+    for name, benchmark in BENCHMARKS.items():
+        if name not in cfg.benchmarks:
+            continue
+        max_size = cfg.max_size.get(name)
+        if max_size is not None and size > max_size:
+            logger.info("Skipping %s on %d cocktails (max %d)", name, size, max_size)
+            continue
+
+        inputs = [output(dependency) for dependency in benchmark.inputs]
+        result, seconds, peak_bytes = measure(lambda: benchmark.run(cfg.stages, *inputs),
+                                              cfg.repeats, cfg.profile_memory)
+        outputs[name] = result
+        results.append({
+            'benchmark': name,
+            'size': size,
+            'seconds': seconds,
+            'best_seconds': min(seconds),
+            'median_seconds': float(np.median(seconds)),
+            'peak_memory_mb': peak_bytes / 2 ** 20 if peak_bytes is not None else None,
+            'details': benchmark.details(result) if benchmark.details else None,
+        })
+        logger.info("%-20s %10d cocktails  %9.3fs  %s", name, size, min(seconds),
+                    f"{peak_bytes / 2 ** 20:.1f} MB" if peak_bytes is not None else '')
+    return results
+
+
+def git_revision():
+    """
+    Identify the benchmarked code.
+
+    Returns:
+    tuple: (commit, dirty) - the checked out commit and whether tracked files are modified, (None, None) outside git.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout
+        status = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit.strip(), bool(status.strip())
+
+
+def machine_info():
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+
+
+def load_results(file_path):
+    with open(file_path) as results_file:
+        return json.load(results_file)
+
+
+def previous_results(results_dir, commit, dirty, compare_to=None):
+    """
+    Find the run to compare the current one with.
+
+    Parameters:
+    results_dir (str): Directory of the results files.
+    commit (str): The benchmarked commit.
+    dirty (bool): Whether the benchmarked tree has uncommitted changes.
+    compare_to (str): Explicit results file, overrides the search.
+
+    Returns:
+    dict: The previous results, None if there is no previous run. The latest run of
+          another commit is used, or of the same commit if the current tree has uncommitted changes.
+    """
+    if compare_to:
+        return load_results(compare_to)
+    if not os.path.isdir(results_dir):
+        return None
+    # File names start with the UTC timestamp of the run
+    for file_name in sorted(os.listdir(results_dir), reverse=True):
+        if not file_name.endswith('.json'):
+            continue
+        previous = load_results(os.path.join(results_dir, file_name))
+        if previous.get('commit') != commit or (dirty and not previous.get('dirty')):
+            return previous
+    return None
+
+
+def compare_results(current, previous, threshold):
+    """
+    Log the change of time and peak memory of every benchmark run in both runs.
+
+    Parameters:
+    current (dict): Results of the current run.
+    previous (dict): Results of the previous run.
+    threshold (float): Ratio above which a benchmark is reported as a regression.
+
+    Returns:
+    list: (benchmark, size, metric, ratio) of every regression.
+    """
+    if previous['machine'] != current['machine']:
+        logger.warning("The previous run was on another machine, timings are not comparable.")
+
+    baseline = {(result['benchmark'], result['size']): result for result in previous['results']}
+    logger.info("Compared with %s (%s):", (previous.get('commit') or 'unknown commit')[:8], previous['timestamp'])
+    regressions = []
+    for result in current['results']:
+        before = baseline.get((result['benchmark'], result['size']))
+        if before is None:
+            continue
+        ratios = {'time': result['best_seconds'] / max(before['best_seconds'], 1e-9)}
+        if result['peak_memory_mb'] is not None and before['peak_memory_mb']:
+            ratios['memory'] = result['peak_memory_mb'] / before['peak_memory_mb']
+        logger.info("%-20s %10d cocktails  time x%.2f  %s", result['benchmark'], result['size'], ratios['time'],
+                    f"memory x{ratios['memory']:.2f}" if 'memory' in ratios else '')
+        for metric, ratio in ratios.items():
+            if ratio > threshold:
+                regressions.append((result['benchmark'], result['size'], metric, ratio))
+
+    for benchmark, size, metric, ratio in regressions:
+        logger.warning("Regression: %s on %d cocktails, %s x%.2f", benchmark, size, metric, ratio)
+    return regressions
+
+
+def save_results(results, results_dir):
+    """
+    Write the results of a run to a new file named after its timestamp and commit.
+
+    Parameters:
+    results (dict): Results of the run.
+    results_dir (str): Output directory.
+
+    Returns:
+    str: Path to the written file.
+    """
+    os.makedirs(results_dir, exist_ok=True)
+    timestamp = datetime.fromisoformat(results['timestamp']).strftime('%Y%m%dT%H%M%SZ')
+    file_path = os.path.join(results_dir, f"{timestamp}_{(results['commit'] or 'unknown')[:8]}.json")
+    with open(file_path, 'w') as results_file:
+        json.dump(results, results_file, indent=4)
+    return file_path
+
+
+@hydra.main(version_base=None, config_path="../configs", config_name="benchmark_configs/benchmark_config")
+def main(cfg: DictConfig):
+    """
+    Time and memory-profile every stage on synthetic catalogs of growing size.
+
+    Parameters:
+    cfg (DictConfig): Benchmark configuration with the config of every pipeline stage under 'stages'.
+    """
+    # Only the warnings of the benchmarked scripts are shown, their progress logs would flood the timings
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    unknown = [name for name in cfg.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        logger.critical("Unknown benchmarks %s. Use any of %s.", unknown, list(BENCHMARKS))
+        return None
+
+    commit, dirty = git_revision()
+    current = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'config': OmegaConf.to_container(cfg),
+        'results': [result for size in cfg.sizes for result in run_size(cfg, size)],
+    }
+
+    previous = previous_results(cfg.results_dir, commit, dirty, cfg.compare_to)
+    logger.info("Results saved to %s", save_results(current, cfg.results_dir))
+    if previous is not None:
+        compare_results(current, previous, cfg.regression_threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import os
+import sys
+import time
+import tempfile
+import subprocess
+import logging
+from datetime import datetime, timezone
+
+import hydra
+from omegaconf import DictConfig, OmegaConf
+
+from run_benchmarks import git_revision, machine_info, save_results
+
+logger = logging.getLogger(__name__)
+
+CLI = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src', 'cli.py'))
+
+
+def parse_importtime(output):
+    """
+    Parse the report written to stderr by python -X importtime.
+
+    Parameters:
+    output (str): stderr of the process.
+
+    Returns:
+    tuple: (top_level, modules) - cumulative import time in ms of every module imported
+           directly by the process (not by another module), and the names of all imported modules.
+    """
+    top_level = {}
+    modules = set()
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        if not cumulative_us.strip().isdigit():
+            continue  # Header line
+        module = name.strip()
+        modules.add(module)
+        # Nested imports are indented by two spaces per level
+        if len(name) - len(name.lstrip()) == 1:
+            top_level[module] = top_level.get(module, 0) + int(cumulative_us) / 1000
+    return top_level, modules
+
+
+def run_command(command, args, run_dir, importtime=False):
+    """
+    Run a command of the CLI in a fresh interpreter.
+
+    Parameters:
+    command (str): Name of the command.
+    args (list): Hydra overrides of the run.
+    run_dir (str): Hydra run directory, so the timed runs leave no outputs.
+    importtime (bool): Run with -X importtime.
+
+    Returns:
+    tuple: (wall time in ms, stderr of the process).
+    """
+    arguments = [sys.executable] + (['-X', 'importtime'] if importtime else []) + [CLI, command]
+    arguments += list(args) + [f"hydra.run.dir={run_dir}"]
+    start = time.perf_counter()
+    process = subprocess.run(arguments, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if process.returncode != 0:
+        raise RuntimeError(f"'{' '.join(arguments)}' failed:\n{process.stderr}")
+    return wall_ms, process.stderr
+
+
+def measure_command(command, command_cfg, cfg, run_dir):
+    """
+    Time the startup of a command and list the heavy modules it imports.
+
+    Parameters:
+    command (str): Name of the command.
+    command_cfg (DictConfig): args and allowed heavy modules of the command.
+    cfg (DictConfig): The benchmark configuration.
+    run_dir (str): Hydra run directory of the runs.
+
+    Returns:
+    dict: Timings, slowest imports and budget violations of the command.
+    """
+    wall_ms = min(run_command(command, command_cfg.args, run_dir)[0] for _ in range(cfg.repeats))
+    _, report = run_command(command, command_cfg.args, run_dir, importtime=True)
+    top_level, modules = parse_importtime(report)
+
+    heavy = sorted({module.split('.')[0] for module in modules} & set(cfg.heavy_modules))
+    import_ms = sum(top_level.values())
+    violations = [f"imports {module}" for module in heavy if module not in command_cfg.allowed]
+    if wall_ms > cfg.wall_budget_ms:
+        violations.append(f"wall time {wall_ms:.0f} ms > {cfg.wall_budget_ms} ms")
+    if import_ms > cfg.import_budget_ms:
+        violations.append(f"import time {import_ms:.0f} ms > {cfg.import_budget_ms} ms")
+
+    slowest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)[:cfg.top_imports]
+    return {'command': command, 'args': list(command_cfg.args), 'wall_ms': wall_ms, 'import_ms': import_ms,
+            'heavy_modules': heavy, 'slowest_imports': dict(slowest), 'violations': violations}
+
+
+@hydra.main(version_base=None, config_path="../configs", config_name="benchmark_configs/startup_config")
+def main(cfg: DictConfig):
+    """
+    Check the startup time and the imports of the CLI commands against their budget.
+
+    Exits with status 1 if a command is over budget or imports a heavy module it does not need.
+
+    Parameters:
+    cfg (DictConfig): Startup benchmark configuration.
+    """
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as run_dir:
+        results = [measure_command(command, command_cfg, cfg, run_dir)
+                   for command, command_cfg in cfg.commands.items()]
+
+    for result in results:
+        logger.info("%-20s wall %5.0f ms  imports %5.0f ms  heavy modules: %s", result['command'],
+                    result['wall_ms'], result['import_ms'], ', '.join(result['heavy_modules']) or 'none')
+        logger.info("%-20s slowest imports: %s", '', ', '.join(f"{module} {ms:.0f} ms"
+                                                              for module, ms in result['slowest_imports'].items()))
+
+    commit, dirty = git_revision()
+    logger.info("Results saved to %s", save_results({
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'machine': machine_info(),
+        'config': OmegaConf.to_container(cfg),
+        'results': results,
+    }, cfg.results_dir))
+
+    violations = [(result['command'], violation) for result in results for violation in result['violations']]
+    for command, violation in violations:
+        logger.error("%s: %s", command, violation)
+    if violations:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
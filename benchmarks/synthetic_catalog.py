@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import logging
+from collections import Counter
+from dataclasses import dataclass
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+from utils.data_storage import RAW_DATASET
+
+logger = logging.getLogger(__name__)
+
+# Ids of the synthetic cocktails start above the ids of the bundled dataset
+FIRST_COCKTAIL_ID = 100000
+
+
+@dataclass
+class SeedCatalog:
+    """
+    Value distributions of the bundled raw dataset, sampled by the generator.
+
+    Attributes:
+    ingredients (list): Distinct raw ingredient dicts without their measure, sorted by id.
+    ingredient_weights (np.ndarray): Number of cocktails using every ingredient.
+    measures (list): Measures listed in the bundled cocktails.
+    ingredient_counts (np.ndarray): Number of ingredients of every bundled cocktail.
+    cocktails (list): Raw cocktails, their category, glass, tags and instructions are resampled.
+    """
+    ingredients: list
+    ingredient_weights: np.ndarray
+    measures: list
+    ingredient_counts: np.ndarray
+    cocktails: list
+
+
+def load_seed_catalog(file_path=RAW_DATASET):
+    """
+    Collect the value distributions of a raw dataset.
+
+    Parameters:
+    file_path (str): Path to the raw JSON dataset.
+
+    Returns:
+    SeedCatalog: The distributions of the dataset.
+    """
+    with open(file_path, 'r') as file:
+        cocktails = json.load(file)
+
+    ingredients = {}
+    usage = Counter()
+    measures = []
+    for cocktail in cocktails:
+        for ingredient in cocktail['ingredients']:
+            ingredients.setdefault(ingredient['id'], {k: v for k, v in ingredient.items() if k != 'measure'})
+            usage[ingredient['id']] += 1
+            if ingredient.get('measure') is not None:
+                measures.append(ingredient['measure'])
+
+    ids = sorted(ingredients)
+    return SeedCatalog(
+        ingredients=[ingredients[ingredient_id] for ingredient_id in ids],
+        ingredient_weights=np.array([usage[ingredient_id] for ingredient_id in ids], dtype=np.float64),
+        measures=measures,
+        ingredient_counts=np.array([len(cocktail['ingredients']) for cocktail in cocktails]),
+        cocktails=cocktails,
+    )
+
+
+def extend_ingredients(seed, n_ingredients, rng):
+    """
+    Add synthetic ingredients to the bundled ones, with Zipf-distributed popularity.
+
+    Parameters:
+    seed (SeedCatalog): The bundled distributions.
+    n_ingredients (int): Total number of ingredients, at least the bundled ones are kept.
+    rng (np.random.Generator): Random generator.
+
+    Returns:
+    tuple: (ingredients, probabilities) - the ingredient dicts and the probability of drawing each of them.
+    """
+    ingredients = list(seed.ingredients)
+    weights = list(seed.ingredient_weights)
+    next_id = max(ingredient['id'] for ingredient in ingredients) + 1
+    for rank in range(len(ingredients), n_ingredients):
+        template = seed.ingredients[rng.integers(len(seed.ingredients))]
+        alcohol = int(rng.random() < 0.4)
+        ingredients.append({
+            **template,
+            'id': next_id,
+            'name': f"Synthetic Ingredient {next_id}",
+            'alcohol': alcohol,
+            'percentage': int(rng.integers(5, 60)) if alcohol and rng.random() < 0.5 else None,
+        })
+        # The synthetic ingredients form the long tail of the popularity distribution
+        weights.append(seed.ingredient_weights.max() / (rank + 1))
+        next_id += 1
+
+    weights = np.asarray(weights, dtype=np.float64)
+    return ingredients, weights / weights.sum()
+
+
+def iter_synthetic_cocktails(n_cocktails, seed=None, n_ingredients=None, chunk_size=10000, random_state=0,
+                             description_length=None):
+    """
+    Generate raw cocktails with the schema and value distributions of the bundled dataset.
+
+    Every cocktail samples its category, glass, tags, alcoholic flag and
+    instructions from a bundled cocktail, its number of ingredients from the
+    bundled ingredient counts, and its ingredients (without repetition) by
+    popularity, so the tagging rules match like on real data.
+
+    Parameters:
+    n_cocktails (int): Number of cocktails.
+    seed (SeedCatalog): Distributions to sample, the bundled dataset if None.
+    n_ingredients (int): Size of the ingredient catalog, the bundled ingredients if None.
+    chunk_size (int): Number of cocktails per chunk.
+    random_state (int): Seed of the generator, the same seed generates the same catalog.
+    description_length (int): Truncate the ingredient descriptions to this length, None keeps them whole.
+
+    Yields:
+    list: The next chunk of raw cocktail dicts.
+    """
+    seed = seed or load_seed_catalog()
+    rng = np.random.default_rng(random_state)
+    ingredients, probabilities = extend_ingredients(seed, n_ingredients or len(seed.ingredients), rng)
+    if description_length is not None:
+        # The descriptions are most of the size of the raw catalog
+        ingredients = [{**ingredient, 'description': ingredient['description'][:description_length]}
+                       if ingredient['description'] else ingredient for ingredient in ingredients]
+    max_count = len(ingredients)
+
+    for start in range(0, n_cocktails, chunk_size):
+        size = min(chunk_size, n_cocktails - start)
+        templates = rng.integers(len(seed.cocktails), size=size)
+        counts = np.minimum(rng.choice(seed.ingredient_counts, size=size), max_count)
+        measures = rng.integers(len(seed.measures), size=int(counts.sum()))
+        position = 0
+
+        chunk = []
+        for row in range(size):
+            template = seed.cocktails[templates[row]]
+            cocktail_id = FIRST_COCKTAIL_ID + start + row
+            chosen = rng.choice(max_count, size=counts[row], replace=False, p=probabilities)
+            cocktail_ingredients = []
+            for ingredient in chosen:
+                cocktail_ingredients.append({**ingredients[ingredient], 'measure': seed.measures[measures[position]]})
+                position += 1
+            chunk.append({
+                **template,
+                'id': cocktail_id,
+                'name': f"Synthetic Cocktail {cocktail_id}",
+                'ingredients': cocktail_ingredients,
+            })
+        yield chunk
+
+
+def write_synthetic_catalog(file_path, n_cocktails, n_ingredients=None, chunk_size=10000, random_state=0,
+                            description_length=None):
+    """
+    Write a synthetic raw dataset as a JSON array, one cocktail per line.
+
+    The cocktails are written chunk by chunk, so catalogs larger than memory can be generated.
+
+    Parameters:
+    file_path (str): Path to the output JSON file.
+    n_cocktails (int): Number of cocktails.
+    n_ingredients (int): Size of the ingredient catalog, the bundled ingredients if None.
+    chunk_size (int): Number of cocktails generated at once.
+    random_state (int): Seed of the generator.
+    description_length (int): Truncate the ingredient descriptions to this length, None keeps them whole.
+    """
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    temporary = file_path + '.tmp'
+    with open(temporary, 'w') as file:
+        file.write('[')
+        separator = '\n'
+        for chunk in iter_synthetic_cocktails(n_cocktails, n_ingredients=n_ingredients, chunk_size=chunk_size,
+                                              random_state=random_state, description_length=description_length):
+            for cocktail in chunk:
+                file.write(separator)
+                file.write(json.dumps(cocktail))
+                separator = ',\n'
+        file.write('\n]\n')
+    # Interrupted runs do not leave a truncated catalog behind
+    os.replace(temporary, file_path)
+    logger.info("Synthetic catalog of %d cocktails written to %s", n_cocktails, file_path)
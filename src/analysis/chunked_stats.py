@@ -0,0 +1,562 @@
+import logging
+from collections import Counter
+
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+# Rows of pd.DataFrame.describe(include='all'), in order
+DESCRIBE_ROWS = ['count', 'unique', 'top', 'freq', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
+
+def is_list(value):
+    """Check whether a value is a list-like cell (lists from JSON, arrays from Arrow)."""
+    return isinstance(value, (list, tuple, np.ndarray))
+
+
+class DictItems(tuple):
+    """Items of a dict converted by hashable, so restore can convert them back."""
+
+
+def hashable(value):
+    """
+    Convert a cell to a hashable value so it can be counted.
+
+    Parameters:
+    value: Cell value, lists and dicts are converted recursively to tuples.
+
+    Returns:
+    A hashable value.
+    """
+    if is_list(value):
+        return tuple(hashable(item) for item in value)
+    if isinstance(value, dict):
+        return DictItems((key, hashable(item)) for key, item in value.items())
+    return value
+
+
+def restore(value):
+    """Convert a value made hashable by hashable back to lists and dicts."""
+    if isinstance(value, DictItems):
+        return {key: restore(item) for key, item in value}
+    if isinstance(value, tuple):
+        return [restore(item) for item in value]
+    return value
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch estimating the number of distinct values.
+
+    Uses 2 ** precision one-byte registers (16 KiB by default), the relative
+    error is about 1.04 / sqrt(2 ** precision), 0.8% by default.
+
+    Parameters:
+    precision (int): Number of hash bits used to select a register.
+    """
+
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def update(self, values):
+        """
+        Add values to the sketch.
+
+        Parameters:
+        values (array-like): Hashable values.
+        """
+        array = np.empty(len(values), dtype=object)
+        array[:] = list(values)
+        hashes = pd.util.hash_array(array)
+
+        remaining_bits = 64 - self.precision
+        registers = (hashes >> np.uint64(remaining_bits)).astype(np.int64)
+        remainders = hashes & np.uint64((1 << remaining_bits) - 1)
+
+        # Rank = position of the leftmost 1 bit in the remaining bits
+        ranks = remaining_bits - bit_length(remainders) + 1
+        np.maximum.at(self.registers, registers, ranks.astype(np.uint8))
+
+    def merge(self, other):
+        """Merge another sketch with the same precision into this one."""
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def count(self):
+        """
+        Estimate the number of distinct values added.
+
+        Returns:
+        int: The estimate.
+        """
+        n_registers = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / n_registers)
+        estimate = alpha * n_registers ** 2 / np.sum(2.0 ** -self.registers.astype(np.float64))
+
+        # Linear counting is more accurate for small cardinalities
+        empty = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * n_registers and empty:
+            estimate = n_registers * np.log(n_registers / empty)
+        return int(round(estimate))
+
+
+def bit_length(values):
+    """
+    Vectorized int.bit_length of uint64 values.
+
+    Parameters:
+    values (np.ndarray): uint64 array.
+
+    Returns:
+    np.ndarray: Number of bits needed to represent every value.
+    """
+    values = values.copy()
+    lengths = np.zeros(values.shape, dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        larger = values >= np.uint64(1 << shift)
+        lengths[larger] += shift
+        values[larger] >>= np.uint64(shift)
+    return lengths + (values > 0)
+
+
+class TopCounter:
+    """
+    Mergeable value counts, optionally bounded to the most frequent values.
+
+    Unbounded, the counts are exact. With a capacity, the counter is pruned to
+    the capacity most frequent values whenever it grows past twice that size,
+    so the counts are approximate: a pruned value that occurs again is counted
+    from zero, and its count is too low by the occurrences it had when pruned.
+    error sums the largest count dropped by every pruning, so the true count of
+    a kept value is between its count and count + error, and a value that is
+    not kept occurred at most error times. The mode is only certain if its
+    count exceeds the next count by more than error.
+
+    Parameters:
+    capacity (int): Number of values kept after pruning, None for exact counts.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.counts = Counter()
+        self.error = 0
+
+    def update(self, counts):
+        """
+        Add counts.
+
+        Parameters:
+        counts (dict): Value -> number of occurrences.
+        """
+        self.counts.update(counts)
+        if self.capacity is not None and len(self.counts) > 2 * self.capacity:
+            kept = self.counts.most_common(self.capacity + 1)
+            self.error += kept.pop()[1]
+            self.counts = Counter(dict(kept))
+
+    def merge(self, other):
+        """Merge another counter into this one, the error bounds add up."""
+        self.error += other.error
+        self.update(other.counts)
+
+
+class QuantileSketch:
+    """
+    Mergeable uniform sample of at most capacity values, used to estimate quantiles.
+
+    Quantiles are exact while fewer than capacity values were added. Merging
+    two samples draws from each in proportion to the number of values it has
+    seen, so the result is a uniform sample of all values.
+
+    Parameters:
+    capacity (int): Maximum number of values kept, None keeps every value (exact quantiles).
+    random_state (int): Seed of the sampling.
+    """
+
+    def __init__(self, capacity=100000, random_state=0):
+        self.capacity = capacity
+        self.rng = np.random.default_rng(random_state)
+        self.sample = np.empty(0)
+        self.n_seen = 0
+
+    def update(self, values):
+        """
+        Add values.
+
+        Parameters:
+        values (np.ndarray): float64 values without NaN.
+        """
+        batch = QuantileSketch(self.capacity)
+        batch.n_seen = len(values)
+        batch.sample = values if self.fits(len(values)) else self.rng.choice(values, self.capacity, replace=False)
+        self.merge(batch)
+
+    def fits(self, size):
+        return self.capacity is None or size <= self.capacity
+
+    def merge(self, other):
+        """Merge another sketch into this one."""
+        n_seen = self.n_seen + other.n_seen
+        if self.fits(len(self.sample) + len(other.sample)):
+            self.sample = np.concatenate([self.sample, other.sample])
+        else:
+            if n_seen < 10 ** 9:
+                from_self = self.rng.hypergeometric(self.n_seen, other.n_seen, self.capacity)
+            else:
+                from_self = self.rng.binomial(self.capacity, self.n_seen / n_seen)
+            from_self = int(np.clip(from_self, self.capacity - len(other.sample), len(self.sample)))
+            self.sample = np.concatenate([
+                self.rng.choice(self.sample, from_self, replace=False),
+                self.rng.choice(other.sample, self.capacity - from_self, replace=False),
+            ])
+        self.n_seen = n_seen
+
+    def quantiles(self, q):
+        """
+        Estimate quantiles with linear interpolation, like pd.Series.quantile.
+
+        Parameters:
+        q (list): Quantiles between 0 and 1.
+
+        Returns:
+        np.ndarray: The estimated quantiles.
+        """
+        return np.quantile(self.sample, q)
+
+
+class FieldStats:
+    """
+    Mergeable statistics of one column (or dict key) computed batch by batch.
+
+    Tracks non-null and missing counts, value counts (unique count, mode and
+    top value), and for numeric fields the mean and variance (merged with
+    Chan's parallel algorithm), min, max and a quantile sketch.
+
+    Parameters:
+    distinct (str): 'exact' counts every distinct value, 'hll' estimates the
+                    unique count with HyperLogLog and only keeps the top_k most
+                    frequent values for the mode, whose frequency is then a lower
+                    bound (see TopCounter).
+    top_k (int): Values kept by the counter with 'hll'.
+    quantile_sample (int): Capacity of the quantile sketch, None for exact quantiles.
+    random_state (int): Seed of the quantile sketch.
+    """
+
+    def __init__(self, distinct='exact', top_k=10000, quantile_sample=100000, random_state=0):
+        if distinct not in ('exact', 'hll'):
+            raise ValueError(f"Unknown distinct counting '{distinct}'. Use 'exact' or 'hll'.")
+        self.count = 0
+        self.missing = 0
+        self.counter = TopCounter(None if distinct == 'exact' else top_k)
+        self.hll = HyperLogLog() if distinct == 'hll' else None
+
+        self.numeric = True
+        self.n_numbers = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.quantiles = QuantileSketch(quantile_sample, random_state)
+
+    def update(self, values, kind=None):
+        """
+        Add a batch of values.
+
+        The values are counted once, and the unique count, mode and top value
+        are all derived from these counts.
+
+        Parameters:
+        values (pd.Series): Values of the field in the batch.
+        kind (str): value_kind of the values if already known.
+        """
+        non_null = values.dropna()
+        self.missing += len(values) - len(non_null)
+        self.count += len(non_null)
+        if non_null.empty:
+            return
+
+        kind = kind or value_kind(non_null)
+        # Only cells that may be lists or dicts go through the Python-level conversion
+        keys = non_null if kind in HASHABLE_KINDS else non_null.map(hashable)
+        counts = keys.value_counts(sort=False)
+        self.counter.update(dict(zip(counts.index.tolist(), counts.tolist())))
+        if self.hll is not None:
+            self.hll.update(counts.index)
+
+        if self.numeric:
+            numbers = numeric_values(non_null, kind)
+            if numbers is None:
+                self.numeric = False
+            else:
+                self._update_moments(len(numbers), numbers.mean(), ((numbers - numbers.mean()) ** 2).sum(),
+                                     numbers.min(), numbers.max())
+                self.quantiles.update(numbers)
+
+    def _update_moments(self, n, mean, m2, minimum, maximum):
+        total = self.n_numbers + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.n_numbers * n / total
+        self.n_numbers = total
+        self.min = min(self.min, minimum)
+        self.max = max(self.max, maximum)
+
+    def merge(self, other):
+        """Merge the statistics of another batch or partition into these."""
+        self.count += other.count
+        self.missing += other.missing
+        self.counter.merge(other.counter)
+        if self.hll is not None:
+            self.hll.merge(other.hll)
+        self.numeric = self.numeric and other.numeric
+        if other.n_numbers:
+            self._update_moments(other.n_numbers, other.mean, other.m2, other.min, other.max)
+            self.quantiles.merge(other.quantiles)
+
+    @property
+    def is_numeric(self):
+        return self.numeric and self.n_numbers > 0
+
+    def unique(self):
+        """Number of distinct non-null values (estimated with 'hll')."""
+        return self.hll.count() if self.hll is not None else len(self.counter.counts)
+
+    def top(self):
+        """
+        Most frequent value, ties broken by first occurrence like describe().
+
+        Returns:
+        tuple: (value, frequency), (None, 0) if there are no values.
+        """
+        if not self.counter.counts:
+            return None, 0
+        value, frequency = max(self.counter.counts.items(), key=lambda item: item[1])
+        return restore(value), frequency
+
+    def mode(self):
+        """
+        Most frequent value, ties broken by the smallest value like Series.mode()[0].
+
+        Returns:
+        tuple: (value, frequency), (None, 0) if there are no values.
+        """
+        if not self.counter.counts:
+            return None, 0
+        frequency = max(self.counter.counts.values())
+        candidates = [value for value, count in self.counter.counts.items() if count == frequency]
+        try:
+            return restore(min(candidates)), frequency
+        except TypeError:
+            return restore(candidates[0]), frequency
+
+    def describe(self):
+        """
+        Summary statistics like pd.Series.describe().
+
+        Returns:
+        pd.Series: count, mean, std, min, quartiles and max for numeric fields,
+                   count, unique, top and freq otherwise.
+        """
+        if self.is_numeric:
+            quartiles = self.quantiles.quantiles([0.25, 0.5, 0.75])
+            std = np.sqrt(self.m2 / (self.n_numbers - 1)) if self.n_numbers > 1 else np.nan
+            return pd.Series({'count': float(self.count), 'mean': self.mean, 'std': std, 'min': self.min,
+                              '25%': quartiles[0], '50%': quartiles[1], '75%': quartiles[2], 'max': self.max})
+
+        top, frequency = self.top()
+        return pd.Series({'count': self.count, 'unique': self.unique(),
+                          'top': top,
+                          'freq': frequency if self.count else np.nan}, dtype=object)
+
+    def summary(self):
+        """
+        All statistics of the field in one record.
+
+        Returns:
+        dict: non_null, missing, unique, mode and mode_freq, plus mean, std,
+              min, quartiles and max for numeric fields.
+        """
+        mode, frequency = self.mode()
+        summary = {'non_null': self.count, 'missing': self.missing, 'unique': self.unique(),
+                   'mode': mode, 'mode_freq': frequency}
+        if self.is_numeric:
+            summary.update(self.describe().drop('count').to_dict())
+        return summary
+
+
+# Kinds of pd.api.types.infer_dtype whose values can be counted as they are
+HASHABLE_KINDS = {'string', 'bytes', 'integer', 'floating', 'mixed-integer-float', 'decimal', 'complex', 'boolean',
+                  'datetime64', 'datetime', 'date', 'timedelta64', 'timedelta', 'time', 'period', 'categorical',
+                  'empty'}
+NUMERIC_KINDS = {'integer', 'floating', 'mixed-integer-float'}
+
+
+def value_kind(values):
+    """
+    Infer the kind of the values of a column in a single C-level scan.
+
+    Parameters:
+    values (pd.Series): The values.
+
+    Returns:
+    str: The kind returned by pd.api.types.infer_dtype, ignoring missing values.
+    """
+    return pd.api.types.infer_dtype(values, skipna=True)
+
+
+def numeric_values(values, kind=None):
+    """
+    Convert non-null values to floats if they are all numbers (booleans excluded).
+
+    Parameters:
+    values (pd.Series): Non-null values.
+    kind (str): value_kind of the values if already known.
+
+    Returns:
+    np.ndarray: float64 values, or None if a value is not a number.
+    """
+    if pd.api.types.is_bool_dtype(values):
+        return None
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(dtype=np.float64)
+    if (kind or value_kind(values)) in NUMERIC_KINDS:
+        return values.astype(np.float64).to_numpy()
+    return None
+
+
+def describe_fields(fields):
+    """
+    Combine field statistics into a table like pd.DataFrame.describe(include='all').
+
+    Parameters:
+    fields (dict): Field name -> FieldStats.
+
+    Returns:
+    pd.DataFrame: One column per field.
+    """
+    table = pd.DataFrame({name: stats.describe() for name, stats in fields.items()})
+    return table.reindex(DESCRIBE_ROWS).dropna(how='all')
+
+
+class DatasetProfile:
+    """
+    Mergeable profile of a dataset built from record batches.
+
+    For every column it keeps the statistics of its values. List columns are
+    also exploded: the statistics of their elements are kept per column, or
+    per key when the elements are dicts (like pd.json_normalize).
+
+    Parameters:
+    **field_options: Keyword arguments of FieldStats.
+    """
+
+    def __init__(self, **field_options):
+        self.field_options = field_options
+        self.n_rows = 0
+        self.columns = {}
+        self.elements = {}
+        self.keys = {}
+
+    def _field(self, fields, name):
+        if name not in fields:
+            fields[name] = FieldStats(**self.field_options)
+        return fields[name]
+
+    def update(self, batch):
+        """
+        Add a batch of records.
+
+        Parameters:
+        batch (pd.DataFrame): The next batch of rows.
+        """
+        self.n_rows += len(batch)
+        for column in batch.columns:
+            values = batch[column]
+            kind = value_kind(values)
+            self._field(self.columns, column).update(values, kind)
+
+            # Columns of scalars are never scanned for lists
+            if kind in HASHABLE_KINDS or not values.map(is_list).any():
+                continue
+            elements = values.explode().dropna()
+            if elements.map(lambda element: isinstance(element, dict)).any():
+                records = pd.json_normalize(elements.tolist())
+                keys = self.keys.setdefault(column, {})
+                for key in records.columns:
+                    self._field(keys, key).update(records[key])
+            else:
+                self._field(self.elements, column).update(elements)
+
+    def merge(self, other):
+        """Merge the profile of another partition of the dataset into this one."""
+        self.n_rows += other.n_rows
+        for fields, other_fields in ((self.columns, other.columns), (self.elements, other.elements)):
+            for name, stats in other_fields.items():
+                self._field(fields, name).merge(stats)
+        for column, other_keys in other.keys.items():
+            keys = self.keys.setdefault(column, {})
+            for key, stats in other_keys.items():
+                self._field(keys, key).merge(stats)
+
+    def describe(self):
+        """Descriptive statistics of the columns, like data.describe(include='all')."""
+        return describe_fields(self.columns)
+
+    def missing_values(self):
+        """Number of missing values of every column, like data.isnull().sum()."""
+        return pd.Series({name: stats.missing for name, stats in self.columns.items()}, dtype=np.int64)
+
+    def summary(self):
+        """
+        Structured profile with one row per analyzed field.
+
+        Columns of scalars and list columns are summarized by their values or
+        elements, list columns of dicts by every key of the dicts.
+
+        Returns:
+        pd.DataFrame: FieldStats.summary of every field, indexed by (column, key),
+                      the key being None except for dict keys.
+        """
+        rows = {}
+        for column, stats in self.columns.items():
+            if column in self.keys:
+                for key, key_stats in self.keys[column].items():
+                    rows[(column, key)] = key_stats.summary()
+            else:
+                rows[(column, None)] = self.elements.get(column, stats).summary()
+        index = pd.MultiIndex.from_tuples(list(rows), names=['column', 'key'])
+        return pd.DataFrame(list(rows.values()), index=index)
+
+
+def profile_batches(batches, **field_options):
+    """
+    Profile a dataset batch by batch.
+
+    Parameters:
+    batches (iterable): Batches of rows (pd.DataFrame).
+    **field_options: Keyword arguments of FieldStats.
+
+    Returns:
+    DatasetProfile: The profile of all batches.
+    """
+    profile = DatasetProfile(**field_options)
+    for index, batch in enumerate(batches):
+        profile.update(batch)
+        logger.debug("Profiled batch %d (%d rows so far)", index, profile.n_rows)
+    return profile
+
+
+def field_options(chunked_cfg):
+    """
+    Keyword arguments of FieldStats from the 'chunked' section of an analysis config.
+
+    Parameters:
+    chunked_cfg (DictConfig): The 'chunked' section.
+
+    Returns:
+    dict: The distinct, top_k and quantile_sample options set in the section.
+    """
+    return {key: chunked_cfg[key] for key in ('distinct', 'top_k', 'quantile_sample') if key in chunked_cfg}
@@ -1,24 +1,39 @@
-import pandas as pd
+import os
+import sys
 import logging
 import hydra
 from omegaconf import DictConfig, OmegaConf
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.data_storage import input_dataset_path, iter_dataset_batches, read_dataset
+from utils.instrumentation import instrumented, instrumented_main
+from utils.result_cache import Lazy, open_cache
+from utils.lazy_imports import lazy_import
+from chunked_stats import DatasetProfile, field_options, profile_batches
+
+pd = lazy_import('pandas')
+
+# Editing these files invalidates the cached results of the analysis
+ANALYSIS_SOURCES = [__file__, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chunked_stats.py')]
+
 # Configure logging with a custom format
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
 
 
-def load_data(file_path):
+@instrumented
+def load_data(file_path, columns=None):
     """
-    Load JSON data from a specified file.
+    Load data from a specified JSON, Parquet or Arrow file.
 
     Parameters:
-    file_path (str): The path to the JSON file to be loaded.
+    file_path (str): The path to the file to be loaded.
+    columns (list): Optional list of columns to load. All columns are loaded if None.
 
     Returns:
     pd.DataFrame: The loaded data as a DataFrame, or None if an error occurs.
     """
     try:
-        data = pd.read_json(file_path)
+        data = read_dataset(file_path, columns=columns)
         logging.info(f"Data loaded successfully from {file_path}.")
         return data
     except Exception as e:
@@ -26,87 +41,151 @@ def load_data(file_path):
         return None
 
 
-def analyze_columns(data):
+@instrumented
+def profile_data(data):
+    """
+    Profile every column of a loaded dataset in a single pass per column.
+
+    The values of each column are counted once, and the unique count, mode and
+    frequency are derived from these counts instead of rescanning the column.
+    List columns are exploded once, and dict elements normalized once.
+
+    Parameters:
+    data (pd.DataFrame): The dataset to be profiled.
+
+    Returns:
+    DatasetProfile: The profile of the dataset, with exact quantiles.
+    """
+    profile = DatasetProfile(quantile_sample=None)
+    profile.update(data)
+    return profile
+
+
+@instrumented
+def build_profile(file_path, cfg):
+    """
+    Profile the dataset, batch by batch if enabled in the config.
+
+    Parameters:
+    file_path (str): The path to the dataset.
+    cfg (DictConfig): The configuration object containing settings for the analysis.
+
+    Returns:
+    DatasetProfile: The profile of the dataset, or None if the data could not be loaded.
+    """
+    if cfg.chunked.enabled:
+        return profile_batches(iter_dataset_batches(file_path, cfg.chunked.batch_size), **field_options(cfg.chunked))
+
+    data = load_data(file_path)
+    if data is None:
+        logging.error("No data to analyze.")
+        return None
+    return profile_data(data)
+
+
+@instrumented
+def analyze_columns(profile):
     """
     Analyze each column in the dataset.
 
-    This function logs detailed analysis for each column in the provided DataFrame.
+    This function logs detailed analysis for each column of the profiled dataset.
     It handles columns containing lists and dictionaries, providing unique counts,
     most common values, and their frequencies. For numeric columns, it also logs
     descriptive statistics.
 
     Parameters:
-    data (pd.DataFrame): The dataset to be analyzed. Each column in the DataFrame
-                         will be analyzed individually.
+    profile (DatasetProfile): Profile of the dataset, from profile_data or profile_batches.
 
     Returns:
-    None
+    pd.DataFrame: The structured column profile (see DatasetProfile.summary).
     """
     logging.info("Analyzing each column in the dataset:")
 
-    for column in data.columns:
+    for column, stats in profile.columns.items():
         logging.info(f"\nAnalyzing column: {column}")
 
-        if data[column].apply(lambda x: isinstance(x, list)).any():
-            flat_list = data[column].explode().dropna()
-
-            if flat_list.apply(lambda x: isinstance(x, dict)).any():
-                dict_df = pd.json_normalize(flat_list)
-                unique_count = dict_df.nunique()
-                logging.info(f"Unique counts for dict elements:\n{unique_count}")
-
-                for key in dict_df.columns:
-                    most_common_value = dict_df[key].mode()[0] if not dict_df[key].isnull().all() else None
-                    most_common_freq = dict_df[key].value_counts().max() if not dict_df[key].isnull().all() else 0
-                    logging.info(f"Key: {key}, Most common value: {most_common_value}, Frequency: {most_common_freq}")
-            else:
-                non_null_count = flat_list.notnull().sum()
-                unique_count = flat_list.nunique()
-                most_common_value = flat_list.mode()[0] if unique_count > 0 else None
-                most_common_freq = flat_list.value_counts().max() if unique_count > 0 else 0
-
-                logging.info(f"Non-null count: {non_null_count}")
-                logging.info(f"Unique count: {unique_count}")
-                logging.info(f"Most common value: {most_common_value}")
-                logging.info(f"Frequency of the most common value: {most_common_freq}")
+        if column in profile.keys:
+            keys = profile.keys[column]
+            unique_count = pd.Series({key: key_stats.unique() for key, key_stats in keys.items()})
+            logging.info(f"Unique counts for dict elements:\n{unique_count}")
 
+            for key, key_stats in keys.items():
+                log_key_stats(key, *key_stats.mode())
+                log_count_error(key_stats.counter.error)
         else:
-            non_null_count = data[column].notnull().sum()
-            unique_count = data[column].nunique()
-            most_common_value = data[column].mode()[0] if unique_count > 0 else None
-            most_common_freq = data[column].value_counts().max() if unique_count > 0 else 0
+            stats = profile.elements.get(column, stats)
+            log_value_stats(stats.count, stats.unique(), *stats.mode())
+            log_count_error(stats.counter.error)
 
-            logging.info(f"Non-null count: {non_null_count}")
-            logging.info(f"Unique count: {unique_count}")
-            logging.info(f"Most common value: {most_common_value}")
-            logging.info(f"Frequency of the most common value: {most_common_freq}")
+            if column not in profile.elements and stats.is_numeric:
+                logging.info(f"Statistics:\n{stats.describe().rename(column)}")
 
-            if pd.api.types.is_numeric_dtype(data[column]):
-                stats = data[column].describe()
-                logging.info(f"Statistics:\n{stats}")
+    return profile.summary()
 
 
-def generate_descriptive_stats(data):
+def log_value_stats(non_null_count, unique_count, most_common_value, most_common_freq):
+    """
+    Log the value statistics of a column.
+
+    Parameters:
+    non_null_count (int): Number of non-null values.
+    unique_count (int): Number of unique values.
+    most_common_value: The most common value, None if there are no values.
+    most_common_freq (int): Frequency of the most common value.
+    """
+    logging.info(f"Non-null count: {non_null_count}")
+    logging.info(f"Unique count: {unique_count}")
+    logging.info(f"Most common value: {most_common_value}")
+    logging.info(f"Frequency of the most common value: {most_common_freq}")
+
+
+def log_key_stats(key, most_common_value, most_common_freq):
+    """
+    Log the most common value of a key of the dicts in a list column.
+
+    Parameters:
+    key (str): The dict key.
+    most_common_value: The most common value, None if all values are null.
+    most_common_freq (int): Frequency of the most common value.
+    """
+    logging.info(f"Key: {key}, Most common value: {most_common_value}, Frequency: {most_common_freq}")
+
+
+def log_count_error(error):
+    """
+    Log the error bound of frequencies counted with pruning (distinct: hll), if any.
+
+    Parameters:
+    error (int): Error bound of the counter, see TopCounter.
+    """
+    if error:
+        logging.info(f"Frequencies are lower bounds, up to {error} below the true counts (top_k pruning)")
+
+
+@instrumented
+def generate_descriptive_stats(profile):
     """
     Generate and log descriptive statistics and missing values for the dataset.
 
     Parameters:
-    data (pd.DataFrame): The dataset to be analyzed.
+    profile (DatasetProfile): Profile of the dataset, from profile_data or profile_batches.
 
     Returns:
-    None
+    pd.DataFrame: The descriptive statistics, like data.describe(include='all').
     """
-    descriptive_stats = data.describe(include='all')
+    descriptive_stats = profile.describe()
     logging.info(f"Descriptive Statistics:\n{descriptive_stats}")
 
-    missing_values = data.isnull().sum()
+    missing_values = profile.missing_values()
     if missing_values.any():
         logging.debug(f"Missing Values:\n{missing_values}")
     else:
         logging.info("No missing values found.")
+    return descriptive_stats
 
 
 @hydra.main(version_base=None, config_path="../../configs/analysis_configs/", config_name="general_analysis_config")
+@instrumented_main
 def main(cfg: DictConfig):
     """
     Main function to execute the analysis based on the configuration.
@@ -121,31 +200,29 @@ def main(cfg: DictConfig):
     global_config = OmegaConf.load("configs/global_configs.yaml")
 
     # Global selection of data type: raw or processed
-    if global_config.data_type == 'raw':
-        file_path = 'data/raw/cocktail_dataset.json'
-    elif global_config.data_type == 'processed':
-        file_path = 'data/processed/processed_cocktail_dataset.json'
-    else:
+    file_path = input_dataset_path(global_config)
+    if file_path is None:
         logging.error("Invalid data type specified in global config. Use 'raw' or 'processed'.")
         return None
 
-    # Load data
-    if cfg.functions.load_data:
-        data = load_data(file_path)
-    else:
+    if not cfg.functions.load_data:
         logging.info("Data loading is disabled.")
         return None
 
-    if data is not None:
-        # Analyze general data if enabled
-        if cfg.functions.generate_descriptive_stats:
-            generate_descriptive_stats(data)
+    # The results are only logged, so hits replay their logs without unpickling them (and importing pandas)
+    cache = open_cache(global_config, cfg.refresh_cache, load_results=False)
+    context = cache.context(file_path, cfg, ANALYSIS_SOURCES)
 
-        # Analyze columns if enabled
-        if cfg.functions.analyze_columns:
-            analyze_columns(data)
-    else:
-        logging.error("No data to analyze.")
+    # The dataset is only loaded and profiled (batch by batch if enabled) if a result is not cached
+    profile = Lazy(lambda: build_profile(file_path, cfg))
+
+    # Analyze general data if enabled
+    if cfg.functions.generate_descriptive_stats:
+        cache.apply('generate_descriptive_stats', context, generate_descriptive_stats, profile)
+
+    # Analyze columns if enabled
+    if cfg.functions.analyze_columns:
+        cache.apply('analyze_columns', context, analyze_columns, profile)
 
 
 if __name__ == "__main__":
@@ -1,25 +1,50 @@
-import pandas as pd
+from __future__ import annotations
+
+import os
+import sys
+from dataclasses import dataclass
 import logging
 import hydra
 from omegaconf import DictConfig, OmegaConf
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.data_storage import input_dataset_path, iter_dataset_batches, read_dataset, write_dataset
+from utils.ingredient_index import read_aligned_index
+from utils.instrumentation import instrumented, instrumented_main
+from utils.result_cache import Lazy, open_cache
+from utils.lazy_imports import lazy_import
+from chunked_stats import DatasetProfile, field_options
+
+pd = lazy_import('pandas')
+
+# Editing these files invalidates the cached results of the analysis
+ANALYSIS_SOURCES = [__file__, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chunked_stats.py')]
+
+# Attributes of an ingredient kept by the report, the same for every use of the ingredient
+REPORT_ATTRIBUTES = ['name', 'alcohol', 'percentage']
+
+# Alcohol strength of the ingredients in the report: no percentage, 0%, up to the strong threshold, above it
+STRENGTHS = ['unknown', 'none', 'alcoholic', 'strong']
+
 # Configure logging with a custom format
 logging.basicConfig(level=logging.INFO,
                     format='%(levelname)s - %(message)s')
 
 
-def load_data(file_path):
+@instrumented
+def load_data(file_path, columns=None):
     """
-    Load JSON data from a specified file.
+    Load data from a specified JSON, Parquet or Arrow file.
 
     Parameters:
-    file_path (str): Path to the JSON file.
+    file_path (str): Path to the data file.
+    columns (list): Optional list of columns to load. All columns are loaded if None.
 
     Returns:
     pd.DataFrame: Loaded data as a DataFrame, or None if an error occurs.
     """
     try:
-        data = pd.read_json(file_path)
+        data = read_dataset(file_path, columns=columns)
         logging.debug("Data loaded successfully.")
         return data
     except Exception as e:
@@ -27,63 +52,255 @@ def load_data(file_path):
         return None
 
 
-def analyze_ingredients(data):
+def load_ingredient_index(file_path, global_config):
     """
-    Analyze ingredients and their properties.
+    Load the ingredient index written by simplify_data.py for the processed dataset.
+
+    Parameters:
+    file_path (str): Path to the data file.
+    global_config (DictConfig): The global configuration.
+
+    Returns:
+    IngredientIndex: The index aligned to the dataset, None for raw data or if there is no matching index.
+    """
+    if global_config.data_type != 'processed':
+        return None
+    ids = load_data(file_path, columns=['id'])
+    return read_aligned_index(ids['id'], file_path) if ids is not None else None
+
+
+def flatten_ingredients(ingredients_column):
+    """
+    Flatten the nested ingredients into one row per ingredient of a cocktail.
+
+    Parameters:
+    ingredients_column (pd.Series): Column with the list of ingredient dicts of every cocktail.
+
+    Returns:
+    pd.DataFrame: DataFrame of ingredients, or None if an ingredient is not a dict.
+    """
+    ingredients_flat = ingredients_column.explode().dropna()
+
+    # Ensure that ingredients are dictionaries to extract their attributes
+    if not ingredients_flat.apply(lambda x: isinstance(x, dict)).all():
+        return None
+    return pd.json_normalize(ingredients_flat.tolist())
+
+
+@instrumented
+def load_ingredients(file_path, global_config):
+    """
+    Load the ingredients of the dataset as one row per ingredient of a cocktail.
+
+    The ingredients are joined by id from the ingredient index written by
+    simplify_data.py if it matches the dataset, otherwise the nested
+    'ingredients' column is loaded and flattened.
 
     Parameters:
-    data (pd.DataFrame): DataFrame containing cocktail data.
+    file_path (str): Path to the data file.
+    global_config (DictConfig): The global configuration.
 
     Returns:
     pd.DataFrame: DataFrame of ingredients, or None if no valid data found.
     """
+    index = load_ingredient_index(file_path, global_config)
+    if index is not None:
+        return index.edges()
+
+    data = load_data(file_path, columns=['ingredients'])
+    if data is None:
+        logging.error("No data to analyze.")
+        return None
+
+    ingredients_df = flatten_ingredients(data['ingredients'])
+    if ingredients_df is None:
+        logging.warning("No valid ingredient dictionaries found.")
+    return ingredients_df
+
+
+@instrumented
+def analyze_ingredients(ingredients_df):
+    """
+    Analyze ingredients and their properties.
+
+    Parameters:
+    ingredients_df (pd.DataFrame): DataFrame of ingredients, see load_ingredients.
+
+    Returns:
+    pd.DataFrame: Basic statistics of the ingredient attributes.
+    """
     logging.debug("Analyzing ingredients used in cocktails...")
+    logging.debug(f"Available columns in ingredients_df: {ingredients_df.columns.tolist()}")
+    return log_ingredient_stats(ingredients_df.describe(include='all'))  # Include all data types
 
-    # Flatten the ingredients
-    ingredients_flat = data['ingredients'].explode().dropna()
 
-    # Ensure that ingredients are dictionaries to extract their attributes
-    if ingredients_flat.apply(lambda x: isinstance(x, dict)).all():
-        ingredients_df = pd.json_normalize(ingredients_flat)
+def log_ingredient_stats(stats):
+    """
+    Log the basic statistics of the ingredient attributes.
+
+    Parameters:
+    stats (pd.DataFrame): Statistics like ingredients_df.describe(include='all').
 
-        # Display basic statistics for ingredient attributes
-        logging.info("Basic statistics for ingredients:")
-        stats = ingredients_df.describe(include='all')  # Include all data types
-        logging.info(f"\n{stats}\n")  # Log stats
+    Returns:
+    pd.DataFrame: The statistics.
+    """
+    logging.info("Basic statistics for ingredients:")
+    logging.info(f"\n{stats}\n")
+    return stats
 
-        logging.debug(f"Available columns in ingredients_df: {ingredients_df.columns.tolist()}")
-        return ingredients_df  # Return the DataFrame for further analysis
-    else:
+
+@dataclass
+class IngredientSummary:
+    """
+    Ingredient data accumulated batch by batch by analyze_ingredients_chunked.
+
+    Every field is small compared to the dataset: the profile holds mergeable
+    aggregates and the frames hold one row per distinct ingredient.
+
+    Attributes:
+    profile (DatasetProfile): Profile of the ingredients (one row per ingredient of a cocktail).
+    ingredients (pd.DataFrame): The ingredients deduplicated by id, see aggregate_ingredients.
+    unique_names (pd.DataFrame): Unique ingredient names, in order of appearance.
+    """
+    profile: DatasetProfile
+    ingredients: pd.DataFrame
+    unique_names: pd.DataFrame
+
+
+@instrumented
+def analyze_ingredients_chunked(batches, **options):
+    """
+    Analyze ingredients and their properties batch by batch with bounded memory.
+
+    Parameters:
+    batches (iterable): Batches of flat ingredients (pd.DataFrame, see flatten_ingredients),
+                        None for a batch with invalid ingredients.
+    **options: Keyword arguments of FieldStats.
+
+    Returns:
+    IngredientSummary: The accumulated ingredient data, or None if no valid data found.
+    """
+    logging.debug("Analyzing ingredients used in cocktails batch by batch...")
+    profile = DatasetProfile(**options)
+    ingredients, unique_names = [], {}
+
+    for ingredients_df in batches:
+        if ingredients_df is None:
+            logging.warning("No valid ingredient dictionaries found.")
+            return None
+        if ingredients_df.empty:
+            continue
+
+        profile.update(ingredients_df)
+        unique_names.update(dict.fromkeys(ingredients_df['name'].dropna()))
+
+        # Keep one row per ingredient seen so far, the alcohol reports are built from them
+        ingredients = [merge_ingredient_aggregates(ingredients + [aggregate_ingredients(ingredients_df)])]
+
+    if not profile.n_rows:
         logging.warning("No valid ingredient dictionaries found.")
-        return None  # Return None if no valid data found
+        return None
 
+    return IngredientSummary(
+        profile=profile,
+        ingredients=ingredients[0],
+        unique_names=pd.DataFrame({'name': list(unique_names)}),
+    )
 
-def print_ingredients_without_alcohol(ingredients_df):
+
+def aggregate_ingredients(ingredients_df):
     """
-    Print ingredients that do not have assigned alcohol content (NaN).
+    Deduplicate the ingredients by id and count their uses.
+
+    The aggregates of several batches are combined with merge_ingredient_aggregates.
 
     Parameters:
-    ingredients_df (pd.DataFrame): DataFrame of ingredients.
+    ingredients_df (pd.DataFrame): DataFrame of ingredients, one row per ingredient of a cocktail.
+
+    Returns:
+    pd.DataFrame: One row per ingredient id with its REPORT_ATTRIBUTES and number of uses.
     """
-    # Filter for ingredients where 'alcohol' is NaN
-    missing_alcohol = ingredients_df[ingredients_df['alcohol'].isna()]
+    aggregations = {column: (column, 'first') for column in REPORT_ATTRIBUTES}
+    return ingredients_df.groupby('id', sort=False).agg(**aggregations, uses=('name', 'size')).reset_index()
 
-    # Print unique values in the 'alcohol' column
-    unique_alcohol_values = ingredients_df['alcohol'].unique()
-    logging.debug(unique_alcohol_values)
 
-    # Print the first few rows of the 'alcohol' column
-    logging.debug("First few values in 'alcohol' column:")
-    logging.debug(ingredients_df['alcohol'].head())
+def merge_ingredient_aggregates(aggregates):
+    """
+    Combine the aggregates of batches of ingredients.
 
-    if not missing_alcohol.empty:
-        logging.info("Ingredients without assigned alcohol content (NaN):")
-        for index, row in missing_alcohol.iterrows():
-            logging.info(f"ID: {row['id']}, Name: {row['name']}")
-    else:
-        logging.info("All ingredients have assigned alcohol content.")
+    Parameters:
+    aggregates (list): Aggregates from aggregate_ingredients.
+
+    Returns:
+    pd.DataFrame: One row per ingredient id with its REPORT_ATTRIBUTES and total number of uses.
+    """
+    aggregations = {column: (column, 'first') for column in REPORT_ATTRIBUTES}
+    return (pd.concat(aggregates, ignore_index=True).groupby('id', sort=False)
+            .agg(**aggregations, uses=('uses', 'sum')).reset_index())
+
+
+@instrumented
+def build_ingredient_report(ingredients, strong_threshold=30):
+    """
+    Classify every distinct ingredient by alcohol content in one vectorized pass.
+
+    Parameters:
+    ingredients (pd.DataFrame): The ingredients deduplicated by id, see aggregate_ingredients.
+    strong_threshold (float): Percentage above which an ingredient is strong.
+
+    Returns:
+    pd.DataFrame: One row per ingredient sorted by id, with its REPORT_ATTRIBUTES, 'uses',
+                  'missing_alcohol' (no assigned alcohol content) and 'strength' (one of STRENGTHS).
+    """
+    report = ingredients.sort_values('id', ignore_index=True)
+    report['missing_alcohol'] = report['alcohol'].isna()
+    percentage = pd.to_numeric(report['percentage'], errors='coerce')
+    strength = pd.cut(percentage, [-float('inf'), 0, strong_threshold, float('inf')], labels=STRENGTHS[1:])
+    report['strength'] = strength.cat.set_categories(STRENGTHS).fillna('unknown')
+    return report
+
+
+def log_report_section(section, title, empty_message, log_limit):
+    """
+    Log the size of a section of the ingredient report and its first ingredients.
+
+    Parameters:
+    section (pd.DataFrame): Rows of the ingredient report.
+    title (str): Logged before the ingredients.
+    empty_message (str): Logged instead if the section is empty.
+    log_limit (int): Number of ingredients listed.
+    """
+    if section.empty:
+        logging.info(empty_message)
+        return
+
+    logging.info(f"{title}: {len(section)} ingredients, used {int(section['uses'].sum())} times")
+    listed = section.head(log_limit)
+    for ingredient_id, name in zip(listed['id'], listed['name'].str.replace("ñ", "n")):
+        logging.info(f"ID: {ingredient_id}, Name: {name}")
+    if len(section) > log_limit:
+        logging.info(f"... and {len(section) - log_limit} more")
+
+
+@instrumented
+def print_ingredients_without_alcohol(report, log_limit=20):
+    """
+    Print ingredients that do not have assigned alcohol content (NaN).
+
+    Parameters:
+    report (pd.DataFrame): Ingredient report, see build_ingredient_report.
+    log_limit (int): Number of ingredients listed in the log.
+
+    Returns:
+    pd.DataFrame: The ingredients of the report without alcohol content.
+    """
+    missing_alcohol = report[report['missing_alcohol']]
+    log_report_section(missing_alcohol, "Ingredients without assigned alcohol content (NaN)",
+                       "All ingredients have assigned alcohol content.", log_limit)
+    return missing_alcohol
 
 
+@instrumented
 def print_unique_ingredients(ingredients_df):
     """
     Print unique ingredients in the dataset.
@@ -97,57 +314,122 @@ def print_unique_ingredients(ingredients_df):
     logging.info(f"Unique ingredients in the dataset: {unique_ingredients}")
 
 
-def print_strong_alcohol_ingredients(ingredients_df):
+@instrumented
+def print_strong_alcohol_ingredients(report, log_limit=20):
     """
     Print unique ingredients with a high alcohol content.
 
     Parameters:
-    ingredients_df (pd.DataFrame): DataFrame of ingredients.
+    report (pd.DataFrame): Ingredient report, see build_ingredient_report.
+    log_limit (int): Number of ingredients listed in the log.
+
+    Returns:
+    pd.DataFrame: The strong ingredients of the report.
     """
-    # Filter for ingredients where 'percentage' is high
-    strong_alcohol = ingredients_df[ingredients_df['percentage'] > 30]
+    strong_alcohol = report[report['strength'] == 'strong']
+    log_report_section(strong_alcohol, "Unique ingredients with high alcohol content",
+                       "No ingredients with high alcohol content found.", log_limit)
+    return strong_alcohol
 
-    if not strong_alcohol.empty:
-        logging.info("Unique ingredients with high alcohol content:")
 
-        # Replace 'ñ' with 'n' using .loc to avoid SettingWithCopyWarning
-        strong_alcohol.loc[:, 'name'] = strong_alcohol['name'].str.replace("ñ", "n")
+@instrumented
+def print_alcohol_ingredients(report, log_limit=20):
+    """
+    Print unique ingredients with any alcohol content.
 
-        # Get unique combinations of ID and Name
-        unique_ingredients = strong_alcohol[['id', 'name']].drop_duplicates()
+    Parameters:
+    report (pd.DataFrame): Ingredient report, see build_ingredient_report.
+    log_limit (int): Number of ingredients listed in the log.
 
-        for index, row in unique_ingredients.iterrows():
-            logging.info(f"ID: {row['id']}, Name: {row['name']}")
-    else:
-        logging.info("No ingredients with high alcohol content found.")
+    Returns:
+    pd.DataFrame: The ingredients of the report with a percentage above 0.
+    """
+    alcohol_ingredients = report[report['strength'].isin(['alcoholic', 'strong'])]
+    log_report_section(alcohol_ingredients, "Unique ingredients with alcohol content",
+                       "No ingredients with alcohol content found.", log_limit)
+    return alcohol_ingredients
 
 
-def print_alcohol_ingredients(ingredients_df):
+@instrumented
+def save_ingredient_report(report, output_path):
     """
-    Print unique ingredients with any alcohol content.
+    Write the ingredient report and log how many ingredients fall in every strength.
 
     Parameters:
-    ingredients_df (pd.DataFrame): DataFrame of ingredients.
+    report (pd.DataFrame): Ingredient report, see build_ingredient_report.
+    output_path (str): Parquet, Arrow or JSON file.
+    """
+    write_dataset(report, output_path)
+    strengths = ', '.join(f"{strength} {count}" for strength, count in
+                          report['strength'].value_counts(sort=False).items())
+    logging.info(f"Ingredient report of {len(report)} ingredients ({strengths}) written to {output_path}")
+
+
+def iter_ingredient_batches(file_path, batch_size, global_config):
     """
-    # Filter for ingredients where 'percentage' is greater than 0
-    alcohol_ingredients = ingredients_df[ingredients_df['percentage'] > 0]
+    Iterate over the ingredients of the dataset batch by batch of cocktails.
 
-    if not alcohol_ingredients.empty:
-        logging.info("Unique ingredients with alcohol content:")
+    Parameters:
+    file_path (str): Path to the dataset.
+    batch_size (int): Number of cocktails per batch.
+    global_config (DictConfig): The global configuration.
 
-        # Replace 'ñ' with 'n' using .loc to avoid SettingWithCopyWarning
-        alcohol_ingredients.loc[:, 'name'] = alcohol_ingredients['name'].str.replace("ñ", "n")
+    Yields:
+    pd.DataFrame: The flat ingredients of the next batch, None if a batch has invalid ingredients.
+    """
+    index = load_ingredient_index(file_path, global_config)
+    if index is not None:
+        yield from index.iter_edge_batches(batch_size)
+        return
+    for batch in iter_dataset_batches(file_path, batch_size, columns=['ingredients']):
+        yield flatten_ingredients(batch['ingredients'])
 
-        # Get unique combinations of ID and Name
-        unique_ingredients = alcohol_ingredients[['id', 'name']].drop_duplicates()
 
-        for index, row in unique_ingredients.iterrows():
-            logging.info(f"ID: {row['id']}, Name: {row['name']}")
-    else:
-        logging.info("No ingredients with alcohol content found.")
+@instrumented
+def run_chunked_analysis(file_path, cfg, global_config, cache, context):
+    """
+    Run the enabled ingredient analyses batch by batch.
+
+    The alcohol reports are built from the ingredients of the IngredientSummary,
+    already deduplicated by id, and log the same results as in memory.
+
+    Parameters:
+    file_path (str): Path to the dataset.
+    cfg (DictConfig): Configuration object from Hydra.
+    global_config (DictConfig): The global configuration.
+    cache (ResultCache): Cache of the analysis results.
+    context (dict): Cache context of the analysis.
+    """
+    if not cfg.functions.analyze_ingredients:
+        logging.info("Ingredient analysis is disabled.")
+        return
+
+    # The dataset is only read if a result is not cached
+    summary = Lazy(lambda: analyze_ingredients_chunked(
+        iter_ingredient_batches(file_path, cfg.chunked.batch_size, global_config), **field_options(cfg.chunked)))
+    report = Lazy(lambda: build_ingredient_report(summary().ingredients, cfg.report.strong_threshold)
+                  if summary() is not None else None)
+
+    cache.apply('analyze_ingredients', context, lambda summary: log_ingredient_stats(summary.profile.describe()),
+                summary)
+    if cfg.functions.print_ingredients_without_alcohol:
+        cache.apply('print_ingredients_without_alcohol', context,
+                    lambda report: print_ingredients_without_alcohol(report, cfg.report.log_limit), report)
+    if cfg.functions.print_unique_ingredients:
+        cache.apply('print_unique_ingredients', context,
+                    lambda summary: print_unique_ingredients(summary.unique_names), summary)
+    if cfg.functions.print_strong_alcohol_ingredients:
+        cache.apply('print_strong_alcohol_ingredients', context,
+                    lambda report: print_strong_alcohol_ingredients(report, cfg.report.log_limit), report)
+    if cfg.functions.print_alcohol_ingredients:
+        cache.apply('print_alcohol_ingredients', context,
+                    lambda report: print_alcohol_ingredients(report, cfg.report.log_limit), report)
+    if cfg.report.output_path and report() is not None:
+        save_ingredient_report(report(), cfg.report.output_path)
 
 
 @hydra.main(version_base=None, config_path="../../configs/analysis_configs", config_name="ingredient_analysis_config")
+@instrumented_main
 def main(cfg: DictConfig):
     """
     Main function to execute the analysis based on the configuration.
@@ -159,54 +441,67 @@ def main(cfg: DictConfig):
     global_config = OmegaConf.load("configs/global_configs.yaml")
 
     # Global selection of data type: raw or processed
-    if global_config.data_type == 'raw':
-        file_path = 'data/raw/cocktail_dataset.json'
-    elif global_config.data_type == 'processed':
-        file_path = 'data/processed/processed_cocktail_dataset.json'
-    else:
+    file_path = input_dataset_path(global_config)
+    if file_path is None:
         logging.error("Invalid data type specified in global config. Use 'raw' or 'processed'.")
         return None
 
-    # Load data if enabled in config
-    if cfg.functions.load_data:
-        data = load_data(file_path)
-    else:
+    if not cfg.functions.load_data:
         logging.info("Data loading is disabled.")
         return None
 
-    if data is not None:
-        # Analyze ingredients if enabled in config
-        if cfg.functions.analyze_ingredients:
-            ingredients_df = analyze_ingredients(data)
-        else:
-            ingredients_df = None
-            logging.info("Ingredient analysis is disabled.")
-
-        # Print ingredients without alcohol if enabled in config
-        if ingredients_df is not None and cfg.functions.print_ingredients_without_alcohol:
-            print_ingredients_without_alcohol(ingredients_df)
-        else:
-            logging.info("Printing ingredients without alcohol is disabled or no valid ingredient data.")
-
-        # Print unique ingredients if enabled in config
-        if ingredients_df is not None and cfg.functions.print_unique_ingredients:
-            print_unique_ingredients(ingredients_df)
-        else:
-            logging.info("Printing unique ingredients is disabled or no valid ingredient data.")
-
-        # Print ingredients with high alcohol content if enabled in config
-        if ingredients_df is not None and cfg.functions.print_strong_alcohol_ingredients:
-            print_strong_alcohol_ingredients(ingredients_df)
-        else:
-            logging.info("Printing ingredients with high alcohol content is disabled or no valid ingredient data.")
-
-        # Print ingredients with any alcohol content if enabled in config
-        if ingredients_df is not None and cfg.functions.print_strong_alcohol_ingredients:
-            print_alcohol_ingredients(ingredients_df)
-        else:
-            logging.info("Printing ingredients with alcohol content is disabled or no valid ingredient data.")
+    # The results are only logged, so hits replay their logs without unpickling them (and importing pandas)
+    cache = open_cache(global_config, cfg.refresh_cache, load_results=False)
+    context = cache.context(file_path, cfg, ANALYSIS_SOURCES)
+
+    # Analyze the ingredients batch by batch instead of loading the data if enabled
+    if cfg.chunked.enabled:
+        run_chunked_analysis(file_path, cfg, global_config, cache, context)
+        return None
+
+    # Load the ingredients if enabled in config, only if a result is not cached
+    ingredients_df = Lazy(lambda: load_ingredients(file_path, global_config))
+    # The alcohol reports share one report of the ingredients deduplicated by id
+    report = Lazy(lambda: build_ingredient_report(aggregate_ingredients(ingredients_df()), cfg.report.strong_threshold)
+                  if ingredients_df() is not None else None)
+    analyzed = cfg.functions.analyze_ingredients
+
+    # Analyze ingredients if enabled in config
+    if analyzed:
+        cache.apply('analyze_ingredients', context, analyze_ingredients, ingredients_df)
     else:
-        logging.error("No data to analyze.")
+        logging.info("Ingredient analysis is disabled.")
+
+    # Print ingredients without alcohol if enabled in config
+    if analyzed and cfg.functions.print_ingredients_without_alcohol:
+        cache.apply('print_ingredients_without_alcohol', context,
+                    lambda report: print_ingredients_without_alcohol(report, cfg.report.log_limit), report)
+    else:
+        logging.info("Printing ingredients without alcohol is disabled or no valid ingredient data.")
+
+    # Print unique ingredients if enabled in config
+    if analyzed and cfg.functions.print_unique_ingredients:
+        cache.apply('print_unique_ingredients', context, print_unique_ingredients, ingredients_df)
+    else:
+        logging.info("Printing unique ingredients is disabled or no valid ingredient data.")
+
+    # Print ingredients with high alcohol content if enabled in config
+    if analyzed and cfg.functions.print_strong_alcohol_ingredients:
+        cache.apply('print_strong_alcohol_ingredients', context,
+                    lambda report: print_strong_alcohol_ingredients(report, cfg.report.log_limit), report)
+    else:
+        logging.info("Printing ingredients with high alcohol content is disabled or no valid ingredient data.")
+
+    # Print ingredients with any alcohol content if enabled in config
+    if analyzed and cfg.functions.print_alcohol_ingredients:
+        cache.apply('print_alcohol_ingredients', context,
+                    lambda report: print_alcohol_ingredients(report, cfg.report.log_limit), report)
+    else:
+        logging.info("Printing ingredients with alcohol content is disabled or no valid ingredient data.")
+
+    # Write the ingredient report if a path is set
+    if analyzed and cfg.report.output_path and report() is not None:
+        save_ingredient_report(report(), cfg.report.output_path)
 
 
 if __name__ == "__main__":
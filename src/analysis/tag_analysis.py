@@ -1,25 +1,42 @@
-import pandas as pd
+from __future__ import annotations
+
+import os
+import sys
 import logging
 import hydra
 from omegaconf import DictConfig, OmegaConf
 from collections import Counter
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.data_storage import input_dataset_path, iter_dataset_batches, read_dataset
+from utils.instrumentation import instrumented, instrumented_main
+from utils.result_cache import Lazy, open_cache
+from utils.lazy_imports import lazy_import
+from chunked_stats import FieldStats, field_options
+
+pd = lazy_import('pandas')
+
+# Editing these files invalidates the cached results of the analysis
+ANALYSIS_SOURCES = [__file__, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chunked_stats.py')]
+
 # Configure logging with a custom format
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
 
 
-def load_data(file_path: str) -> pd.DataFrame:
+@instrumented
+def load_data(file_path: str, columns: list = None) -> pd.DataFrame:
     """
-    Load JSON data from a specified file.
+    Load data from a specified JSON, Parquet or Arrow file.
 
     Parameters:
-    file_path (str): The path to the JSON file.
+    file_path (str): The path to the data file.
+    columns (list): Optional list of columns to load. All columns are loaded if None.
 
     Returns:
     pd.DataFrame: The loaded data as a DataFrame, or None if an error occurs.
     """
     try:
-        data = pd.read_json(file_path)
+        data = read_dataset(file_path, columns=columns)
         logging.info("Data loaded successfully.")
         return data
     except Exception as e:
@@ -27,6 +44,7 @@ def load_data(file_path: str) -> pd.DataFrame:
         return None
 
 
+@instrumented
 def analyze_tags(data: pd.DataFrame) -> pd.Series:
     """
     Analyze tags and print unique values.
@@ -48,23 +66,90 @@ def analyze_tags(data: pd.DataFrame) -> pd.Series:
     return unique_tags
 
 
-def tag_counter(data: pd.DataFrame):
+@instrumented
+def tag_counter(data: pd.DataFrame) -> Counter:
     """
     Count the occurrences of each tag and print the results.
 
     Parameters:
     data (pd.DataFrame): The DataFrame containing the data.
+
+    Returns:
+    Counter: Tag -> number of occurrences.
     """
     tag_counts = Counter()
     for tags in data['tags']:
         tag_counts.update(tags)
-    
+
+    log_tag_counts(tag_counts)
+    return tag_counts
+
+
+def log_tag_counts(tag_counts):
+    """
+    Log the number of occurrences of each tag.
+
+    Parameters:
+    tag_counts (dict): Tag -> number of occurrences.
+    """
     # Convert to DataFrame for better visualization
     tag_counts_df = pd.DataFrame(tag_counts.items(), columns=['Tag', 'Count'])
     logging.info("Tag counts:\n" + tag_counts_df.to_string(index=False))
 
 
+@instrumented
+def count_tags_chunked(batches, **options):
+    """
+    Count the tags batch by batch with bounded memory.
+
+    Parameters:
+    batches (iterable): Batches of rows (pd.DataFrame) with a 'tags' column.
+    **options: Keyword arguments of FieldStats.
+
+    Returns:
+    FieldStats: Statistics of the tags, its counter holds the count of every tag in order of appearance.
+    """
+    tag_stats = FieldStats(**options)
+    for batch in batches:
+        tag_stats.update(batch['tags'].explode())
+    return tag_stats
+
+
+def tag_counter_chunked(tag_stats: FieldStats) -> dict:
+    """
+    Print the occurrences of each tag counted by count_tags_chunked.
+
+    Parameters:
+    tag_stats (FieldStats): Statistics of the tags.
+
+    Returns:
+    dict: Tag -> number of occurrences.
+    """
+    log_tag_counts(tag_stats.counter.counts)
+    if tag_stats.counter.error:
+        logging.info(f"Tag counts are lower bounds, up to {tag_stats.counter.error} below the true counts "
+                     f"(top_k pruning)")
+    return dict(tag_stats.counter.counts)
+
+
+def analyze_tags_chunked(tag_stats: FieldStats) -> list:
+    """
+    Print the unique tags counted by count_tags_chunked, like analyze_tags.
+
+    Parameters:
+    tag_stats (FieldStats): Statistics of the tags.
+
+    Returns:
+    list: The unique tags, in order of appearance.
+    """
+    logging.info("Analyzing tags used in cocktails...")
+    unique_tags = list(tag_stats.counter.counts)
+    logging.info(f"Unique tags in the dataset: {unique_tags}")
+    return unique_tags
+
+
 @hydra.main(version_base=None, config_path="../../configs/analysis_configs", config_name="tag_analysis_config")
+@instrumented_main
 def main(cfg: DictConfig):
     """
     Main function to execute the tag analysis.
@@ -75,28 +160,39 @@ def main(cfg: DictConfig):
     # Load global config (data_type)
     global_config = OmegaConf.load("configs/global_configs.yaml")
 
-    if global_config.data_type == 'raw':
-        file_path = 'data/raw/cocktail_dataset.json'
-    elif global_config.data_type == 'processed':
-        file_path = 'data/processed/processed_cocktail_dataset.json'
-    else:
+    file_path = input_dataset_path(global_config)
+    if file_path is None:
         logging.error("Invalid data type specified in global config. Use 'raw' or 'processed'.")
         return None
 
-    # Load data if enabled in config
-    if cfg.functions.load_data:
-        data = load_data(file_path)
-    else:
+    if not cfg.functions.load_data:
         logging.info("Data loading is disabled.")
         return None
-    
-    if data is not None and cfg.functions.tag_counter:
-        tag_counter(data)
+
+    # The results are only logged, so hits replay their logs without unpickling them (and importing pandas)
+    cache = open_cache(global_config, cfg.refresh_cache, load_results=False)
+    context = cache.context(file_path, cfg, ANALYSIS_SOURCES)
+
+    # Count the tags batch by batch instead of loading the data if enabled
+    if cfg.chunked.enabled:
+        tag_stats = Lazy(lambda: count_tags_chunked(
+            iter_dataset_batches(file_path, cfg.chunked.batch_size, columns=['tags']), **field_options(cfg.chunked)))
+        if cfg.functions.tag_counter:
+            cache.apply('tag_counter', context, tag_counter_chunked, tag_stats)
+        if cfg.functions.analyze_tags:
+            cache.apply('analyze_tags', context, analyze_tags_chunked, tag_stats)
+        return None
+
+    # Load data if enabled in config, only if a result is not cached
+    data = Lazy(lambda: load_data(file_path, columns=['tags']))
+
+    if cfg.functions.tag_counter:
+        cache.apply('tag_counter', context, tag_counter, data)
     else:
         logging.info("Tag counting is disabled or no valid data found.")
 
-    if data is not None and cfg.functions.analyze_tags:
-        analyze_tags(data)
+    if cfg.functions.analyze_tags:
+        cache.apply('analyze_tags', context, analyze_tags, data)
     else:
         logging.info("Tag analysis is disabled or no valid data found.")
 
@@ -0,0 +1,77 @@
+import os
+import sys
+import runpy
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(SRC_DIR)
+
+# Entry point script (relative to the repository) and description of every command
+COMMANDS = {
+    'simplify': ('src/preprocessing_scripts/simplify_data.py', "Simplify the raw dataset"),
+    'tagging': ('src/preprocessing_scripts/tagging_script.py', "Tag the cocktails from their ingredients"),
+    'one_hot': ('src/preprocessing_scripts/one_hot_encode_tags.py', "One-hot encode the tags"),
+    'clustering': ('src/clustering/clustering.py', "Cluster the cocktails and save the cluster model"),
+    'predict': ('src/clustering/predict_clusters.py', "Assign new cocktails to the saved clusters"),
+    'pipeline': ('src/pipeline/run_pipeline.py', "Run the preprocessing and clustering stages"),
+    'general_analysis': ('src/analysis/general_analysis.py', "Describe the columns of the dataset"),
+    'tag_analysis': ('src/analysis/tag_analysis.py', "Count the tags"),
+    'ingredient_analysis': ('src/analysis/ingredients_analysis.py', "Analyze the ingredients"),
+    'similarity': ('src/similarity/similarity_index.py', "Find similar cocktails"),
+    'query': ('src/query/query_index.py', "Run boolean queries over ingredients and tags"),
+    'cooccurrence': ('src/cooccurrence/cooccurrence_matrix.py', "Count the ingredients and tags found together"),
+    'association_rules': ('src/cooccurrence/association_rules.py', "Mine frequent ingredient sets and rules"),
+    'benchmark': ('benchmarks/run_benchmarks.py', "Benchmark the stages on synthetic catalogs"),
+    'startup_benchmark': ('benchmarks/startup_benchmark.py', "Check the startup time of the commands"),
+}
+
+
+def usage():
+    """Describe the commands, without importing any of them."""
+    width = max(map(len, COMMANDS))
+    lines = ["Usage: python src/cli.py <command> [hydra overrides]", "", "Commands:"]
+    lines += [f"  {name:<{width}}  {description}" for name, (_, description) in COMMANDS.items()]
+    lines += ["", "Run 'python src/cli.py <command> --help' for the config of a command."]
+    return '\n'.join(lines)
+
+
+def run(command, arguments):
+    """
+    Run the entry point of a command as if it was started directly.
+
+    Only the modules of that entry point are imported, so a command does not
+    pay the import time of the libraries used by the others.
+
+    Parameters:
+    command (str): Name of the command, a key of COMMANDS.
+    arguments (list): Command line arguments passed to the entry point (Hydra overrides).
+    """
+    script = os.path.join(REPO_DIR, COMMANDS[command][0])
+    sys.argv = [script] + list(arguments)
+    # Like 'python <script>', the directory of the script replaces the one of this file on the path
+    sys.path[0] = os.path.dirname(script)
+    runpy.run_path(script, run_name='__main__')
+
+
+def main(argv=None):
+    """
+    Dispatch to the entry point named by the first argument.
+
+    Parameters:
+    argv (list): Command line arguments, sys.argv[1:] if None.
+
+    Returns:
+    int: Exit status.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0
+    if argv[0] not in COMMANDS:
+        print(f"Unknown command '{argv[0]}'.\n\n{usage()}", file=sys.stderr)
+        return 2
+    run(argv[0], argv[1:])
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+import logging
+
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+metrics = lazy_import('sklearn.metrics')
+
+logger = logging.getLogger(__name__)
+
+# Evaluation methods available in clustering_config.yaml (clustering.evaluation.method)
+EVALUATION_METHODS = ['silhouette', 'sampled_silhouette', 'chunked_silhouette', 'calinski_harabasz', 'davies_bouldin']
+
+# Methods where a lower score means a better clustering
+LOWER_IS_BETTER = {'davies_bouldin'}
+
+
+def stratified_sample(labels, sample_size, rng):
+    """
+    Draw a sample of row indices with the same cluster proportions as labels.
+
+    Every cluster keeps at least two rows (if it has them), so each sampled
+    cluster has a defined silhouette.
+
+    Parameters:
+    labels (np.ndarray): Cluster label of every row.
+    sample_size (int): Approximate number of rows to draw.
+    rng (np.random.Generator): Random generator.
+
+    Returns:
+    np.ndarray: Sorted row indices.
+    """
+    clusters, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    fraction = min(1.0, sample_size / len(labels))
+    order = np.argsort(inverse, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    sample = []
+    for start, count in zip(starts, counts):
+        size = min(count, max(2, int(round(count * fraction))))
+        sample.append(rng.choice(order[start:start + count], size=size, replace=False))
+    return np.sort(np.concatenate(sample))
+
+
+def sampled_silhouette(features, labels, sample_size=10000, n_samples=10, random_state=0):
+    """
+    Estimate the silhouette score on stratified samples.
+
+    The score is computed on n_samples independent stratified samples, the
+    estimate is their mean with a 95% confidence interval.
+
+    Parameters:
+    features (np.ndarray): Feature array.
+    labels (np.ndarray): Cluster label of every row.
+    sample_size (int): Rows per sample.
+    n_samples (int): Number of samples.
+    random_state (int): Seed of the random generator.
+
+    Returns:
+    tuple: (mean, (low, high)) - estimated score and its 95% confidence interval.
+    """
+    if len(labels) <= sample_size:
+        score = metrics.silhouette_score(features, labels)
+        return score, (score, score)
+
+    rng = np.random.default_rng(random_state)
+    scores = []
+    for _ in range(n_samples):
+        rows = stratified_sample(labels, sample_size, rng)
+        scores.append(metrics.silhouette_score(features[rows], labels[rows]))
+
+    scores = np.asarray(scores)
+    margin = 1.96 * scores.std(ddof=1) / np.sqrt(len(scores)) if len(scores) > 1 else 0.0
+    return scores.mean(), (scores.mean() - margin, scores.mean() + margin)
+
+
+def chunked_silhouette(features, labels, max_memory_mb=256):
+    """
+    Compute the exact silhouette score, streaming distances in blocks.
+
+    Identical rows (common with one-hot tags) are collapsed into unique points
+    weighted by their count, then the Euclidean distances from a block of unique
+    points to all unique points are computed at a time. A block never exceeds
+    max_memory_mb, so memory stays bounded for any number of rows.
+
+    Parameters:
+    features (np.ndarray): Feature array.
+    labels (np.ndarray): Cluster label of every row.
+    max_memory_mb (int): Memory cap of one distance block.
+
+    Returns:
+    float: Silhouette score, equal to sklearn's silhouette_score.
+    """
+    labels = np.asarray(labels)
+    clusters, label_codes = np.unique(labels, return_inverse=True)
+    if not 1 < len(clusters) < len(labels):
+        raise ValueError("Number of labels must be between 2 and n_samples - 1.")
+
+    # Collapse identical (row, label) pairs into weighted unique points
+    keyed = np.column_stack([features, label_codes]).astype(np.float64)
+    unique, counts = np.unique(keyed, axis=0, return_counts=True)
+    points, point_labels = unique[:, :-1], unique[:, -1].astype(np.int64)
+
+    # Number of rows of every cluster reachable from each unique point
+    weights = np.zeros((len(points), len(clusters)))
+    weights[np.arange(len(points)), point_labels] = counts
+    cluster_sizes = weights.sum(axis=0)
+
+    squared_norms = (points ** 2).sum(axis=1)
+    block_rows = max(1, int(max_memory_mb * 2 ** 20 // (8 * len(points) * 2)))
+
+    total = 0.0
+    for start in range(0, len(points), block_rows):
+        block = slice(start, start + block_rows)
+        distances = squared_norms[block, None] - 2 * points[block] @ points.T + squared_norms[None, :]
+        np.sqrt(np.maximum(distances, 0, out=distances), out=distances)
+        cluster_distances = distances @ weights
+
+        own = point_labels[block]
+        rows = np.arange(len(own))
+        own_sizes = cluster_sizes[own]
+
+        # Mean distance to the other points of the own cluster (the point itself is at distance 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            intra = cluster_distances[rows, own] / (own_sizes - 1)
+            mean_distances = cluster_distances / cluster_sizes
+        mean_distances[rows, own] = np.inf
+        nearest = mean_distances.min(axis=1)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scores = (nearest - intra) / np.maximum(intra, nearest)
+        # Points of single-element clusters have a silhouette of 0
+        scores = np.where(own_sizes > 1, np.nan_to_num(scores), 0.0)
+        total += (scores * counts[block]).sum()
+
+    return total / len(labels)
+
+
+def score_clustering(features, labels, method='silhouette', sample_size=10000, n_samples=10,
+                     max_memory_mb=256, random_state=0):
+    """
+    Score a clustering with the configured evaluation method.
+
+    Parameters:
+    features (np.ndarray): Feature array.
+    labels (np.ndarray): Cluster label of every row.
+    method (str): One of EVALUATION_METHODS.
+    sample_size (int): Rows per sample for 'sampled_silhouette'.
+    n_samples (int): Number of samples for 'sampled_silhouette'.
+    max_memory_mb (int): Memory cap of one distance block for 'chunked_silhouette'.
+    random_state (int): Seed for 'sampled_silhouette'.
+
+    Returns:
+    float: The score. Lower is better for methods in LOWER_IS_BETTER, higher otherwise.
+    """
+    if method == 'silhouette':
+        return metrics.silhouette_score(features, labels)
+    if method == 'sampled_silhouette':
+        score, (low, high) = sampled_silhouette(features, labels, sample_size, n_samples, random_state)
+        logger.debug(f"Sampled silhouette {score:.4f}, 95% CI [{low:.4f}, {high:.4f}]")
+        return score
+    if method == 'chunked_silhouette':
+        return chunked_silhouette(features, labels, max_memory_mb)
+    if method == 'calinski_harabasz':
+        return metrics.calinski_harabasz_score(features, labels)
+    if method == 'davies_bouldin':
+        return metrics.davies_bouldin_score(features, labels)
+    raise ValueError(f"Unknown evaluation method '{method}'. Use one of {EVALUATION_METHODS}.")
+
+
+def is_better(score, best_score, method='silhouette'):
+    """
+    Check whether a score beats the best score so far for the given method.
+
+    Parameters:
+    score (float): Candidate score.
+    best_score (float): Best score so far, None if there is none.
+    method (str): One of EVALUATION_METHODS.
+
+    Returns:
+    bool: True if score is strictly better.
+    """
+    if best_score is None:
+        return True
+    return score < best_score if method in LOWER_IS_BETTER else score > best_score
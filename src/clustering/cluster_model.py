@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import os
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from omegaconf import OmegaConf
+
+from utils.data_storage import iter_row_batches
+from utils.incremental import stable_hash
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_MODEL = 'data/processed/cluster_model'
+
+# Layout of the files of a model version, bumped when it changes
+MODEL_FORMAT_VERSION = 2
+
+# Name of the file holding the version used when none is requested
+CURRENT_FILE = 'CURRENT'
+
+MODEL_ARRAYS = ['scale', 'offset', 'centers']
+
+# Sections of the tagging config that change the assigned tags, the mode only changes how they are computed
+TAGGING_SECTIONS = ('functions', 'tags_definitions')
+
+
+@dataclass
+class ClusterModel:
+    """
+    Fitted feature transform and K-means centroids, assigning new cocktails to clusters without refitting.
+
+    The MinMaxScaler and the tag weights both scale every column independently,
+    so they are folded into one affine transform: features = one_hot * scale + offset.
+
+    Attributes:
+    columns (list): Tag name of every column of the one-hot features (None for unused positions).
+    scale (np.ndarray): float32 scale of every column, scaler.scale_ * weights.
+    offset (np.ndarray): float32 offset of every column, scaler.min_ * weights.
+    centers (np.ndarray): float32 K-means centroids, one row per cluster.
+    algorithm (str): Clustering algorithm the centroids were fitted with.
+    tagging (str): Hash of the tagging config the clustered tags were assigned with, see tagging_fingerprint.
+    version (str): Content hash of the model, set when it is written or read.
+    created_at (str): Time the model was written, ISO 8601 in UTC.
+    """
+    columns: list
+    scale: np.ndarray
+    offset: np.ndarray
+    centers: np.ndarray
+    algorithm: str = 'kmeans'
+    tagging: str = None
+    version: str = None
+    created_at: str = None
+
+    def __post_init__(self):
+        # ||center||², the row norms are the same for every center and not needed for the argmin
+        self._center_norms = np.einsum('ij,ij->i', self.centers, self.centers)
+
+    @property
+    def n_clusters(self):
+        return len(self.centers)
+
+    @property
+    def tags_indices(self):
+        """Column index of every tag, like tags_indices in one_hot_encoding_config.yaml."""
+        return {tag: index for index, tag in enumerate(self.columns) if tag is not None}
+
+    def transform(self, tags_matrix):
+        """
+        Normalize and weight one-hot encoded tags like the clustered features.
+
+        Parameters:
+        tags_matrix (scipy.sparse.csr_matrix): One-hot encoded tags with the columns of the model.
+
+        Returns:
+        np.ndarray: float32 features, one row per cocktail.
+        """
+        if tags_matrix.shape[1] != len(self.columns):
+            raise ValueError(f"Expected {len(self.columns)} tag columns, got {tags_matrix.shape[1]}.")
+        features = np.ascontiguousarray(tags_matrix.astype(np.float32).toarray())
+        features *= self.scale
+        features += self.offset
+        return features
+
+    def predict(self, tags_matrix, batch_size=65536):
+        """
+        Assign every row of a one-hot matrix to its nearest K-means centroid.
+
+        Parameters:
+        tags_matrix (scipy.sparse.csr_matrix): One-hot encoded tags, in memory or memory-mapped.
+        batch_size (int): Rows transformed at once.
+
+        Returns:
+        np.ndarray: K-means cluster of every row.
+        """
+        labels = np.empty(tags_matrix.shape[0], dtype=np.int32)
+        for start, batch in zip(range(0, tags_matrix.shape[0], batch_size), iter_row_batches(tags_matrix, batch_size)):
+            distances = self._center_norms - 2 * (self.transform(batch) @ self.centers.T)
+            labels[start:start + batch.shape[0]] = distances.argmin(axis=1)
+        return labels
+
+
+def tagging_fingerprint(tagging_cfg):
+    """
+    Hash of the sections of a tagging config that change the assigned tags.
+
+    Parameters:
+    tagging_cfg (DictConfig): The tagging configuration.
+
+    Returns:
+    str: 16 character hex digest.
+    """
+    return stable_hash({section: OmegaConf.to_container(tagging_cfg[section], resolve=True)
+                        for section in TAGGING_SECTIONS})
+
+
+def build_cluster_model(scaler, weights, kmeans, columns, algorithm='kmeans', tagging=None):
+    """
+    Collect the fitted parts of a clustering run into a ClusterModel.
+
+    Parameters:
+    scaler (MinMaxScaler): Scaler fitted on the one-hot encoded tags.
+    weights (list): Weight of every tag.
+    kmeans (KMeans or MiniBatchKMeans): The fitted K-means model.
+    columns (list): Tag name of every column.
+    algorithm (str): Clustering algorithm, 'kmeans' or 'minibatch'.
+    tagging (str): tagging_fingerprint of the tagging config the tags were assigned with.
+
+    Returns:
+    ClusterModel: The model.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    return ClusterModel(
+        columns=list(columns),
+        scale=(scaler.scale_ * weights).astype(np.float32),
+        offset=(scaler.min_ * weights).astype(np.float32),
+        centers=np.ascontiguousarray(kmeans.cluster_centers_, dtype=np.float32),
+        algorithm=algorithm,
+        tagging=tagging,
+    )
+
+
+def model_version(model):
+    """
+    Content hash of a model, identical models get the same version.
+
+    Parameters:
+    model (ClusterModel): The model.
+
+    Returns:
+    str: 16 character hex digest.
+    """
+    return stable_hash({'format': MODEL_FORMAT_VERSION, 'columns': model.columns, 'algorithm': model.algorithm,
+                        'tagging': model.tagging, **{name: getattr(model, name).tolist() for name in MODEL_ARRAYS}})
+
+
+def write_cluster_model(model, directory=CLUSTER_MODEL):
+    """
+    Write a model as a new version and make it the current one.
+
+    Every version is kept in its own subdirectory, so a consumer can pin the
+    version its labels were produced with while newer models are written.
+
+    Parameters:
+    model (ClusterModel): The model.
+    directory (str): Directory of the model versions.
+
+    Returns:
+    str: The version written.
+    """
+    model.version = model_version(model)
+    model.created_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    version_dir = os.path.join(directory, model.version)
+    os.makedirs(version_dir, exist_ok=True)
+    for name in MODEL_ARRAYS:
+        np.save(os.path.join(version_dir, f"{name}.npy"), getattr(model, name))
+
+    # meta.json is written last, a version without it is incomplete
+    with open(os.path.join(version_dir, 'meta.json'), 'w') as meta_file:
+        json.dump({
+            'format_version': MODEL_FORMAT_VERSION,
+            'version': model.version,
+            'created_at': model.created_at,
+            'algorithm': model.algorithm,
+            'n_clusters': model.n_clusters,
+            'columns': model.columns,
+            'tagging': model.tagging,
+        }, meta_file, indent=4)
+
+    current = os.path.join(directory, CURRENT_FILE)
+    with open(current + '.tmp', 'w') as current_file:
+        current_file.write(model.version)
+    os.replace(current + '.tmp', current)
+
+    logger.info("Cluster model %s with %d clusters written to %s", model.version, model.n_clusters, version_dir)
+    return model.version
+
+
+def read_cluster_model(directory=CLUSTER_MODEL, version=None):
+    """
+    Load a model written by write_cluster_model.
+
+    Parameters:
+    directory (str): Directory of the model versions.
+    version (str): Version to load, the current one if None.
+
+    Returns:
+    ClusterModel: The model.
+    """
+    if version is None:
+        current = os.path.join(directory, CURRENT_FILE)
+        if not os.path.exists(current):
+            raise FileNotFoundError(f"No cluster model in {directory}. Run clustering.py first.")
+        with open(current) as current_file:
+            version = current_file.read().strip()
+
+    version_dir = os.path.join(directory, version)
+    with open(os.path.join(version_dir, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+    if meta['format_version'] != MODEL_FORMAT_VERSION:
+        raise ValueError(f"Cluster model {version} has format version {meta['format_version']}, "
+                         f"expected {MODEL_FORMAT_VERSION}. Rerun clustering.py.")
+
+    return ClusterModel(
+        columns=meta['columns'],
+        algorithm=meta['algorithm'],
+        tagging=meta['tagging'],
+        version=meta['version'],
+        created_at=meta['created_at'],
+        **{name: np.load(os.path.join(version_dir, f"{name}.npy")) for name in MODEL_ARRAYS},
+    )
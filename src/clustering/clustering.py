@@ -1,12 +1,32 @@
-import pandas as pd
-from sklearn.cluster import KMeans, AgglomerativeClustering
-from sklearn.metrics import silhouette_score
-from sklearn.preprocessing import MinMaxScaler
+from __future__ import annotations
+
+import os
+import sys
+import time
+from dataclasses import dataclass
+from functools import partial
 from omegaconf import OmegaConf
 import hydra
 import warnings
 import logging
 
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from cluster_evaluation import is_better, score_clustering
+from cluster_model import build_cluster_model, tagging_fingerprint, write_cluster_model
+from utils.data_storage import (CLUSTERED_DATASET, PROCESSED_DATASET, dataset_path, export_json,
+                                iter_dataset_batches, iter_row_batches, one_hot_features_path, read_dataset,
+                                read_feature_matrix, read_schema, resolve_dataset_path, write_dataset,
+                                write_record_chunks)
+from utils.instrumentation import instrumented, instrumented_main, measure, record
+from utils.lazy_imports import lazy_import
+
+# scikit-learn and joblib take over a second to import, only the scripts that fit models pay it
+np = lazy_import('numpy')
+pa = lazy_import('pyarrow')
+joblib = lazy_import('joblib')
+cluster = lazy_import('sklearn.cluster')
+preprocessing = lazy_import('sklearn.preprocessing')
+
 # Ignore warnings for cleaner output
 warnings.filterwarnings("ignore", category=UserWarning)
 
@@ -14,91 +34,308 @@ warnings.filterwarnings("ignore", category=UserWarning)
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-def load_data(filepath):
+ALGORITHMS = ['kmeans', 'minibatch']
+HIERARCHICAL = ['agglomerative', 'birch', 'centroid_agglomerative']
+
+@instrumented
+def load_data(filepath, columns=None):
     """
-    Load the cocktail data from a JSON file.
+    Load the cocktail data from the processed dataset store.
     
     Parameters:
-    filepath (str): Path to the JSON file.
+    filepath (str): Path to the Parquet, Arrow or JSON file.
+    columns (list): Optional list of columns to load.
     
     Returns:
     pd.DataFrame: Loaded data.
     """
-    return pd.read_json(filepath)
+    return read_dataset(filepath, columns=columns)
+
+def ensure_numeric_format(tags_matrix):
+    """
+    Convert the sparse one-hot tags matrix to a contiguous float32 array.
+
+    Only the non-zero values are cast, the dense array is allocated once.
+    
+    Parameters:
+    tags_matrix (scipy.sparse.csr_matrix): Sparse one-hot encoded tags.
+    
+    Returns:
+    np.ndarray: C-contiguous float32 array with one row per cocktail.
+    """
+    return np.ascontiguousarray(tags_matrix.astype(np.float32).toarray())
+
+def normalize_tags(features, return_scaler=False):
+    """
+    Normalize the one-hot encoded tags to a [0, 1] range in place.
+    
+    Parameters:
+    features (np.ndarray): float32 array with one-hot encoded tags.
+    return_scaler (bool): Also return the fitted scaler.
+    
+    Returns:
+    np.ndarray: The same array, normalized, or (scaler, array) if return_scaler.
+    """
+    scaler = preprocessing.MinMaxScaler(copy=False)
+    features = scaler.fit_transform(features)
+    return (scaler, features) if return_scaler else features
 
-def ensure_numeric_format(tags_series):
+def apply_weights(features, weights):
     """
-    Convert one-hot tags from series to a proper numeric array.
+    Apply weights to the tags in place to emphasize certain features.
     
     Parameters:
-    tags_series (pd.Series): Series containing one-hot encoded tags.
+    features (np.ndarray): float32 array with one-hot encoded tags.
+    weights (list): List of weights to apply, one per column.
     
     Returns:
-    pd.DataFrame: DataFrame with numeric format.
+    np.ndarray: The same array, weighted.
     """
-    return pd.DataFrame(tags_series.tolist())
+    features *= np.asarray(weights, dtype=features.dtype)
+    return features
 
-def normalize_tags(tags_df):
+def compute_weights(column_sums):
     """
-    Normalize the one-hot encoded tags to a [0, 1] range.
+    Compute the tag weights from the column sums of the normalized tags.
+
+    Tags present in more than 5 cocktails get a weight of 1, rarer tags 0.5.
     
     Parameters:
-    tags_df (pd.DataFrame): DataFrame with one-hot encoded tags.
+    column_sums (array): Sum of every normalized tag column.
     
     Returns:
-    pd.DataFrame: Normalized DataFrame.
+    list: Weight of every tag.
     """
-    scaler = MinMaxScaler()
-    return pd.DataFrame(scaler.fit_transform(tags_df), columns=tags_df.columns)
+    return [1 if count > 5 else 0.5 for count in column_sums]  # Example weights
 
-def apply_weights(tags_df, weights):
+@instrumented
+def fit_streaming_scaler(tags_matrix, batch_size):
     """
-    Apply weights to the tags to emphasize certain features.
+    Fit the MinMaxScaler and the tag weights in one pass over the one-hot matrix.
     
     Parameters:
-    tags_df (pd.DataFrame): DataFrame with one-hot encoded tags.
-    weights (list): List of weights to apply.
+    tags_matrix (scipy.sparse.csr_matrix): One-hot encoded tags, typically memory-mapped.
+    batch_size (int): Rows per batch.
     
     Returns:
-    pd.DataFrame: Weighted DataFrame.
+    tuple: (scaler, weights) - the fitted MinMaxScaler and the weight of every tag.
+    """
+    scaler = preprocessing.MinMaxScaler(copy=False)
+    column_sums = 0
+    n_rows = 0
+    for batch in iter_row_batches(tags_matrix, batch_size):
+        batch = ensure_numeric_format(batch)
+        scaler.partial_fit(batch)
+        column_sums = column_sums + batch.sum(axis=0, dtype=np.float64)
+        n_rows += len(batch)
+
+    # The scaler is affine (x * scale_ + min_), so the sums of the normalized columns follow from the raw sums
+    return scaler, compute_weights(column_sums * scaler.scale_ + n_rows * scaler.min_)
+
+def iter_weighted_batches(tags_matrix, scaler, weights, batch_size):
+    """
+    Iterate over the normalized and weighted one-hot tags in row batches.
+    
+    Parameters:
+    tags_matrix (scipy.sparse.csr_matrix): One-hot encoded tags, typically memory-mapped.
+    scaler (MinMaxScaler): Fitted scaler.
+    weights (list): Weight of every tag.
+    batch_size (int): Rows per batch.
+    
+    Yields:
+    np.ndarray: float32 array with the next batch of rows.
     """
-    return tags_df * weights
+    for batch in iter_row_batches(tags_matrix, batch_size):
+        yield apply_weights(scaler.transform(ensure_numeric_format(batch)), weights)
 
-def perform_clustering(tags_df, n_clusters):
+@instrumented
+def load_feature_sample(tags_matrix, scaler, weights, sample_size, random_state=0):
+    """
+    Load a random sample of normalized and weighted rows, used to score streamed models.
+    
+    Parameters:
+    tags_matrix (scipy.sparse.csr_matrix): One-hot encoded tags, typically memory-mapped.
+    scaler (MinMaxScaler): Fitted scaler.
+    weights (list): Weight of every tag.
+    sample_size (int): Number of rows to load.
+    random_state (int): Seed of the sampling.
+    
+    Returns:
+    tuple: (rows, features) - sorted row indices and their float32 features.
+    """
+    rng = np.random.default_rng(random_state)
+    rows = np.sort(rng.choice(tags_matrix.shape[0], size=min(sample_size, tags_matrix.shape[0]), replace=False))
+    return rows, apply_weights(scaler.transform(ensure_numeric_format(tags_matrix[rows])), weights)
+
+def fit_minibatch_kmeans(batches, n_clusters, n_epochs=1):
+    """
+    Fit MiniBatchKMeans with partial_fit over batches streamed from disk.
+    
+    Parameters:
+    batches (callable): Returns a new iterator over the feature batches.
+    n_clusters (int): Number of clusters.
+    n_epochs (int): Number of passes over the data.
+    
+    Returns:
+    MiniBatchKMeans: The fitted model.
+    """
+    kmeans = cluster.MiniBatchKMeans(n_clusters=n_clusters, random_state=0)
+    # The first partial_fit needs at least n_clusters rows, smaller batches are buffered until then
+    pending = []
+    for _ in range(n_epochs):
+        for batch in batches():
+            if hasattr(kmeans, 'cluster_centers_'):
+                kmeans.partial_fit(batch)
+                continue
+            pending.append(batch)
+            if sum(len(rows) for rows in pending) >= n_clusters:
+                kmeans.partial_fit(np.concatenate(pending))
+                pending = []
+    if pending:
+        # Fewer rows than clusters in total, partial_fit raises a ValueError
+        kmeans.partial_fit(np.concatenate(pending))
+    return kmeans
+
+def predict_labels(predict, batches):
+    """
+    Predict the cluster of every row batch by batch.
+    
+    Parameters:
+    predict (callable): Predict method of a fitted model.
+    batches (callable): Returns a new iterator over the feature batches.
+    
+    Returns:
+    np.ndarray: Cluster label of every row.
+    """
+    return np.concatenate([predict(batch) for batch in batches()])
+
+def hierarchical_labels(features, n_clusters, hierarchical='agglomerative', n_micro_clusters=100):
+    """
+    Perform hierarchical clustering of in-memory features.
+    
+    Parameters:
+    features (np.ndarray): Array with weighted one-hot encoded tags.
+    n_clusters (int): Number of clusters.
+    hierarchical (str): 'agglomerative' (O(n²) memory), 'birch' or 'centroid_agglomerative'
+                        (agglomerative clustering of n_micro_clusters K-means centroids).
+    n_micro_clusters (int): Number of K-means centroids for 'centroid_agglomerative'.
+    
+    Returns:
+    np.ndarray: Cluster label of every row.
+    """
+    if hierarchical == 'agglomerative':
+        return cluster.AgglomerativeClustering(n_clusters=n_clusters).fit_predict(features)
+    if hierarchical == 'birch':
+        return cluster.Birch(n_clusters=n_clusters).fit_predict(features)
+    if hierarchical == 'centroid_agglomerative':
+        n_micro_clusters = min(max(n_micro_clusters, n_clusters), len(features))
+        micro = cluster.KMeans(n_clusters=n_micro_clusters, random_state=0, n_init=1).fit(features)
+        centroid_labels = cluster.AgglomerativeClustering(n_clusters=n_clusters).fit_predict(micro.cluster_centers_)
+        return centroid_labels[micro.labels_]
+    raise ValueError(f"Unknown hierarchical clustering '{hierarchical}'.")
+
+@dataclass
+class SweepResult:
+    """
+    Result of fitting K-means for one candidate number of clusters.
+
+    Attributes:
+    n_clusters (int): Number of clusters.
+    score (float): Score of the fitted model with the configured evaluation method.
+    fit_seconds (float): Wall time of the K-means fit.
+    score_seconds (float): Wall time of the scoring.
+    model (KMeans): The fitted model, reused once the best candidate is chosen.
+    """
+    n_clusters: int
+    score: float
+    fit_seconds: float
+    score_seconds: float
+    model: cluster.KMeans
+
+@instrumented(rows=lambda labels: len(labels[0]))
+def perform_clustering(features, n_clusters, kmeans=None, hierarchical='agglomerative', n_micro_clusters=100):
     """
     Perform K-means and Agglomerative clustering.
     
     Parameters:
-    tags_df (pd.DataFrame): DataFrame with one-hot encoded tags.
+    features (np.ndarray): Array with weighted one-hot encoded tags.
     n_clusters (int): Number of clusters.
+    kmeans (KMeans): Optional K-means model already fitted on features (e.g. by the k-sweep).
+    hierarchical (str): Hierarchical clustering method, see hierarchical_labels.
+    n_micro_clusters (int): Number of K-means centroids for 'centroid_agglomerative'.
     
     Returns:
     tuple: K-means and Agglomerative clustering labels.
     """
-    # K-means clustering
-    kmeans = KMeans(n_clusters=n_clusters, random_state=0, n_init=10)
-    kmeans_labels = kmeans.fit_predict(tags_df)
+    # K-means clustering, reuse the fitted model if given
+    if kmeans is None:
+        kmeans = cluster.KMeans(n_clusters=n_clusters, random_state=0, n_init=10)
+        kmeans.fit(features)
+    kmeans_labels = kmeans.labels_
 
     # Agglomerative clustering
-    agg_cluster = AgglomerativeClustering(n_clusters=n_clusters)
-    agg_labels = agg_cluster.fit_predict(tags_df)
+    agg_labels = hierarchical_labels(features, n_clusters, hierarchical, n_micro_clusters)
+
+    return kmeans_labels, agg_labels
+
+@instrumented(rows=lambda labels: len(labels[0]))
+def perform_streaming_clustering(batches, n_clusters, kmeans, n_rows, hierarchical='birch',
+                                 n_micro_clusters=100, n_epochs=1):
+    """
+    Perform MiniBatchKMeans and scalable hierarchical clustering over batches streamed from disk.
+    
+    Parameters:
+    batches (callable): Returns a new iterator over the feature batches.
+    n_clusters (int): Number of clusters.
+    kmeans (MiniBatchKMeans): K-means model fitted by the k-sweep.
+    n_rows (int): Total number of rows.
+    hierarchical (str): 'birch' or 'centroid_agglomerative', plain agglomerative
+                        clustering needs all rows in memory.
+    n_micro_clusters (int): Number of K-means centroids for 'centroid_agglomerative'.
+    n_epochs (int): Number of passes over the data when fitting the micro-clusters.
+    
+    Returns:
+    tuple: K-means and hierarchical clustering labels.
+    """
+    kmeans_labels = predict_labels(kmeans.predict, batches)
+
+    if hierarchical == 'birch':
+        # Build the CF-tree batch by batch, then run the global clustering of its subclusters once
+        birch = cluster.Birch(n_clusters=None)
+        for batch in batches():
+            birch.partial_fit(batch)
+        birch.set_params(n_clusters=n_clusters)
+        birch.partial_fit()
+        agg_labels = predict_labels(birch.predict, batches)
+    elif hierarchical == 'centroid_agglomerative':
+        micro = fit_minibatch_kmeans(batches, min(max(n_micro_clusters, n_clusters), n_rows), n_epochs)
+        centroid_labels = cluster.AgglomerativeClustering(n_clusters=n_clusters).fit_predict(micro.cluster_centers_)
+        agg_labels = centroid_labels[predict_labels(micro.predict, batches)]
+    else:
+        raise ValueError(f"Hierarchical clustering '{hierarchical}' needs all rows in memory, "
+                         "use 'birch' or 'centroid_agglomerative' with the minibatch algorithm.")
 
     return kmeans_labels, agg_labels
 
-def evaluate_clustering(tags_df, kmeans_labels, agg_labels):
+@instrumented
+def evaluate_clustering(features, kmeans_labels, agg_labels, evaluation=None):
     """
-    Evaluate clustering using silhouette score.
+    Evaluate clustering using the configured evaluation method (silhouette score by default).
     
     Parameters:
-    tags_df (pd.DataFrame): DataFrame with one-hot encoded tags.
+    features (np.ndarray): Array with weighted one-hot encoded tags.
     kmeans_labels (array): K-means clustering labels.
     agg_labels (array): Agglomerative clustering labels.
+    evaluation (dict): Keyword arguments of score_clustering (clustering.evaluation in the config).
     """
-    kmeans_silhouette = silhouette_score(tags_df, kmeans_labels)
-    logger.info(f"K-means Silhouette Score: {kmeans_silhouette:.4f}")
+    evaluation = evaluation or {}
+    method = evaluation.get('method', 'silhouette')
 
-    agg_silhouette = silhouette_score(tags_df, agg_labels)
-    logger.info(f"Agglomerative Clustering Silhouette Score: {agg_silhouette:.4f}")
+    kmeans_score = score_clustering(features, kmeans_labels, **evaluation)
+    logger.info(f"K-means {method} score: {kmeans_score:.4f}")
+
+    agg_score = score_clustering(features, agg_labels, **evaluation)
+    logger.info(f"Agglomerative Clustering {method} score: {agg_score:.4f}")
 
 def log_cluster_counts(cocktail_data):
     """
@@ -118,68 +355,195 @@ def log_cluster_counts(cocktail_data):
     for cluster, count in agg_counts.items():
         logger.info(f"Cluster {cluster}: {count} cocktails")
 
-def find_optimal_clusters(tags_df, max_clusters=10):
+def fit_candidate(features, n_clusters, evaluation=None, batches=None, n_epochs=1):
     """
-    Find the optimal number of clusters based on silhouette score.
+    Fit K-means for one number of clusters and score it.
     
     Parameters:
-    tags_df (pd.DataFrame): DataFrame with one-hot encoded tags.
+    features (np.ndarray): Array with weighted one-hot encoded tags. When batches
+                           is given, only this sample is scored.
+    n_clusters (int): Number of clusters.
+    evaluation (dict): Keyword arguments of score_clustering (clustering.evaluation in the config).
+    batches (callable): Returns a new iterator over the feature batches on disk. If given,
+                        MiniBatchKMeans is fitted on the batches instead of KMeans on features.
+    n_epochs (int): Number of passes over the batches.
+    
+    Returns:
+    SweepResult: The fitted model with its score and timings.
+    """
+    start = time.perf_counter()
+    if batches is None:
+        kmeans = cluster.KMeans(n_clusters=n_clusters, random_state=0, n_init=10)
+        kmeans_labels = kmeans.fit_predict(features)
+    else:
+        kmeans = fit_minibatch_kmeans(batches, n_clusters, n_epochs)
+        kmeans_labels = kmeans.predict(features)
+    fit_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    score = score_clustering(features, kmeans_labels, **(evaluation or {}))
+    score_seconds = time.perf_counter() - start
+
+    return SweepResult(n_clusters, score, fit_seconds, score_seconds, kmeans)
+
+@instrumented
+def find_optimal_clusters(features, max_clusters=10, n_jobs=1, evaluation=None, batches=None, n_epochs=1):
+    """
+    Find the optimal number of clusters based on the configured score (silhouette score by default).
+
+    The candidate numbers of clusters are fitted concurrently in a process pool.
+    
+    Parameters:
+    features (np.ndarray): Array with weighted one-hot encoded tags.
     max_clusters (int): Maximum number of clusters to evaluate.
+    n_jobs (int): Number of worker processes, -1 uses all cores.
+    evaluation (dict): Keyword arguments of score_clustering (clustering.evaluation in the config).
+    batches (callable): Optional feature batches on disk for streaming fits, see fit_candidate.
+    n_epochs (int): Number of passes over the batches.
     
     Returns:
-    int: Optimal number of clusters.
+    tuple: (best, results) - the SweepResult with the highest score and the
+           SweepResult of every candidate, ordered by number of clusters.
     """
-    best_score = -1
-    best_n = 2
-    scores = []
+    results = joblib.Parallel(n_jobs=n_jobs, backend='loky')(
+        joblib.delayed(fit_candidate)(features, n_clusters, evaluation, batches, n_epochs)
+        for n_clusters in range(2, max_clusters + 1)
+    )
+    method = (evaluation or {}).get('method', 'silhouette')
 
-    for n_clusters in range(2, max_clusters + 1):
-        kmeans = KMeans(n_clusters=n_clusters, random_state=0, n_init=10)
-        kmeans_labels = kmeans.fit_predict(tags_df)
+    best = None
+    for result in results:
+        logger.info(f"{method} score for {result.n_clusters} clusters: {result.score:.4f} "
+                    f"(fit {result.fit_seconds:.2f}s, score {result.score_seconds:.2f}s)")
+        # The candidates may be fitted in worker processes, their timings are recorded here
+        record(f"fit_kmeans[k={result.n_clusters}]", wall_seconds=result.fit_seconds)
+        record(f"{method}[k={result.n_clusters}]", wall_seconds=result.score_seconds, score=float(result.score))
 
-        score = silhouette_score(tags_df, kmeans_labels)
-        scores.append(score)
-        logger.info(f"Silhouette Score for {n_clusters} clusters: {score:.4f}")
+        # Keep the smallest number of clusters among equal scores
+        if best is None or is_better(result.score, best.score, method):
+            best = result
 
-        if score > best_score:
-            best_score = score
-            best_n = n_clusters
+    logger.info(f"Optimal number of clusters: {best.n_clusters} with a {method} score of {best.score:.4f}")
+    return best, results
 
-    logger.info(f"Optimal number of clusters: {best_n} with a Silhouette Score of {best_score:.4f}")
-    return best_n
+def cluster_in_memory(tags_matrix, clustering_cfg, evaluation):
+    """
+    Cluster with full-batch K-means on the dense feature array.
+    
+    Parameters:
+    tags_matrix (scipy.sparse.csr_matrix): Sparse one-hot encoded tags.
+    clustering_cfg (DictConfig): The 'clustering' section of the config.
+    evaluation (dict): Keyword arguments of score_clustering.
+    
+    Returns:
+    tuple: K-means and hierarchical clustering labels, the fitted scaler, the
+           tag weights and the K-means model.
+    """
+    with measure('prepare_features') as stage:
+        # Build the dense float32 feature array once, the next steps modify it in place
+        features = ensure_numeric_format(tags_matrix)
 
-@hydra.main(version_base=None, config_path="../../configs/clustering_configs", config_name="clustering_config")
-def main(cfg):
+        # Normalize the one-hot encoded tags
+        scaler, features = normalize_tags(features, return_scaler=True)
+
+        # Optionally apply weights to certain tags (define weights as per your analysis)
+        weights = compute_weights(features.sum(axis=0))
+        features = apply_weights(features, weights)
+        stage.rows = features.shape[0]
+
+    # Find the optimal number of clusters
+    best, _ = find_optimal_clusters(features, max_clusters=clustering_cfg.n_clusters,
+                                    n_jobs=clustering_cfg.n_jobs, evaluation=evaluation)
+
+    # Perform clustering with optimal clusters, reusing the K-means model fitted during the sweep
+    kmeans_labels, agg_labels = perform_clustering(features, best.n_clusters, kmeans=best.model,
+                                                   hierarchical=clustering_cfg.hierarchical,
+                                                   n_micro_clusters=clustering_cfg.n_micro_clusters)
+
+    # Evaluate clustering
+    evaluate_clustering(features, kmeans_labels, agg_labels, evaluation)
+    return kmeans_labels, agg_labels, scaler, weights, best.model
+
+def cluster_streaming(tags_matrix, clustering_cfg, evaluation):
     """
-    Main function to perform clustering on cocktail data.
+    Cluster with MiniBatchKMeans, reading the feature batches from the one-hot matrix.
+
+    Only one batch of features and a scoring sample are held in memory at a time
+    when the matrix is memory-mapped.
     
     Parameters:
-    cfg (OmegaConf): Configuration object.
+    tags_matrix (scipy.sparse.csr_matrix): Sparse one-hot encoded tags.
+    clustering_cfg (DictConfig): The 'clustering' section of the config.
+    evaluation (dict): Keyword arguments of score_clustering.
+    
+    Returns:
+    tuple: K-means and hierarchical clustering labels, the fitted scaler, the
+           tag weights and the MiniBatchKMeans model.
     """
-    # Load the cocktail data
-    cocktail_data = load_data('data/processed/processed_cocktail_dataset.json')
+    batch_size = clustering_cfg.batch_size
+    scaler, weights = fit_streaming_scaler(tags_matrix, batch_size)
+    batches = partial(iter_weighted_batches, tags_matrix, scaler, weights, batch_size)
 
-    # Extract the one-hot encoded tags
-    tags_df = cocktail_data['one_hot_tags']
+    # Models are fitted on all batches but scored on a sample held in memory
+    rows, sample = load_feature_sample(tags_matrix, scaler, weights,
+                                       evaluation.get('sample_size', 10000), evaluation.get('random_state', 0))
 
-    # Ensure tags_df is properly formatted
-    tags_df = ensure_numeric_format(tags_df)
+    best, _ = find_optimal_clusters(sample, max_clusters=clustering_cfg.n_clusters, n_jobs=clustering_cfg.n_jobs,
+                                    evaluation=evaluation, batches=batches, n_epochs=clustering_cfg.n_epochs)
 
-    # Normalize the one-hot encoded tags
-    tags_df = normalize_tags(tags_df)
+    kmeans_labels, agg_labels = perform_streaming_clustering(
+        batches, best.n_clusters, best.model, int(scaler.n_samples_seen_),
+        hierarchical=clustering_cfg.hierarchical, n_micro_clusters=clustering_cfg.n_micro_clusters,
+        n_epochs=clustering_cfg.n_epochs,
+    )
 
-    # Optionally apply weights to certain tags (define weights as per your analysis)
-    weights = [1 if count > 5 else 0.5 for count in tags_df.sum()]  # Example weights
-    tags_df = apply_weights(tags_df, weights)
+    evaluate_clustering(sample, kmeans_labels[rows], agg_labels[rows], evaluation)
+    return kmeans_labels, agg_labels, scaler, weights, best.model
 
-    # Find the optimal number of clusters
-    optimal_clusters = find_optimal_clusters(tags_df, max_clusters=cfg.clustering.n_clusters)
+def config_error(clustering_cfg):
+    """
+    Check the clustering config before anything is loaded or fitted.
 
-    # Perform clustering with optimal clusters
-    kmeans_labels, agg_labels = perform_clustering(tags_df, optimal_clusters)
+    Parameters:
+    clustering_cfg (DictConfig): The 'clustering' section of the config.
 
-    # Evaluate clustering
-    evaluate_clustering(tags_df, kmeans_labels, agg_labels)
+    Returns:
+    str: Description of the first invalid setting, None if the config is valid.
+    """
+    if clustering_cfg.algorithm not in ALGORITHMS:
+        return f"Unknown clustering algorithm '{clustering_cfg.algorithm}'. Use one of {ALGORITHMS}."
+    if clustering_cfg.hierarchical not in HIERARCHICAL:
+        return f"Unknown hierarchical clustering '{clustering_cfg.hierarchical}'. Use one of {HIERARCHICAL}."
+    if clustering_cfg.algorithm == 'minibatch' and clustering_cfg.hierarchical == 'agglomerative':
+        return ("Hierarchical clustering 'agglomerative' needs all rows in memory, "
+                "use 'birch' or 'centroid_agglomerative' with the minibatch algorithm.")
+    return None
+
+@instrumented(rows=lambda result: len(result[0]))
+def cluster_cocktails(cocktail_data, tags_matrix, columns, clustering_cfg, tagging_cfg=None):
+    """
+    Cluster the cocktails and add the cluster labels to their data.
+    
+    Parameters:
+    cocktail_data (pd.DataFrame): Cocktail data, one row per row of tags_matrix.
+    tags_matrix (scipy.sparse.csr_matrix): Sparse one-hot encoded tags.
+    columns (list): Tag name of every column of tags_matrix.
+    clustering_cfg (DictConfig): The 'clustering' section of the config.
+    tagging_cfg (DictConfig): The tagging config the tags were assigned with, recorded in the model.
+    
+    Returns:
+    tuple: (cocktail_data, model) - the cocktail data with 'kmeans_cluster' and 'agg_cluster'
+           columns, and the ClusterModel assigning new cocktails to the K-means clusters.
+    """
+    error = config_error(clustering_cfg)
+    if error:
+        raise ValueError(error)
+
+    evaluation = OmegaConf.to_container(clustering_cfg.evaluation)
+    if clustering_cfg.algorithm == 'minibatch':
+        kmeans_labels, agg_labels, scaler, weights, kmeans = cluster_streaming(tags_matrix, clustering_cfg, evaluation)
+    else:
+        kmeans_labels, agg_labels, scaler, weights, kmeans = cluster_in_memory(tags_matrix, clustering_cfg, evaluation)
 
     # Add cluster labels to the original data for further analysis
     cocktail_data['kmeans_cluster'] = kmeans_labels
@@ -187,11 +551,111 @@ def main(cfg):
 
     # Log the number of cocktails in each cluster
     log_cluster_counts(cocktail_data)
+    tagging = tagging_fingerprint(tagging_cfg) if tagging_cfg is not None else None
+    return cocktail_data, build_cluster_model(scaler, weights, kmeans, columns, clustering_cfg.algorithm, tagging)
 
-    # Save the clustered data
-    output_file = 'data/processed/clustered_cocktail_dataset.json'
-    cocktail_data.to_json(output_file, orient='records', indent=4)
+@instrumented
+def save_clustered_data(cocktail_data, storage, model=None, model_dir=None):
+    """
+    Save the clustered data, optionally exporting it to JSON, and the cluster model.
+    
+    Parameters:
+    cocktail_data (pd.DataFrame): DataFrame with cocktail data and cluster labels.
+    storage (DictConfig): The 'storage' section of the global config.
+    model (ClusterModel): Model returned by cluster_cocktails, written as a new version to model_dir.
+    model_dir (str): Directory of the model versions, the model is not written if None.
+    """
+    output_file = dataset_path(CLUSTERED_DATASET, storage.format)
+    write_dataset(cocktail_data, output_file)
     logger.info(f"Clustered data saved to {output_file}")
 
+    # Optionally export the final dataset to JSON
+    if storage.export_json and storage.format != 'json':
+        export_json(cocktail_data, dataset_path(CLUSTERED_DATASET, 'json'))
+
+    if model is not None and model_dir:
+        write_cluster_model(model, model_dir)
+
+@instrumented
+def save_clustered_batches(dataset_file, labels, storage, batch_size, model=None, model_dir=None):
+    """
+    Write the clustered dataset batch by batch, adding the cluster labels to every batch of the processed dataset.
+
+    Only one batch of cocktails is held in memory, like the minibatch clustering.
+
+    Parameters:
+    dataset_file (str): Path to the processed dataset the cocktails were clustered from.
+    labels (pd.DataFrame): 'kmeans_cluster' and 'agg_cluster' of every row of the dataset, in order.
+    storage (DictConfig): The 'storage' section of the global config.
+    batch_size (int): Number of cocktails per batch.
+    model (ClusterModel): Model returned by cluster_cocktails, written as a new version to model_dir.
+    model_dir (str): Directory of the model versions, the model is not written if None.
+    """
+    label_columns = ['kmeans_cluster', 'agg_cluster']
+
+    def chunks():
+        start = 0
+        for batch in iter_dataset_batches(dataset_file, batch_size):
+            for column in label_columns:
+                batch[column] = labels[column].to_numpy()[start:start + len(batch)]
+            start += len(batch)
+            yield batch.to_dict('records')
+
+    schema = read_schema(dataset_file)
+    if schema is not None:
+        schema = schema.remove_metadata()
+        for column in label_columns:
+            schema = schema.append(pa.field(column, pa.from_numpy_dtype(labels[column].dtype)))
+
+    output_file = dataset_path(CLUSTERED_DATASET, storage.format)
+    write_record_chunks(chunks, output_file, schema)
+    logger.info(f"Clustered data saved to {output_file}")
+
+    # Optionally export the final dataset to JSON
+    if storage.export_json and storage.format != 'json':
+        write_record_chunks(chunks, dataset_path(CLUSTERED_DATASET, 'json'))
+
+    if model is not None and model_dir:
+        write_cluster_model(model, model_dir)
+
+@hydra.main(version_base=None, config_path="../../configs", config_name="clustering_configs/clustering_config")
+@instrumented_main
+def main(cfg):
+    """
+    Main function to perform clustering on cocktail data.
+    
+    Parameters:
+    cfg (OmegaConf): Configuration object.
+    """
+    global_config = OmegaConf.load("configs/global_configs.yaml")
+    error = config_error(cfg.clustering)
+    if error:
+        logger.critical(error)
+        return None
+
+    # Load the cocktail data, only the ids in minibatch mode: the labels are added batch by batch when saving
+    streaming = cfg.clustering.algorithm == 'minibatch'
+    dataset_file = resolve_dataset_path(PROCESSED_DATASET, global_config.storage.format)
+    cocktail_data = load_data(dataset_file, columns=['id'] if streaming else None)
+
+    # Load the one-hot encoded tags produced by one_hot_encode_tags.py (memory-mapped)
+    with measure('read_feature_matrix') as stage:
+        features_path = one_hot_features_path(cfg.clustering.features_path)
+        tags_matrix, ids, columns = read_feature_matrix(features_path)
+        stage.rows = tags_matrix.shape[0]
+    if len(ids) != len(cocktail_data) or (ids != cocktail_data['id'].to_numpy()).any():
+        logger.critical("One-hot tags in %s do not match the cocktail data. Rerun one_hot_encode_tags.py.",
+                        features_path)
+        return None
+
+    cocktail_data, model = cluster_cocktails(cocktail_data, tags_matrix, columns, cfg.clustering, cfg.tagging)
+
+    # Save the clustered data and the model used by predict_clusters.py
+    if streaming:
+        save_clustered_batches(dataset_file, cocktail_data, global_config.storage, cfg.clustering.batch_size,
+                               model, cfg.clustering.model_dir)
+    else:
+        save_clustered_data(cocktail_data, global_config.storage, model, cfg.clustering.model_dir)
+
 if __name__ == "__main__":
     main()
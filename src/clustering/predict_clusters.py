@@ -0,0 +1,117 @@
+import os
+import sys
+import time
+import logging
+import hydra
+from omegaconf import DictConfig
+
+sys.path[:0] = [os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+                os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'preprocessing_scripts'))]
+from cluster_model import read_cluster_model, tagging_fingerprint
+from one_hot_encode_tags import one_hot_encode_tags
+from simplify_data import iter_simplified_chunks
+from tagging_script import compile_tag_rules, tag_cocktails
+from utils.data_storage import write_dataset
+from utils.instrumentation import instrumented, instrumented_main
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+
+def tagging_error(model, tagging_cfg):
+    """
+    Check that new cocktails are tagged like the cocktails the model was fitted on.
+
+    Parameters:
+    model (ClusterModel): The cluster model.
+    tagging_cfg (DictConfig): The tagging configuration used for the new cocktails.
+
+    Returns:
+    str: Description of the mismatch, None if the tagging configs match.
+    """
+    if model.tagging is None:
+        return f"Cluster model {model.version} does not record the tagging config it was fitted with."
+    if model.tagging != tagging_fingerprint(tagging_cfg):
+        return (f"Cluster model {model.version} was fitted on tags assigned with another tagging config "
+                f"(functions or tags_definitions changed). Rerun the tagging, one-hot encoding and clustering.")
+    return None
+
+
+@instrumented
+def predict_cocktails(cocktails, model, rules, tagging_cfg):
+    """
+    Tag, encode and assign new cocktails to the K-means clusters of a fitted model.
+
+    The cocktails are tagged with the current tagging config and encoded on
+    the tag columns of the model, no clustering is refitted. Tags that are not
+    columns of the model are ignored, like when the clustered tags were encoded.
+
+    Parameters:
+    cocktails (list): Raw or simplified cocktail dicts with their 'ingredients'.
+    model (ClusterModel): Model written by clustering.py, see read_cluster_model.
+    rules (TagRules): Tag rules compiled from tagging_cfg.tags_definitions.
+    tagging_cfg (DictConfig): The tagging configuration.
+
+    Returns:
+    np.ndarray: K-means cluster of every cocktail.
+    """
+    if not cocktails:
+        return np.empty(0, dtype=np.int32)
+    tags = tag_cocktails(pd.Series([cocktail['ingredients'] for cocktail in cocktails]), rules, tagging_cfg)
+    return model.predict(one_hot_encode_tags(pd.Series(tags), model.tags_indices))
+
+
+@hydra.main(version_base=None, config_path="../../configs", config_name="clustering_configs/predict_config")
+@instrumented_main
+def main(cfg: DictConfig):
+    """
+    Assign the cocktails of a raw JSON file to the clusters of the persisted model.
+
+    Parameters:
+    cfg (DictConfig): Prediction configuration with the tagging config under 'tagging'.
+    """
+    try:
+        model = read_cluster_model(cfg.predict.model_dir, cfg.predict.version)
+    except (FileNotFoundError, ValueError) as e:
+        logging.critical("Error loading the cluster model: %s", e)
+        return None
+    logging.info("Loaded cluster model %s with %d clusters (%s)", model.version, model.n_clusters, model.created_at)
+
+    error = tagging_error(model, cfg.tagging)
+    if error and cfg.predict.strict_tagging:
+        logging.critical("%s Set predict.strict_tagging=false to assign the cocktails anyway.", error)
+        return None
+    if error:
+        logging.warning(error)
+
+    rules = compile_tag_rules(cfg.tagging.tags_definitions)
+    results = []
+    predict_seconds = 0
+    for chunk in iter_simplified_chunks(cfg.predict.input_path, cfg.predict.batch_size):
+        start = time.perf_counter()
+        labels = predict_cocktails(chunk, model, rules, cfg.tagging)
+        predict_seconds += time.perf_counter() - start
+        results.append(pd.DataFrame({
+            'id': [cocktail['id'] for cocktail in chunk],
+            'name': [cocktail['name'] for cocktail in chunk],
+            'kmeans_cluster': labels,
+        }))
+
+    predictions = pd.concat(results, ignore_index=True) if results else \
+        pd.DataFrame(columns=['id', 'name', 'kmeans_cluster'])
+    predictions['model_version'] = model.version
+    logging.info("Assigned %d cocktails in %.3fs (%.1f µs per cocktail)", len(predictions), predict_seconds,
+                 1e6 * predict_seconds / max(len(predictions), 1))
+
+    if cfg.predict.output_path:
+        write_dataset(predictions, cfg.predict.output_path)
+    else:
+        for cocktail in predictions.head(cfg.predict.log_limit).itertuples():
+            logging.info("%s (%s): K-means cluster %d", cocktail.name, cocktail.id, cocktail.kmeans_cluster)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import os
+import sys
+import math
+import logging
+import hydra
+from omegaconf import DictConfig, OmegaConf
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from cooccurrence_matrix import FIELDS, Vocabulary, incidence_batches, load_cooccurrence
+from frequent_itemsets import (association_rules, frequent_partners, maximal_itemsets, mine_frequent_itemsets,
+                               vertical_bitmaps)
+from utils.data_storage import PROCESSED_DATASET, resolve_dataset_path, write_dataset
+from utils.instrumentation import instrumented_main, measure
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+
+def itemsets_table(itemsets, labels, n_cocktails):
+    """
+    Describe frequent itemsets.
+
+    Parameters:
+    itemsets (dict): Columns of the items of every itemset (tuple) -> number of cocktails.
+    labels (list): Item of every column.
+    n_cocktails (int): Number of cocktails.
+
+    Returns:
+    pd.DataFrame: items (list), length, count and support of every itemset, most frequent first.
+    """
+    table = pd.DataFrame({
+        'items': [[labels[column] for column in itemset] for itemset in itemsets],
+        'length': [len(itemset) for itemset in itemsets],
+        'count': list(itemsets.values()),
+    })
+    table['support'] = table['count'] / n_cocktails
+    return table.sort_values(['count', 'length'], ascending=False, kind='stable', ignore_index=True)
+
+
+def suggest_tag_definitions(itemsets, labels, min_length=3, limit=10):
+    """
+    Turn the most frequent maximal itemsets into tag definitions to curate.
+
+    A cocktail supports an itemset only if it contains all of its ingredients, so the
+    definitions are combination_tags (all-of), not other_tags (any-of).
+
+    Parameters:
+    itemsets (dict): Columns of the items of every frequent itemset (tuple) -> number of cocktails.
+    labels (list): Ingredient of every column.
+    min_length (int): Minimum number of ingredients of a suggested definition.
+    limit (int): Maximum number of suggested definitions.
+
+    Returns:
+    list: Definitions in the format of combination_tags in tagging_config.yaml ({'tag', 'ingredients'}),
+          with placeholder tag names.
+    """
+    candidates = [(count, itemset) for itemset, count in maximal_itemsets(itemsets).items()
+                  if len(itemset) >= min_length]
+    candidates.sort(key=lambda candidate: (-candidate[0], -len(candidate[1])))
+    return [{'tag': f"Suggested{rank}", 'ingredients': sorted(labels[column] for column in itemset)}
+            for rank, (_, itemset) in enumerate(candidates[:limit], start=1)]
+
+
+@hydra.main(version_base=None, config_path="../../configs/cooccurrence_configs", config_name="association_rules_config")
+@instrumented_main
+def main(cfg: DictConfig):
+    """
+    Mine the frequent itemsets and association rules of the ingredients (or tags) of the processed cocktails.
+
+    Parameters:
+    cfg (DictConfig): Association rules configuration.
+    """
+    global_config = OmegaConf.load("configs/global_configs.yaml")
+    if cfg.field not in FIELDS:
+        logging.critical("Unknown field '%s'. Use one of %s.", cfg.field, FIELDS)
+        return None
+
+    # The item and pair counts come from the co-occurrence matrix, built if missing
+    matrix = load_cooccurrence(cfg.field, global_config.storage.format, cfg.matrix.path, cfg.matrix.batch_size,
+                               cfg.matrix.rebuild)
+    min_count = max(1, math.ceil(cfg.mining.min_support * matrix.n_cocktails))
+    # Mined from the least to the most frequent item, so the largest classes hold the smallest bitmaps
+    frequent = np.flatnonzero(np.asarray(matrix.item_counts) >= min_count)
+    frequent = frequent[np.argsort(np.asarray(matrix.item_counts)[frequent], kind='stable')]
+    logging.info("%d of %d %ss in at least %d of %d cocktails.", len(frequent), matrix.n_items, cfg.field, min_count,
+                 matrix.n_cocktails)
+
+    with measure('vertical_bitmaps') as stage:
+        dataset_file = resolve_dataset_path(PROCESSED_DATASET, global_config.storage.format)
+        vocabulary = Vocabulary(matrix.labels)
+        bitmaps, n_cocktails = vertical_bitmaps(
+            incidence_batches(cfg.field, dataset_file, vocabulary, cfg.matrix.batch_size), frequent)
+        stage.rows = n_cocktails
+    if n_cocktails != matrix.n_cocktails or len(vocabulary) != matrix.n_items:
+        logging.critical("The processed data changed while mining, run again.")
+        return None
+
+    with measure('mine_itemsets') as stage:
+        partners, partner_counts = frequent_partners(matrix.counts, frequent, min_count)
+        positions = mine_frequent_itemsets(bitmaps, partners, partner_counts, min_count, cfg.mining.max_length,
+                                           cfg.mining.n_jobs)
+        stage.rows = len(positions)
+    # Back from mining positions to columns of the matrix, in column order
+    itemsets = {}
+    for itemset, count in positions.items():
+        itemsets[tuple(sorted(int(frequent[position]) for position in itemset))] = count
+
+    itemset_table = itemsets_table(itemsets, matrix.labels, n_cocktails)
+    logging.info("%d frequent itemsets, by length: %s", len(itemset_table),
+                 itemset_table['length'].value_counts().sort_index().to_dict())
+    if cfg.output.itemsets_path:
+        write_dataset(itemset_table, cfg.output.itemsets_path)
+
+    with measure('association_rules') as stage:
+        rules = association_rules(itemsets, n_cocktails, cfg.rules.min_confidence, cfg.rules.min_lift)
+        labels = np.array(matrix.labels, dtype=object)
+        rules['antecedent'] = [list(labels[list(antecedent)]) for antecedent in rules['antecedent']]
+        rules['consequent'] = labels[rules['consequent'].to_numpy(dtype=np.int64)]
+        stage.rows = len(rules)
+    logging.info("%d rules with confidence >= %s and lift >= %s, top %d:\n%s", len(rules), cfg.rules.min_confidence,
+                 cfg.rules.min_lift, cfg.rules.top_k,
+                 rules.head(cfg.rules.top_k).assign(antecedent=lambda df: df['antecedent'].map(' + '.join))
+                 .to_string(index=False))
+    if cfg.output.rules_path:
+        write_dataset(rules, cfg.output.rules_path)
+
+    if cfg.field == 'ingredient' and cfg.suggestions.limit > 0:
+        definitions = suggest_tag_definitions(itemsets, matrix.labels, cfg.suggestions.min_length,
+                                              cfg.suggestions.limit)
+        logging.info("Suggested tag definitions:\n%s", OmegaConf.to_yaml({'combination_tags': definitions}))
+        if cfg.suggestions.output_path:
+            OmegaConf.save(OmegaConf.create({'combination_tags': definitions}), cfg.suggestions.output_path)
+            logging.info("Suggested tag definitions written to %s", cfg.suggestions.output_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,549 @@
+from __future__ import annotations
+
+import os
+import sys
+import json
+import logging
+from dataclasses import dataclass
+import hydra
+from omegaconf import DictConfig, OmegaConf
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.data_storage import (PROCESSED_DATASET, iter_dataset_batches, read_dataset, resolve_dataset_path,
+                                write_dataset)
+from utils.incremental import file_hash, stable_hash
+from utils.ingredient_index import INGREDIENT_INDEX, read_aligned_index
+from utils.instrumentation import instrumented, instrumented_main, measure
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+sparse = lazy_import('scipy.sparse')
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+COOCCURRENCE_DIR = 'data/processed/cooccurrence'
+
+# Column of the processed dataset holding the items of every field, and the key of the item name in its elements
+FIELD_COLUMNS = {'ingredient': ('ingredients', 'name'), 'tag': ('tags', None)}
+FIELDS = list(FIELD_COLUMNS)
+MEASURES = ['count', 'support', 'pmi', 'npmi', 'lift']
+
+INGREDIENT_INDEX_FILES = ['ids.npy', 'offsets.npy', 'ingredient_ids.npy', 'meta.json']
+
+
+class Vocabulary:
+    """
+    Column of every distinct item, growing as new items are encoded.
+
+    Parameters:
+    labels (iterable): Initial items, in column order.
+    """
+
+    def __init__(self, labels=()):
+        self.labels = []
+        self.codes = {}
+        self.encode(list(labels))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def encode(self, values):
+        """
+        Map items to their column, adding the unseen ones.
+
+        Parameters:
+        values (array-like): Items, missing values allowed.
+
+        Returns:
+        np.ndarray: int64 column of every value, -1 for missing values.
+        """
+        # Only the distinct values of the batch go through the dictionary
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        columns = np.empty(len(uniques), dtype=np.int64)
+        for position, value in enumerate(uniques):
+            column = self.codes.get(value)
+            if column is None:
+                column = self.codes[value] = len(self.labels)
+                self.labels.append(value)
+            columns[position] = column
+        return np.where(codes >= 0, columns[codes] if len(columns) else -1, -1)
+
+
+def binary_incidence(rows, columns, n_rows, n_columns):
+    """
+    Build a 0/1 cocktail x item matrix from the (row, column) pair of every item occurrence.
+
+    Parameters:
+    rows (np.ndarray): Row of every occurrence.
+    columns (np.ndarray): Column of every occurrence, negative columns are skipped.
+    n_rows (int): Number of cocktails.
+    n_columns (int): Number of items.
+
+    Returns:
+    sparse.csr_matrix: int32 matrix, 1 if the item appears in the cocktail, however many times.
+    """
+    known = columns >= 0
+    matrix = sparse.csr_matrix(
+        (np.ones(int(known.sum()), dtype=np.int32), (rows[known], columns[known])), shape=(n_rows, n_columns))
+    matrix.sum_duplicates()
+    matrix.data[:] = 1
+    return matrix
+
+
+def list_incidence(lists, vocabulary, key=None):
+    """
+    Build the incidence matrix of a batch of item lists.
+
+    Parameters:
+    lists (pd.Series): List of items of every cocktail (tags, or ingredient dicts).
+    vocabulary (Vocabulary): Columns of the items, extended with the unseen ones.
+    key (str): Key of the item name in the elements of the lists, the elements themselves if None.
+
+    Returns:
+    sparse.csr_matrix: 0/1 cocktail x item matrix.
+    """
+    exploded = lists.reset_index(drop=True).explode().dropna()
+    if key is not None:
+        exploded = exploded.map(lambda item: item.get(key) if isinstance(item, dict) else None)
+    columns = vocabulary.encode(exploded.to_numpy())
+    return binary_incidence(exploded.index.to_numpy(), columns, len(lists), len(vocabulary))
+
+
+def index_incidence_batches(index, vocabulary, batch_size):
+    """
+    Build the ingredient incidence matrix batch by batch of cocktails from the ingredient index.
+
+    The names of the dimension table are encoded once, the edges are joined by integer id,
+    so ingredients sharing a name share a column like in the dataset batches.
+
+    Parameters:
+    index (IngredientIndex): The ingredient index, in memory or memory-mapped.
+    vocabulary (Vocabulary): Columns of the ingredient names.
+    batch_size (int): Number of cocktails per batch.
+
+    Yields:
+    sparse.csr_matrix: 0/1 cocktail x ingredient matrix of the next batch.
+    """
+    table_columns = vocabulary.encode(index.table['name'].to_numpy())
+    for start in range(0, index.n_cocktails, batch_size):
+        stop = min(start + batch_size, index.n_cocktails)
+        first, last = int(index.offsets[start]), int(index.offsets[stop])
+        rows = np.repeat(np.arange(stop - start), np.diff(np.asarray(index.offsets[start:stop + 1])))
+        yield binary_incidence(rows, table_columns[index.ingredient_rows(first, last)], stop - start, len(vocabulary))
+
+
+class CooccurrenceAccumulator:
+    """
+    Sum of the co-occurrence counts X.T @ X of incidence matrices added batch by batch.
+
+    The product of every batch is sparse, with one entry per pair of items found
+    together in at least one of its cocktails, so memory follows the number of
+    co-occurring pairs rather than the square of the number of items. Batch
+    products are kept as they are and summed into the total once their entries
+    outnumber it, so every entry is re-sorted a logarithmic number of times.
+    Later batches may have more columns than earlier ones (a growing Vocabulary).
+
+    Parameters:
+    merge_size (int): Minimum number of pending entries before they are summed into the total.
+    """
+
+    def __init__(self, merge_size=2 ** 22):
+        self.merge_size = merge_size
+        self.total = None
+        self.pending = []
+        self.pending_size = 0
+        self.n_cocktails = 0
+
+    @property
+    def n_items(self):
+        shapes = [matrix.shape[0] for matrix in self.pending]
+        return max(shapes + [self.total.shape[0]] if self.total is not None else shapes, default=0)
+
+    def update(self, incidence):
+        """
+        Add the cocktails of a batch.
+
+        Parameters:
+        incidence (sparse.csr_matrix): 0/1 cocktail x item matrix of the batch.
+        """
+        incidence = incidence.astype(np.int32)
+        # Diagonal entries count the cocktails of every item
+        product = (incidence.T @ incidence).tocoo()
+        self.pending.append(product)
+        self.pending_size += product.nnz
+        self.n_cocktails += incidence.shape[0]
+        if self.pending_size >= max(self.merge_size, self.total.nnz if self.total is not None else 0):
+            self.merge()
+
+    def merge(self):
+        """Sum the pending batch products into the total."""
+        if not self.pending:
+            return
+        n = self.n_items
+        parts = self.pending + ([self.total.tocoo()] if self.total is not None else [])
+        self.total = sparse.csr_matrix(
+            (np.concatenate([part.data for part in parts]),
+             (np.concatenate([part.row for part in parts]), np.concatenate([part.col for part in parts]))),
+            shape=(n, n),
+        )
+        self.total.sum_duplicates()
+        self.pending = []
+        self.pending_size = 0
+
+    def result(self, labels, fingerprint=None):
+        """
+        Build the co-occurrence matrix of all added cocktails.
+
+        Parameters:
+        labels (list): Item of every column, at least as many as the columns of the batches.
+        fingerprint (str): Content hash of the input data, stored to detect a stale matrix.
+
+        Returns:
+        CooccurrenceMatrix: The co-occurrence counts.
+        """
+        self.merge()
+        n = len(labels)
+        total = self.total.tocoo() if self.total is not None else sparse.coo_matrix((n, n), dtype=np.int32)
+        off_diagonal = total.row != total.col
+        item_counts = np.zeros(n, dtype=np.int64)
+        item_counts[total.row[~off_diagonal]] = total.data[~off_diagonal]
+        counts = sparse.csr_matrix(
+            (total.data[off_diagonal], (total.row[off_diagonal], total.col[off_diagonal])), shape=(n, n))
+        return CooccurrenceMatrix(counts, item_counts, list(labels), self.n_cocktails, fingerprint)
+
+
+def pair_measures(counts, counts_a, counts_b, n_cocktails):
+    """
+    Association measures of item pairs.
+
+    Parameters:
+    counts (np.ndarray): Number of cocktails with both items of every pair.
+    counts_a (np.ndarray): Number of cocktails with the first item.
+    counts_b (np.ndarray): Number of cocktails with the second item.
+    n_cocktails (int): Number of cocktails.
+
+    Returns:
+    dict: Measure name -> float64 value of every pair, for every measure of MEASURES but 'count'.
+        support: share of the cocktails with both items.
+        lift: support / (share with a * share with b), 1 for independent items.
+        pmi: log(lift), pointwise mutual information.
+        npmi: pmi / -log(support), normalized to [-1, 1], 1 for items only found together.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    support = counts / n_cocktails
+    lift = counts * n_cocktails / (np.asarray(counts_a, dtype=np.float64) * np.asarray(counts_b, dtype=np.float64))
+    pmi = np.log(lift)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Pairs in every cocktail have a support of 1 and a PMI of 0
+        npmi = np.where(support < 1, pmi / -np.log(support), 1.0)
+    return {'support': support, 'pmi': pmi, 'npmi': npmi, 'lift': lift}
+
+
+@dataclass
+class CooccurrenceMatrix:
+    """
+    Number of cocktails in which every pair of items appears together.
+
+    Attributes:
+    counts (sparse.csr_matrix): Symmetric item x item matrix of pair counts, without the diagonal
+                                and without entries for pairs never found together.
+    item_counts (np.ndarray): int64 number of cocktails of every item.
+    labels (list): Item of every row and column.
+    n_cocktails (int): Number of cocktails counted.
+    fingerprint (str): Content hash of the input data the matrix was built from.
+    """
+    counts: sparse.csr_matrix
+    item_counts: np.ndarray
+    labels: list
+    n_cocktails: int
+    fingerprint: str = None
+
+    @property
+    def n_items(self):
+        return len(self.labels)
+
+    def column_of(self, label):
+        """Row and column of an item, -1 if it is unknown."""
+        try:
+            return self.labels.index(label)
+        except ValueError:
+            return -1
+
+    def entry_rows(self):
+        """Row of every stored entry of counts, aligned with counts.indices and counts.data."""
+        return np.repeat(np.arange(self.n_items, dtype=np.int32), np.diff(self.counts.indptr))
+
+    def measure_matrix(self, measure):
+        """
+        Compute an association measure of every co-occurring pair.
+
+        Parameters:
+        measure (str): A measure of MEASURES.
+
+        Returns:
+        sparse.csr_matrix: Matrix with the sparsity structure of counts and the measure as values.
+        """
+        if measure == 'count':
+            return self.counts
+        rows, columns = self.entry_rows(), self.counts.indices
+        values = pair_measures(self.counts.data, self.item_counts[rows], self.item_counts[columns],
+                               self.n_cocktails)[measure]
+        return sparse.csr_matrix((values, columns, self.counts.indptr), shape=self.counts.shape)
+
+    def pairs_table(self, rows, columns, counts):
+        """
+        Describe item pairs with their count and association measures.
+
+        Parameters:
+        rows (np.ndarray): First item of every pair.
+        columns (np.ndarray): Second item of every pair.
+        counts (np.ndarray): Number of cocktails of every pair.
+
+        Returns:
+        pd.DataFrame: item_a, item_b, count and one column per measure.
+        """
+        labels = np.array(self.labels, dtype=object)
+        table = pd.DataFrame({'item_a': labels[rows], 'item_b': labels[columns], 'count': counts})
+        for name, values in pair_measures(counts, self.item_counts[rows], self.item_counts[columns],
+                                          self.n_cocktails).items():
+            table[name] = values
+        return table
+
+    def top_pairs(self, k=20, measure='count', min_count=1):
+        """
+        Find the k pairs of items with the highest association measure.
+
+        Parameters:
+        k (int): Number of pairs.
+        measure (str): A measure of MEASURES to rank the pairs by.
+        min_count (int): Minimum number of cocktails of a pair, PMI and lift favor rare pairs.
+
+        Returns:
+        pd.DataFrame: The pairs, best first, see pairs_table.
+        """
+        rows, columns = self.entry_rows(), self.counts.indices
+        # Every pair is stored twice, once above the diagonal
+        selected = np.flatnonzero((rows < columns) & (self.counts.data >= min_count))
+        return self.ranked_pairs(rows[selected], np.asarray(columns[selected]), self.counts.data[selected], k, measure)
+
+    def neighbors(self, label, k=10, measure='count', min_count=1):
+        """
+        Find the k items with the highest association measure with an item.
+
+        Parameters:
+        label: The item.
+        k (int): Number of items.
+        measure (str): A measure of MEASURES to rank the items by.
+        min_count (int): Minimum number of cocktails with both items.
+
+        Returns:
+        pd.DataFrame: The pairs (label, item), best first, see pairs_table. None if the item is unknown.
+        """
+        row = self.column_of(label)
+        if row < 0:
+            return None
+        start, stop = self.counts.indptr[row], self.counts.indptr[row + 1]
+        counts = np.asarray(self.counts.data[start:stop])
+        keep = counts >= min_count
+        columns = np.asarray(self.counts.indices[start:stop])[keep]
+        return self.ranked_pairs(np.full(len(columns), row, dtype=np.int32), columns, counts[keep], k, measure)
+
+    def ranked_pairs(self, rows, columns, counts, k, measure):
+        """Describe the k pairs with the highest measure among the given pairs, best first."""
+        scores = counts if measure == 'count' else pair_measures(
+            counts, self.item_counts[rows], self.item_counts[columns], self.n_cocktails)[measure]
+        order = top_positions(scores, k)
+        return self.pairs_table(rows[order], columns[order], counts[order])
+
+
+def top_positions(scores, k):
+    """
+    Find the k highest scores.
+
+    Parameters:
+    scores (np.ndarray): Score of every candidate.
+    k (int): Number of candidates kept.
+
+    Returns:
+    np.ndarray: Positions of the k highest scores, highest first.
+    """
+    if 0 < k < len(scores):
+        # Only the k best candidates are sorted
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(len(scores) if k > 0 else 0)
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+@instrumented
+def build_cooccurrence(batches, vocabulary, fingerprint=None, merge_size=2 ** 22):
+    """
+    Accumulate the co-occurrence counts of incidence matrix batches.
+
+    Parameters:
+    batches (iterable): 0/1 cocktail x item matrices, with columns encoded by vocabulary.
+    vocabulary (Vocabulary): Columns of the items, complete once batches is exhausted.
+    fingerprint (str): Content hash of the input data.
+    merge_size (int): See CooccurrenceAccumulator.
+
+    Returns:
+    CooccurrenceMatrix: The co-occurrence counts.
+    """
+    accumulator = CooccurrenceAccumulator(merge_size)
+    for incidence in batches:
+        accumulator.update(incidence)
+    return accumulator.result(vocabulary.labels, fingerprint)
+
+
+def write_cooccurrence(matrix, directory):
+    """
+    Save a co-occurrence matrix as a directory of .npy arrays, memory-mapped on read.
+
+    Parameters:
+    matrix (CooccurrenceMatrix): The matrix to save.
+    directory (str): Output directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'data.npy'), matrix.counts.data)
+    np.save(os.path.join(directory, 'indices.npy'), matrix.counts.indices)
+    np.save(os.path.join(directory, 'indptr.npy'), matrix.counts.indptr)
+    np.save(os.path.join(directory, 'item_counts.npy'), matrix.item_counts)
+
+    # Written last, a matrix without meta.json is incomplete
+    with open(os.path.join(directory, 'meta.json'), 'w') as meta_file:
+        json.dump({'labels': matrix.labels, 'n_cocktails': matrix.n_cocktails, 'fingerprint': matrix.fingerprint},
+                  meta_file)
+    logging.info("Co-occurrence matrix of %d items and %d pairs written to %s",
+                 matrix.n_items, matrix.counts.nnz // 2, directory)
+
+
+def read_cooccurrence(directory, mmap=True):
+    """
+    Load a co-occurrence matrix saved by write_cooccurrence.
+
+    Parameters:
+    directory (str): Directory of the matrix.
+    mmap (bool): Memory-map the arrays instead of reading them into memory.
+
+    Returns:
+    CooccurrenceMatrix: The loaded matrix.
+    """
+    mmap_mode = 'r' if mmap else None
+    with open(os.path.join(directory, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+
+    def load(name):
+        return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+
+    n = len(meta['labels'])
+    counts = sparse.csr_matrix((load('data'), load('indices'), load('indptr')), shape=(n, n), copy=False)
+    return CooccurrenceMatrix(counts, load('item_counts'), meta['labels'], meta['n_cocktails'], meta['fingerprint'])
+
+
+def input_fingerprint(field, dataset_file, ingredients_dir=INGREDIENT_INDEX):
+    """Content hash of the processed dataset, and of the ingredient index for the ingredients."""
+    paths = [dataset_file]
+    if field == 'ingredient':
+        paths += [os.path.join(ingredients_dir, name) for name in INGREDIENT_INDEX_FILES]
+    return stable_hash([field] + [file_hash(path) if os.path.exists(path) else None for path in paths])
+
+
+def incidence_batches(field, dataset_file, vocabulary, batch_size):
+    """
+    Build the incidence matrix of a field batch by batch of cocktails.
+
+    The ingredients are read from the ingredient index if it covers the dataset,
+    the tags (and the ingredients otherwise) from batches of the dataset.
+
+    Parameters:
+    field (str): A field of FIELDS.
+    dataset_file (str): Path to the processed dataset.
+    vocabulary (Vocabulary): Columns of the items, extended with the unseen ones.
+    batch_size (int): Number of cocktails per batch.
+
+    Returns:
+    iterator: 0/1 cocktail x item matrix of every batch.
+    """
+    column, key = FIELD_COLUMNS[field]
+    if field == 'ingredient':
+        index = read_aligned_index(read_dataset(dataset_file, columns=['id'])['id'], dataset_file)
+        if index is not None:
+            return index_incidence_batches(index, vocabulary, batch_size)
+    return (list_incidence(batch[column], vocabulary, key)
+            for batch in iter_dataset_batches(dataset_file, batch_size, columns=[column]))
+
+
+def load_cooccurrence(field, storage_format='parquet', directory=COOCCURRENCE_DIR, batch_size=10000,
+                      rebuild=False):
+    """
+    Load the co-occurrence matrix of a field, building it if it is missing or the processed data changed.
+
+    Parameters:
+    field (str): A field of FIELDS.
+    storage_format (str): The storage format of the datasets.
+    directory (str): Directory of the matrices, one subdirectory per field.
+    batch_size (int): Number of cocktails per batch when building the matrix.
+    rebuild (bool): Build the matrix even if it is up to date.
+
+    Returns:
+    CooccurrenceMatrix: The matrix.
+    """
+    directory = os.path.join(directory, field)
+    dataset_file = resolve_dataset_path(PROCESSED_DATASET, storage_format)
+    fingerprint = input_fingerprint(field, dataset_file)
+    if not rebuild and os.path.exists(os.path.join(directory, 'meta.json')):
+        matrix = read_cooccurrence(directory)
+        if matrix.fingerprint == fingerprint:
+            return matrix
+        logging.info("The processed data changed since the %s co-occurrence matrix was built, rebuilding it.", field)
+
+    vocabulary = Vocabulary()
+    matrix = build_cooccurrence(incidence_batches(field, dataset_file, vocabulary, batch_size), vocabulary,
+                                fingerprint)
+    write_cooccurrence(matrix, directory)
+    return matrix
+
+
+@hydra.main(version_base=None, config_path="../../configs/cooccurrence_configs", config_name="cooccurrence_config")
+@instrumented_main
+def main(cfg: DictConfig):
+    """
+    Build the co-occurrence matrices if needed and log the most associated pairs of items.
+
+    Parameters:
+    cfg (DictConfig): Co-occurrence configuration.
+    """
+    global_config = OmegaConf.load("configs/global_configs.yaml")
+    if cfg.top_pairs.measure not in MEASURES:
+        logging.critical("Unknown measure '%s'. Use one of %s.", cfg.top_pairs.measure, MEASURES)
+        return None
+
+    for field in cfg.fields:
+        if field not in FIELDS:
+            logging.error("Unknown field '%s'. Use one of %s.", field, FIELDS)
+            continue
+
+        with measure(f"load_{field}_cooccurrence") as stage:
+            matrix = load_cooccurrence(field, global_config.storage.format, cfg.matrix.path, cfg.matrix.batch_size,
+                                       cfg.matrix.rebuild)
+            stage.rows = matrix.n_items
+        logging.info("%d %ss in %d cocktails, %d co-occurring pairs.", matrix.n_items, field, matrix.n_cocktails,
+                     matrix.counts.nnz // 2)
+
+        options = dict(measure=cfg.top_pairs.measure, min_count=cfg.top_pairs.min_count)
+        pairs = matrix.top_pairs(cfg.top_pairs.k, **options)
+        logging.info("Top %s pairs by %s:\n%s", field, cfg.top_pairs.measure, pairs.to_string(index=False))
+        if cfg.top_pairs.output_path:
+            write_dataset(pairs, cfg.top_pairs.output_path.format(field=field))
+
+        for label in cfg.neighbors.get(field, []):
+            neighbors = matrix.neighbors(label, cfg.top_pairs.k, **options)
+            if neighbors is None:
+                logging.warning("Unknown %s '%s'.", field, label)
+            else:
+                logging.info("Most associated with %s:\n%s", label, neighbors.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import os
+import sys
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path[:0] = [os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+                os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'query'))]
+from bitmap import Bitmap
+from utils.ingestion import n_workers
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+sparse = lazy_import('scipy.sparse')
+
+logger = logging.getLogger(__name__)
+
+# Arguments of mine_class shared by the worker processes, set once per worker by init_worker
+_shared = None
+
+
+def vertical_bitmaps(batches, columns):
+    """
+    Build the bitmap of the cocktails of every item from incidence matrix batches.
+
+    Parameters:
+    batches (iterable): 0/1 cocktail x item matrices (CSR), in cocktail order.
+    columns (np.ndarray): Columns of the items to keep, the frequent ones.
+
+    Returns:
+    tuple: (bitmaps, n_cocktails) - Bitmap of the rows of every item of columns, and the number of cocktails.
+    """
+    # Only the edges of the kept items are held in memory
+    selected = [incidence[:, columns] for incidence in batches]
+    matrix = sparse.vstack(selected, format='csc') if selected else sparse.csc_matrix((0, len(columns)))
+    matrix.sort_indices()
+    n = matrix.shape[0]
+    bitmaps = [Bitmap.from_rows(matrix.indices[matrix.indptr[position]:matrix.indptr[position + 1]], n)
+               for position in range(len(columns))]
+    return bitmaps, n
+
+
+def frequent_partners(counts, columns, min_count):
+    """
+    List the frequent pairs of items from their co-occurrence counts.
+
+    Parameters:
+    counts (sparse.csr_matrix): Symmetric item x item co-occurrence counts (CooccurrenceMatrix.counts).
+    columns (np.ndarray): Columns of the frequent items, in mining order.
+    min_count (int): Minimum number of cocktails of a frequent pair.
+
+    Returns:
+    tuple: (partners, partner_counts) - for the item at every position of columns, the sorted
+           positions after it forming a frequent pair with it, and the count of every pair.
+    """
+    pairs = sparse.triu(counts[columns][:, columns], k=1, format='csr')
+    pairs.data[pairs.data < min_count] = 0
+    pairs.eliminate_zeros()
+    pairs.sort_indices()
+    partners = [pairs.indices[pairs.indptr[row]:pairs.indptr[row + 1]] for row in range(len(columns))]
+    partner_counts = [pairs.data[pairs.indptr[row]:pairs.indptr[row + 1]] for row in range(len(columns))]
+    return partners, partner_counts
+
+
+def mine_class(first, bitmaps, partners, partner_counts, min_count, max_length):
+    """
+    Mine the frequent itemsets whose first item, in mining order, is first (Eclat).
+
+    The itemsets sharing a prefix are extended depth-first by intersecting the
+    bitmaps of their siblings, so only the bitmaps along the current path are
+    held. The counts of the pairs come from the co-occurrence matrix, and an
+    item only extends an itemset if it forms a frequent pair with its last item.
+
+    Parameters:
+    first (int): Position of the first item.
+    bitmaps (list): Bitmap of the cocktails of every frequent item, in mining order.
+    partners (list): Frequent pair partners of every item, see frequent_partners.
+    partner_counts (list): Count of every frequent pair, see frequent_partners.
+    min_count (int): Minimum number of cocktails of a frequent itemset.
+    max_length (int): Maximum number of items of an itemset.
+
+    Returns:
+    list: (positions, count) of every frequent itemset of the class, positions in increasing order.
+    """
+    itemsets = [((first,), bitmaps[first].count())]
+    if max_length < 2:
+        return itemsets
+    if max_length == 2:
+        return itemsets + [((first, int(item)), int(count))
+                           for item, count in zip(partners[first], partner_counts[first])]
+
+    def grow(itemset, members):
+        # members: (item, bitmap of itemset + item) of every frequent extension, in mining order
+        for position, (item, bitmap) in enumerate(members):
+            extended = itemset + (item,)
+            itemsets.append((extended, bitmap.count()))
+            if len(extended) == max_length or position + 1 == len(members):
+                continue
+            rest = members[position + 1:]
+            pairs_frequent = np.isin([other for other, _ in rest], partners[item], assume_unique=True)
+            children = []
+            for (other, other_bitmap), frequent in zip(rest, pairs_frequent):
+                if frequent:
+                    joined = bitmap & other_bitmap
+                    if joined.count() >= min_count:
+                        children.append((other, joined))
+            if children:
+                grow(extended, children)
+
+    grow((first,), [(int(item), bitmaps[first] & bitmaps[item]) for item in partners[first]])
+    return itemsets
+
+
+def init_worker(shared):
+    """Store the arguments of mine_class shared by all the tasks of a worker process."""
+    global _shared
+    _shared = shared
+
+
+def mine_class_task(first):
+    """Mine the class of an item in a worker process, see mine_class."""
+    return mine_class(first, *_shared)
+
+
+def mine_frequent_itemsets(bitmaps, partners, partner_counts, min_count, max_length=4, n_jobs=1):
+    """
+    Mine the frequent itemsets of the items, class by class of first item.
+
+    The classes are independent, so with several jobs they are mined in a process
+    pool, partitioned by first item. The bitmaps are sent once per worker, and the
+    classes with the most frequent pairs are submitted first to balance the work.
+
+    Parameters:
+    bitmaps (list): Bitmap of the cocktails of every frequent item, in mining order.
+    partners (list): Frequent pair partners of every item, see frequent_partners.
+    partner_counts (list): Count of every frequent pair, see frequent_partners.
+    min_count (int): Minimum number of cocktails of a frequent itemset.
+    max_length (int): Maximum number of items of an itemset.
+    n_jobs (int): Number of worker processes, -1 uses all cores, 1 mines in the main process.
+
+    Returns:
+    dict: Positions of the items of every frequent itemset (tuple, increasing) -> number of cocktails.
+    """
+    shared = (bitmaps, partners, partner_counts, min_count, max_length)
+    workers = n_workers(n_jobs, len(bitmaps))
+    if workers == 1:
+        classes = [mine_class(first, *shared) for first in range(len(bitmaps))]
+    else:
+        firsts = sorted(range(len(bitmaps)), key=lambda first: len(partners[first]), reverse=True)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(shared,)) as pool:
+            classes = list(pool.map(mine_class_task, firsts))
+        logger.info("Mined %d item classes in %d processes", len(firsts), workers)
+    return {itemset: count for itemsets in classes for itemset, count in itemsets}
+
+
+def association_rules(itemsets, n_cocktails, min_confidence=0.5, min_lift=1.0):
+    """
+    Derive the rules 'antecedent -> item' from frequent itemsets.
+
+    Every subset of a frequent itemset is frequent, so the count of the antecedent
+    of every rule is found among the itemsets.
+
+    Parameters:
+    itemsets (dict): Items of every frequent itemset (tuple in a fixed item order) -> number of cocktails.
+    n_cocktails (int): Number of cocktails.
+    min_confidence (float): Minimum share of the cocktails with the antecedent also having the consequent.
+    min_lift (float): Minimum confidence over the share of the cocktails with the consequent.
+
+    Returns:
+    pd.DataFrame: antecedent (tuple), consequent, count, support, confidence and lift of every rule,
+                  by decreasing confidence then lift.
+    """
+    rules = []
+    for itemset, count in itemsets.items():
+        if len(itemset) < 2:
+            continue
+        for position, consequent in enumerate(itemset):
+            antecedent = itemset[:position] + itemset[position + 1:]
+            rules.append((antecedent, consequent, count, itemsets[antecedent], itemsets[(consequent,)]))
+
+    table = pd.DataFrame(rules, columns=['antecedent', 'consequent', 'count', 'antecedent_count', 'consequent_count'])
+    table['support'] = table['count'] / n_cocktails
+    table['confidence'] = table['count'] / table['antecedent_count']
+    table['lift'] = table['confidence'] * n_cocktails / table['consequent_count']
+    table = table[(table['confidence'] >= min_confidence) & (table['lift'] >= min_lift)]
+    return (table.drop(columns=['antecedent_count', 'consequent_count'])
+            .sort_values(['confidence', 'lift', 'count'], ascending=False, kind='stable', ignore_index=True))
+
+
+def maximal_itemsets(itemsets):
+    """
+    Keep the frequent itemsets without a frequent superset.
+
+    Parameters:
+    itemsets (dict): Items of every frequent itemset (tuple in a fixed item order) -> number of cocktails.
+
+    Returns:
+    dict: The maximal itemsets and their counts.
+    """
+    covered = set()
+    for itemset in itemsets:
+        if len(itemset) > 1:
+            covered.update(itemset[:position] + itemset[position + 1:] for position in range(len(itemset)))
+    return {itemset: count for itemset, count in itemsets.items() if itemset not in covered}
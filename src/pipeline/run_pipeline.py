@@ -0,0 +1,390 @@
+import os
+import sys
+import json
+import time
+import logging
+from dataclasses import dataclass
+from typing import Callable, List
+
+import hydra
+from omegaconf import DictConfig, OmegaConf
+
+# The stage scripts import their siblings and utils relative to their own directory
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path[:0] = [SRC_DIR, os.path.join(SRC_DIR, 'preprocessing_scripts'), os.path.join(SRC_DIR, 'clustering')]
+import simplify_data
+import tagging_script
+import one_hot_encode_tags
+import clustering
+import cluster_evaluation
+import cluster_model
+from utils.data_storage import (CLUSTERED_DATASET, PROCESSED_DATASET, dataset_path, raw_input_path, read_dataset,
+                                read_feature_matrix)
+from utils.ingestion import is_sharded, iter_shard_records, resolve_shards
+from utils.incremental import MANIFEST_DIR, file_hash, stable_hash
+from utils import data_storage, ingestion, ingredient_index
+from utils.instrumentation import count_rows, instrumented_main, measure
+from utils.lazy_imports import lazy_import
+
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+# Key and artifact fingerprint of every stage written by the last runs
+PIPELINE_STATE = os.path.join(MANIFEST_DIR, 'pipeline.json')
+
+# Modules reading and writing the outputs of every stage
+STORAGE_SOURCES = [data_storage, ingestion]
+
+
+@dataclass
+class Stage:
+    """
+    A stage of the pipeline DAG.
+
+    Attributes:
+    name (str): Name of the stage, also the key of its config under 'stages'.
+    inputs (list): Names of the stages whose outputs are passed to run, in order.
+    run (callable): run(cfg, global_config, *inputs) computes the output in memory.
+    save (callable): save(output, cfg, global_config) writes the output to disk.
+    load (callable): load(cfg, global_config) reads the output written by save.
+    artifact (callable): artifact(cfg, global_config) returns the file, or list of files, checked to detect a
+                         missing or replaced output. A stage may rewrite the artifact of one of its inputs in
+                         place (tagging adds the tags to the simplified dataset), the input then reads its
+                         output back from that file.
+    sources (list): Modules implementing the stage, editing them reruns the stage.
+    files (callable): files(cfg, global_config) lists the external input files, editing them reruns the stage.
+    """
+    name: str
+    inputs: List[str]
+    run: Callable
+    save: Callable
+    load: Callable
+    artifact: Callable
+    sources: list
+    files: Callable
+
+
+def run_simplify(cfg, global_config):
+    """Load the raw dataset and simplify it."""
+    input_file = raw_input_path(global_config)
+    ingestion = global_config.get('ingestion') or {}
+    n_jobs, max_pending = ingestion.get('n_jobs', -1), ingestion.get('max_pending', 2)
+    if not cfg.apply_simplification:
+        logger.info("Simplification not applied based on the config.")
+        return simplify_data.load_data(input_file, n_jobs, max_pending)
+    if cfg.mode == 'streaming':
+        # Only the simplified cocktails are kept in memory, shards are simplified in the worker processes
+        if is_sharded(input_file):
+            chunks = iter_shard_records(input_file, simplify_data.simplify_record, n_jobs, max_pending)
+        else:
+            chunks = simplify_data.iter_simplified_chunks(input_file, cfg.chunk_size)
+        return pd.DataFrame([record for chunk in chunks for record in chunk])
+    return simplify_data.simplify_cocktail_data(simplify_data.load_data(input_file, n_jobs, max_pending))
+
+
+def run_tagging(cfg, global_config, cocktails):
+    """Assign the tags to the simplified cocktails."""
+    rules = tagging_script.compile_tag_rules(cfg.tags_definitions)
+    if 'ingredients' in cocktails.columns:
+        return cocktails.assign(tags=tagging_script.tag_cocktails(cocktails['ingredients'], rules, cfg))
+
+    # Loaded from a dataset stored without the nested ingredients
+    index = ingredient_index.read_aligned_index(cocktails['id'], processed_path(cfg, global_config))
+    if index is None:
+        raise ValueError("The cocktails have no ingredients column and no matching ingredient index.")
+    return cocktails.assign(tags=tagging_script.tag_cocktails(None, rules, cfg, index))
+
+
+def run_one_hot(cfg, global_config, cocktails):
+    """One-hot encode the tags, returns (matrix, ids, columns) like read_feature_matrix."""
+    tags_indices = OmegaConf.to_container(cfg.tags_indices)
+    matrix = one_hot_encode_tags.one_hot_encode_tags(cocktails[cfg.one_hot.tag_column], tags_indices)
+    return matrix, cocktails['id'].to_numpy(), one_hot_encode_tags.tag_columns(tags_indices)
+
+
+def run_clustering(cfg, global_config, cocktails, features):
+    """Cluster the tagged cocktails on their one-hot encoded tags, returns (cocktails, model)."""
+    tags_matrix, ids, columns = features
+    if len(ids) != len(cocktails) or (ids != cocktails['id'].to_numpy()).any():
+        raise ValueError("One-hot tags do not match the cocktail data.")
+    return clustering.cluster_cocktails(cocktails.copy(deep=False), tags_matrix, columns, cfg.clustering,
+                                        cfg.tagging)
+
+
+def load_clustering(cfg, global_config):
+    model = cluster_model.read_cluster_model(cfg.clustering.model_dir) if cfg.clustering.model_dir else None
+    return read_dataset(clustered_path(cfg, global_config)), model
+
+
+def raw_files(cfg, global_config):
+    return resolve_shards(raw_input_path(global_config))
+
+
+def no_files(cfg, global_config):
+    return []
+
+
+def processed_path(cfg, global_config):
+    return dataset_path(PROCESSED_DATASET, global_config.storage.format)
+
+
+def processed_artifacts(cfg, global_config):
+    # The ingredient index is written with the processed dataset, meta.json last
+    return [processed_path(cfg, global_config), os.path.join(ingredient_index.INGREDIENT_INDEX, 'meta.json')]
+
+
+def save_tagging(cocktails, cfg, global_config):
+    """Write the tagged cocktails over the simplified dataset and keep its ingredient index in sync."""
+    path = processed_path(cfg, global_config)
+    # Cocktails without their ingredients were tagged on the index of the dataset they were loaded from
+    indexed = 'ingredients' not in cocktails.columns and ingredient_index.index_matches(path)
+    tagging_script.save_simplified_data(cocktails, path, global_config.storage, indexed)
+
+
+def features_path(cfg, global_config):
+    # meta.json is written last by write_feature_matrix
+    return os.path.join(cfg.one_hot.output_path, 'meta.json')
+
+
+def clustered_path(cfg, global_config):
+    return dataset_path(CLUSTERED_DATASET, global_config.storage.format)
+
+
+# Stages in topological order
+STAGES = {
+    'simplify': Stage(
+        'simplify', [], run_simplify,
+        save=lambda cocktails, cfg, global_config: simplify_data.save_simplified_data(
+            cocktails, processed_path(cfg, global_config), global_config.storage),
+        load=lambda cfg, global_config: read_dataset(processed_path(cfg, global_config)),
+        artifact=processed_artifacts, sources=[simplify_data, ingredient_index] + STORAGE_SOURCES, files=raw_files,
+    ),
+    'tagging': Stage(
+        'tagging', ['simplify'], run_tagging,
+        save=save_tagging,
+        load=lambda cfg, global_config: read_dataset(processed_path(cfg, global_config)),
+        artifact=processed_artifacts, sources=[tagging_script, ingredient_index] + STORAGE_SOURCES,
+        files=no_files,
+    ),
+    'one_hot': Stage(
+        'one_hot', ['tagging'], run_one_hot,
+        save=lambda features, cfg, global_config: one_hot_encode_tags.save_encoded_data(*features, cfg.one_hot.output_path),
+        load=lambda cfg, global_config: read_feature_matrix(cfg.one_hot.output_path),
+        artifact=features_path, sources=[one_hot_encode_tags] + STORAGE_SOURCES, files=no_files,
+    ),
+    'clustering': Stage(
+        'clustering', ['tagging', 'one_hot'], run_clustering,
+        save=lambda output, cfg, global_config: clustering.save_clustered_data(
+            output[0], global_config.storage, output[1], cfg.clustering.model_dir),
+        load=load_clustering,
+        artifact=clustered_path, sources=[clustering, cluster_evaluation, cluster_model] + STORAGE_SOURCES,
+        files=no_files,
+    ),
+}
+
+
+def artifact_fingerprint(path):
+    """
+    Fingerprint of a written artifact, used to detect it was replaced outside the pipeline.
+
+    Parameters:
+    path (str or list): Path to the artifact, or to every file of the artifact.
+
+    Returns:
+    list: [size, modification time in ns], one per file for a list, None if a file does not exist.
+    """
+    if isinstance(path, list):
+        fingerprints = [artifact_fingerprint(file) for file in path]
+        return None if None in fingerprints else fingerprints
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Pipeline:
+    """
+    Run stages of a DAG in one process, passing their outputs in memory.
+
+    Every stage has a key hashing its config, the global config, its source
+    code, its external input files and the keys of its inputs, so the keys of
+    all stages are known before anything runs. A stage whose key and artifact
+    match the ones recorded when it was last written is up to date: it is
+    skipped, and its artifact is only loaded if a stage depending on it runs.
+
+    Parameters:
+    stages (dict): Stage name -> Stage, in topological order.
+    stage_cfgs (DictConfig): Config of every stage, by name.
+    global_config (DictConfig): The global configuration.
+    write_intermediate (bool): Write the output of every stage that runs, not only of the targets.
+    force (bool): Run the needed stages even if they are up to date.
+    state_file (str): File with the keys of the stages written by the last runs.
+    """
+
+    def __init__(self, stages, stage_cfgs, global_config, write_intermediate=False, force=False,
+                 state_file=PIPELINE_STATE):
+        self.stages = stages
+        self.stage_cfgs = stage_cfgs
+        self.global_config = global_config
+        self.write_intermediate = write_intermediate
+        self.force = force
+        self.state_file = state_file
+        self.state = self.load_state()
+        self.keys = self.stage_keys()
+        self.outputs = {}
+        self.targets = []
+
+    def load_state(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file) as state_file:
+            return json.load(state_file)
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        with open(self.state_file, 'w') as state_file:
+            json.dump(self.state, state_file, indent=4)
+
+    def stage_keys(self):
+        """
+        Compute the content key of every stage.
+
+        Returns:
+        dict: Stage name -> key.
+        """
+        # The analysis result cache does not change the outputs of the stages
+        global_config = {section: value for section, value in OmegaConf.to_container(self.global_config).items()
+                         if section != 'cache'}
+        keys = {}
+        for name, stage in self.stages.items():
+            keys[name] = stable_hash({
+                'config': OmegaConf.to_container(self.stage_cfgs[name]),
+                'global_config': global_config,
+                'sources': [file_hash(module.__file__) for module in stage.sources],
+                'files': [file_hash(path) for path in stage.files(self.stage_cfgs[name], self.global_config)],
+                'inputs': [keys[dependency] for dependency in stage.inputs],
+            })
+        return keys
+
+    def upstream(self, name):
+        """Names of the stages a stage depends on, directly or through other stages."""
+        names = []
+        for dependency in self.stages[name].inputs:
+            for other in [dependency] + self.upstream(dependency):
+                if other not in names:
+                    names.append(other)
+        return names
+
+    def record(self, name):
+        """
+        Record the key and artifact of a stage whose output was just written.
+
+        An up-to-date input whose artifact is the same file was rewritten in place
+        by the stage (the simplified dataset with the tags added), so its output
+        is now stored in the new file: it is recorded with it and stays up to date.
+
+        Parameters:
+        name (str): Name of the stage.
+        """
+        path = self.stages[name].artifact(self.stage_cfgs[name], self.global_config)
+        artifact = artifact_fingerprint(path)
+        self.state[name] = {'key': self.keys[name], 'artifact': artifact}
+        for dependency in self.upstream(name):
+            same_file = self.stages[dependency].artifact(self.stage_cfgs[dependency], self.global_config) == path
+            if same_file and self.state.get(dependency, {}).get('key') == self.keys[dependency]:
+                self.state[dependency]['artifact'] = artifact
+        self.save_state()
+
+    def is_up_to_date(self, name):
+        """
+        Check whether the artifact of a stage was written with the current key and not replaced since.
+
+        Parameters:
+        name (str): Name of the stage.
+
+        Returns:
+        bool: True if the stage can be skipped.
+        """
+        if self.force:
+            return False
+        stage = self.stages[name]
+        recorded = self.state.get(name, {})
+        artifact = artifact_fingerprint(stage.artifact(self.stage_cfgs[name], self.global_config))
+        return artifact is not None and recorded.get('key') == self.keys[name] and recorded.get('artifact') == artifact
+
+    def output(self, name):
+        """
+        Get the output of a stage, running it and the stages it depends on if needed.
+
+        Parameters:
+        name (str): Name of the stage.
+
+        Returns:
+        The output of the stage.
+        """
+        if name in self.outputs:
+            return self.outputs[name]
+
+        stage = self.stages[name]
+        cfg = self.stage_cfgs[name]
+        if self.is_up_to_date(name):
+            logger.info("Stage '%s' is up to date, loading its output", name)
+            with measure(f"load_{name}"):
+                self.outputs[name] = stage.load(cfg, self.global_config)
+            return self.outputs[name]
+
+        inputs = [self.output(dependency) for dependency in stage.inputs]
+        logger.info("Running stage '%s'", name)
+        start = time.perf_counter()
+        with measure(name) as metrics:
+            output = stage.run(cfg, self.global_config, *inputs)
+            metrics.rows = count_rows(output[0] if isinstance(output, tuple) else output)
+        logger.info("Stage '%s' done in %.2fs", name, time.perf_counter() - start)
+
+        if self.write_intermediate or name in self.targets:
+            with measure(f"save_{name}"):
+                stage.save(output, cfg, self.global_config)
+            self.record(name)
+
+        self.outputs[name] = output
+        return output
+
+    def run(self, targets):
+        """
+        Produce the target stages, skipping the up-to-date ones.
+
+        Parameters:
+        targets (list): Names of the stages to produce.
+        """
+        self.targets = [name for name in self.stages if name in targets]
+        for name in self.targets:
+            if self.is_up_to_date(name):
+                logger.info("Stage '%s' is up to date, skipped", name)
+            else:
+                self.output(name)
+
+
+@hydra.main(version_base=None, config_path="../../configs", config_name="pipeline_configs/pipeline_config")
+@instrumented_main
+def main(cfg: DictConfig):
+    """
+    Run the preprocessing and clustering stages in one process.
+
+    Parameters:
+    cfg (DictConfig): Pipeline configuration with the config of every stage under 'stages'.
+    """
+    global_config = OmegaConf.load("configs/global_configs.yaml")
+
+    unknown = [name for name in cfg.targets if name not in STAGES]
+    if unknown:
+        logger.critical("Unknown pipeline stages %s. Use any of %s.", unknown, list(STAGES))
+        return None
+
+    pipeline = Pipeline(STAGES, cfg.stages, global_config, cfg.write_intermediate, cfg.force)
+    pipeline.run(list(cfg.targets))
+    logger.info("Pipeline complete!")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,68 +1,137 @@
 import hydra
 from omegaconf import DictConfig, OmegaConf
 import logging
-import pandas as pd
-import numpy as np
 import os  # Ensure we can handle directory creation
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.data_storage import input_dataset_path, read_dataset, read_feature_matrix, write_feature_matrix
+from utils.incremental import diff_records, load_manifest, save_manifest, stable_hash
+from utils.instrumentation import instrumented, instrumented_main, measure
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+sparse = lazy_import('scipy.sparse')
 
 # Configuring logging
 logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
 
 
-def create_tag_vector(tags, tags_indices):
+def tag_columns(tags_indices):
     """
-    Create a binary vector based on tags and indices.
+    List the tag name of every column of the one-hot matrix.
 
     Parameters:
-    tags (list): List of tags.
     tags_indices (dict): Dictionary mapping tags to indices.
 
     Returns:
-    np.ndarray: Binary vector representing the presence of tags.
+    list: Tag name at every index, None for indices without a tag.
     """
-    if not tags or not isinstance(tags, list):
-        return np.zeros(max(tags_indices.values()) + 1, dtype=int)  # Return zero vector if tags is None or not iterable
-
-    vector = np.zeros(max(tags_indices.values()) + 1, dtype=int)
-    for tag in tags:
-        index = tags_indices.get(tag)
-        if index is not None:
-            vector[index] = 1
-    return vector
+    columns = [None] * (max(tags_indices.values()) + 1)
+    for tag, index in tags_indices.items():
+        columns[index] = tag
+    return columns
 
 
-def one_hot_encode_tags(cocktails_df, tags_column, output_column, tags_indices):
+@instrumented
+def one_hot_encode_tags(tags_series, tags_indices):
     """
-    Generate one-hot encoding for tags based on tags_indices.
+    Generate a sparse one-hot encoding for tags based on tags_indices.
+
+    The tags are exploded once and mapped to their column index in a single
+    vectorized pass (like MultiLabelBinarizer), so memory scales with the number
+    of tags present rather than rows x vocabulary.
 
     Parameters:
-    cocktails_df (pd.DataFrame): DataFrame containing cocktail data.
-    tags_column (str): Column name containing tags.
-    output_column (str): Column name for the output one-hot encoded tags.
+    tags_series (pd.Series): Column containing the list of tags of every cocktail.
     tags_indices (dict): Dictionary mapping tags to indices.
 
     Returns:
-    pd.DataFrame: DataFrame with one-hot encoded tags.
+    sparse.csr_matrix: uint8 matrix with one row per cocktail and max(tags_indices) + 1 columns.
     """
-    cocktails_df[output_column] = cocktails_df[tags_column].apply(
-        lambda tags: create_tag_vector(tags, tags_indices).tolist()
+    tags_indices = dict(tags_indices)
+    n_columns = max(tags_indices.values()) + 1
+
+    # Rows with None or empty tags explode to NaN and are dropped
+    exploded = tags_series.reset_index(drop=True).explode().dropna()
+    indices = exploded.map(tags_indices).dropna()
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.uint8),
+         (indices.index.to_numpy(), indices.to_numpy(dtype=np.int32))),
+        shape=(len(tags_series), n_columns),
     )
-    return cocktails_df
 
+    # Tags listed twice for the same cocktail are summed by scipy, keep them binary
+    matrix.data[:] = 1
+    return matrix
+
+
+@instrumented
+def encode_incrementally(cocktails, tags_column, tags_indices, directory):
+    """
+    Encode only the cocktails whose tags changed since the previous run.
+
+    The rows of unchanged cocktails are taken from the existing one-hot matrix
+    and the result follows the order of the cocktails. Everything is encoded
+    again if tags_indices changed or there is no existing matrix.
 
-def save_encoded_data(df, file_path):
+    Parameters:
+    cocktails (pd.DataFrame): DataFrame with 'id' and tags columns.
+    tags_column (str): Column name containing tags.
+    tags_indices (dict): Dictionary mapping tags to indices.
+    directory (str): Directory of the existing one-hot matrix.
+
+    Returns:
+    sparse.csr_matrix: One-hot encoded tags of all cocktails.
     """
-    Save the DataFrame with one-hot encoded tags to a JSON file.
+    config = {'tags_indices': tags_indices}
+    manifest = load_manifest('one_hot')
+    ids = cocktails['id'].to_numpy()
+    hashes = [stable_hash(tags) for tags in cocktails[tags_column]]
+    changed, _ = diff_records(ids, hashes, manifest)
+
+    full_run = manifest['config_hash'] != stable_hash(config) or not os.path.exists(os.path.join(directory, 'meta.json'))
+    if full_run:
+        changed[:] = True
+    else:
+        # Not memory-mapped, the files are overwritten below
+        previous, previous_ids, _ = read_feature_matrix(directory, mmap=False)
+        previous_rows = pd.Index(previous_ids).get_indexer(ids)
+        changed |= previous_rows < 0
+
+    positions = np.flatnonzero(changed)
+    logging.info("Encoding %d of %d cocktails", len(positions), len(ids))
+    encoded = one_hot_encode_tags(cocktails[tags_column].iloc[positions], tags_indices)
+
+    if not changed.all():
+        # Pick every row either from the previous matrix or from the newly encoded rows
+        source_rows = previous_rows.copy()
+        source_rows[positions] = previous.shape[0] + np.arange(len(positions))
+        encoded = sparse.vstack([previous, encoded], format='csr')[source_rows]
+
+    save_manifest('one_hot', config, ids, hashes)
+    return encoded
+
+
+@instrumented
+def save_encoded_data(matrix, ids, columns, directory):
+    """
+    Save the one-hot encoded tags as a compact sparse artifact.
 
     Parameters:
-    df (pd.DataFrame): DataFrame to be saved.
-    file_path (str): Path to the output JSON file.
+    matrix (sparse.csr_matrix): One-hot encoded tags.
+    ids (array-like): Cocktail id of every row.
+    columns (list): Tag name of every column.
+    directory (str): Path to the output directory.
     """
-    df.to_json(file_path, orient='records', indent=4)
-    logging.info("Data saved successfully to %s", file_path)  # Log success
+    write_feature_matrix(matrix, ids, columns, directory)
+    logging.info("Data saved successfully to %s", directory)  # Log success
 
 
 @hydra.main(version_base=None, config_path="../../configs/preprocessing_configs", config_name="one_hot_encoding_config")
+@instrumented_main
 def main(cfg: DictConfig):
     """
     Main function to perform one-hot encoding of tags and save the result.
@@ -74,38 +143,41 @@ def main(cfg: DictConfig):
     global_config = OmegaConf.load("configs/global_configs.yaml")
 
     # Access tags indices directly from the config
-    tags_indices = cfg.tags_indices
+    tags_indices = OmegaConf.to_container(cfg.tags_indices)
+    tags_column = cfg.one_hot.tag_column
 
     # Select data file based on data type in global config
-    input_file = 'data/processed/processed_cocktail_dataset.json' if global_config.data_type == 'processed' else 'data/raw/cocktail_dataset.json'
-    output_file = 'data/processed/processed_cocktail_dataset.json'
+    input_file = input_dataset_path(global_config)
+    output_dir = cfg.one_hot.output_path
 
-    # Load data
+    # Load data, only the ids and tags are needed
     try:
-        cocktails = pd.read_json(input_file)
+        with measure('load_data') as stage:
+            cocktails = read_dataset(input_file, columns=['id', tags_column])
+            stage.rows = len(cocktails)
         logging.info("Loaded data successfully from %s", input_file)
     except Exception as e:
         logging.critical("Error loading data: %s", e)
         return None
 
-    # Ensure 'tags' column exists and is not None or empty
-    if 'tags' not in cocktails.columns or cocktails['tags'].isnull().any():
-        logging.critical("Tags column 'tags' not found or contains null values in DataFrame. Available columns: %s", cocktails.columns.tolist())
+    # Ensure the tags column does not contain None values
+    if cocktails[tags_column].isnull().any():
+        logging.critical("Tags column '%s' contains null values in DataFrame.", tags_column)
         return None
 
     # Log some example tags for debugging
-    logging.debug("Example tags: %s", cocktails['tags'].head())
+    logging.debug("Example tags: %s", cocktails[tags_column].head())
 
     # Perform one-hot encoding on the tags column
     logging.info("Starting one-hot encoding of tags")
-    cocktails = one_hot_encode_tags(cocktails, 'tags', cfg.one_hot.output_column_prefix, tags_indices)
-
-    # Ensure output directory exists
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    if global_config.incremental:
+        matrix = encode_incrementally(cocktails, tags_column, tags_indices, output_dir)
+    else:
+        matrix = one_hot_encode_tags(cocktails[tags_column], tags_indices)
 
     # Save the encoded data
-    logging.info("Saving one-hot encoded data to %s", output_file)
-    save_encoded_data(cocktails, output_file)
+    logging.info("Saving one-hot encoded tags to %s", output_dir)
+    save_encoded_data(matrix, cocktails['id'].to_numpy(), tag_columns(tags_indices), output_dir)
     logging.info("One-hot encoding process complete!")
 
 
@@ -1,11 +1,32 @@
-import pandas as pd
+import os
+import sys
 import logging
+from functools import partial
+from itertools import islice
 import hydra
-from omegaconf import DictConfig
+from omegaconf import DictConfig, OmegaConf
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.data_storage import (PROCESSED_DATASET, dataset_path, iter_json_array, merge_schemas, raw_input_path,
+                                read_dataset, write_dataset, write_record_chunks)
+from utils.ingestion import is_sharded, iter_shard_records, iter_shard_schemas, read_records
+from utils.incremental import diff_records, load_manifest, merge_by_id, save_manifest, stable_hash
+from utils.instrumentation import instrumented, instrumented_main
+from utils.ingredient_index import (INGREDIENT_INDEX, IngredientIndexBuilder, attach_ingredients,
+                                    build_ingredient_index, index_matches, read_aligned_index,
+                                    write_ingredient_index)
+from utils.lazy_imports import lazy_import
+
+pd = lazy_import('pandas')
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Keys removed from every cocktail and from every ingredient of a cocktail
+DROPPED_COCKTAIL_KEYS = ['createdAt', 'updatedAt', 'imageUrl', 'instructions']
+DROPPED_INGREDIENT_KEYS = ['createdAt', 'updatedAt', 'imageUrl', 'description']
+
 
+@instrumented
 def simplify_cocktail_data(df):
     """
     Simplify the cocktail data by removing unnecessary columns and simplifying the ingredients data.
@@ -17,41 +38,188 @@ def simplify_cocktail_data(df):
     pd.DataFrame: The simplified DataFrame.
     """
     # Drop unnecessary columns
-    df = df.drop(columns=['createdAt', 'updatedAt', 'imageUrl', 'instructions'], errors='ignore')
+    df = df.drop(columns=DROPPED_COCKTAIL_KEYS, errors='ignore')
 
     df['ingredients'] = df['ingredients'].apply(lambda ingredients: [
-        {k: v for k, v in ingredient.items() if k not in ['createdAt', 'updatedAt', 'imageUrl', 'description']}
+        {k: v for k, v in ingredient.items() if k not in DROPPED_INGREDIENT_KEYS}
         for ingredient in ingredients
     ])
 
     return df
 
 
-def load_data(file_path):
+def simplify_record(record):
+    """
+    Simplify a single raw cocktail record, like simplify_cocktail_data does for a DataFrame.
+
+    Parameters:
+    record (dict): Raw cocktail.
+
+    Returns:
+    dict: The simplified cocktail.
+    """
+    simplified = {k: v for k, v in record.items() if k not in DROPPED_COCKTAIL_KEYS}
+    simplified['ingredients'] = [
+        {k: v for k, v in ingredient.items() if k not in DROPPED_INGREDIENT_KEYS}
+        for ingredient in simplified['ingredients']
+    ]
+    return simplified
+
+
+def iter_simplified_chunks(input_file, chunk_size):
+    """
+    Stream the raw JSON array and yield the simplified cocktails in chunks.
+
+    Every cocktail is simplified as soon as it is parsed, so the long strings
+    that are dropped (instructions, ingredient descriptions) never accumulate.
+
+    Parameters:
+    input_file (str): The path to the raw JSON file.
+    chunk_size (int): Number of cocktails per chunk.
+
+    Yields:
+    list: The next chunk of simplified cocktail dicts.
+    """
+    records = map(simplify_record, iter_json_array(input_file))
+    while True:
+        chunk = list(islice(records, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@instrumented
+def simplify_streaming(input_file, output_file, chunk_size, storage, n_jobs=1, max_pending=2):
+    """
+    Simplify the raw data in chunks, with memory bounded by the chunk size.
+
+    The ingredient index is built from the chunks as they are written, only
+    its integer edges and the distinct ingredients are kept in memory.
+
+    A sharded raw dataset is decoded and simplified shard by shard in a process
+    pool, every shard being a chunk. The schema of the output is merged from
+    the shard schemas, inferred in a first parallel pass.
+
+    Parameters:
+    input_file (str): The path to the raw JSON file, or a glob, directory or manifest of JSON shards.
+    output_file (str): The path to the processed dataset. The format follows the extension.
+    chunk_size (int): Number of cocktails per chunk of a single raw file.
+    storage (DictConfig): The 'storage' section of the global config.
+    n_jobs (int): Worker processes decoding the shards, -1 uses all cores.
+    max_pending (int): Shards in flight per worker.
+    """
+    builder = None
+    schema = None
+    if is_sharded(input_file):
+        source = partial(iter_shard_records, input_file, simplify_record, n_jobs, max_pending)
+        if storage.format != 'json':
+            schema = merge_schemas(iter_shard_schemas(input_file, simplify_record, n_jobs, max_pending))
+            if storage.normalize_ingredients:
+                schema = schema.remove(schema.get_field_index('ingredients'))
+    else:
+        source = partial(iter_simplified_chunks, input_file, chunk_size)
+
+    def chunks():
+        nonlocal builder
+        # write_record_chunks may read the chunks twice, only the last pass is indexed
+        builder = IngredientIndexBuilder()
+        for chunk in source():
+            builder.add([record['id'] for record in chunk], [record['ingredients'] for record in chunk])
+            if storage.normalize_ingredients:
+                chunk = [{k: v for k, v in record.items() if k != 'ingredients'} for record in chunk]
+            yield chunk
+
+    n_records = write_record_chunks(chunks, output_file, schema)
+    write_ingredient_index(builder.build(), INGREDIENT_INDEX, storage.format, output_file)
+    logging.info("Simplified %d cocktails in chunks", n_records)
+
+
+@instrumented
+def load_data(file_path, n_jobs=-1, max_pending=2):
     """
-    Load JSON data from a specified file path into a DataFrame.
+    Load data from a specified file path into a DataFrame.
 
     Parameters:
-    file_path (str): The path to the JSON file.
+    file_path (str): The path to the JSON, Parquet or Arrow file, or a glob, directory or manifest of JSON shards.
+    n_jobs (int): Worker processes decoding the shards, -1 uses all cores.
+    max_pending (int): Shards in flight per worker.
 
     Returns:
     pd.DataFrame: The DataFrame containing the loaded data.
     """
-    return pd.read_json(file_path)
+    if is_sharded(file_path):
+        return pd.DataFrame(read_records(file_path, n_jobs=n_jobs, max_pending=max_pending))
+    return read_dataset(file_path)
 
 
-def save_simplified_data(df, file_path):
+@instrumented
+def save_simplified_data(df, file_path, storage):
     """
-    Save the simplified DataFrame to a JSON file.
+    Save the simplified DataFrame and its ingredient index to the processed dataset store.
 
     Parameters:
     df (pd.DataFrame): The DataFrame to save.
-    file_path (str): The path to the output JSON file.
+    file_path (str): The path to the output file. The format follows the extension.
+    storage (DictConfig): The 'storage' section of the global config. With
+                          normalize_ingredients, the nested ingredients are only stored in the index.
+    """
+    index = build_ingredient_index(df['id'], df['ingredients'])
+    if storage.normalize_ingredients:
+        df = df.drop(columns=['ingredients'])
+    write_dataset(df, file_path)
+    # Written after the dataset, whose content hash it records
+    write_ingredient_index(index, INGREDIENT_INDEX, storage.format, file_path)
+
+
+@instrumented
+def simplify_incrementally(input_file, output_file, cfg, storage, n_jobs=1, max_pending=2):
     """
-    df.to_json(file_path, orient='records', indent=4)
+    Simplify only the new and updated cocktails and merge them into the processed store.
+
+    Every raw cocktail is hashed and compared with the manifest of the previous
+    run. Everything is reprocessed if the config changed or there is no
+    processed dataset yet.
+
+    Parameters:
+    input_file (str): The path to the raw JSON file, or a glob, directory or manifest of JSON shards.
+    output_file (str): The path to the processed dataset.
+    cfg (DictConfig): The Hydra configuration object.
+    storage (DictConfig): The 'storage' section of the global config.
+    n_jobs (int): Worker processes decoding the shards, -1 uses all cores.
+    max_pending (int): Shards in flight per worker.
+    """
+    records = read_records(input_file, n_jobs=n_jobs, max_pending=max_pending)
+
+    ids = [record['id'] for record in records]
+    hashes = [stable_hash(record) for record in records]
+    config = dict(OmegaConf.to_container(cfg), normalize_ingredients=storage.normalize_ingredients)
+    manifest = load_manifest('simplify')
+
+    changed, removed = diff_records(ids, hashes, manifest)
+    full_run = (manifest['config_hash'] != stable_hash(config) or not os.path.exists(output_file)
+                or not index_matches(output_file))
+    if full_run:
+        changed[:] = True
+    elif not changed.any() and not removed:
+        logging.info("No new or updated cocktails, %s is up to date.", output_file)
+        return
+
+    logging.info("Simplifying %d new or updated cocktails, removing %d", changed.sum(), len(removed))
+    updated_df = simplify_cocktail_data(pd.DataFrame([record for record, is_changed in zip(records, changed) if is_changed]))
+
+    if not full_run:
+        existing_df = load_data(output_file)
+        if 'ingredients' not in existing_df.columns:
+            # Stored normalized, the unchanged cocktails get their ingredients from the index
+            existing_df = attach_ingredients(existing_df, read_aligned_index(existing_df['id'], output_file))
+        updated_df = merge_by_id(existing_df, updated_df, ids)
+
+    save_simplified_data(updated_df, output_file, storage)
+    save_manifest('simplify', config, ids, hashes)
 
 
 @hydra.main(version_base=None, config_path="../../configs/preprocessing_configs", config_name="data_simplification_config")
+@instrumented_main
 def main(cfg: DictConfig):
     """
     Main function to simplify the cocktail data.
@@ -59,20 +227,36 @@ def main(cfg: DictConfig):
     Parameters:
     cfg (DictConfig): The Hydra configuration object.
     """
-    input_file = 'data/raw/cocktail_dataset.json'
-    output_file = 'data/processed/processed_cocktail_dataset.json'
+    global_config = OmegaConf.load("configs/global_configs.yaml")
+
+    input_file = raw_input_path(global_config)
+    output_file = dataset_path(PROCESSED_DATASET, global_config.storage.format)
+    ingestion = global_config.get('ingestion') or {}
+    n_jobs, max_pending = ingestion.get('n_jobs', -1), ingestion.get('max_pending', 2)
+
+    # Only process new and updated cocktails if enabled in global config
+    if cfg.apply_simplification and global_config.incremental:
+        simplify_incrementally(input_file, output_file, cfg, global_config.storage, n_jobs, max_pending)
+        logging.info("Data processing complete!")
+        return
+
+    # Stream the raw file instead of loading it at once if enabled in the config
+    if cfg.apply_simplification and cfg.mode == 'streaming':
+        simplify_streaming(input_file, output_file, cfg.chunk_size, global_config.storage, n_jobs, max_pending)
+        logging.info("Data processing complete!")
+        return
 
     logging.debug("Loading data from %s", input_file)
-    df = load_data(input_file)
+    df = load_data(input_file, n_jobs, max_pending)
 
     # Apply simplification if specified in the config
     if cfg.apply_simplification:
         logging.debug("Simplifying the data")
         simplified_df = simplify_cocktail_data(df)
 
-        # Save the simplified data back to JSON
+        # Save the simplified data to the processed store
         logging.debug("Saving simplified data to %s", output_file)
-        save_simplified_data(simplified_df, output_file)
+        save_simplified_data(simplified_df, output_file, global_config.storage)
     else:
         logging.info("Simplification not applied based on the config.")
 
@@ -1,35 +1,151 @@
+import os
+import sys
 import hydra
 from omegaconf import DictConfig, OmegaConf
 import logging
-import pandas as pd
+from dataclasses import dataclass, field
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from utils.data_storage import PROCESSED_DATASET, dataset_path, input_dataset_path, read_dataset, write_dataset
+from utils.incremental import diff_records, load_manifest, save_manifest, stable_hash
+from utils.instrumentation import instrumented, instrumented_main, measure
+from utils.ingredient_index import attach_ingredients, read_aligned_index, update_ingredient_index
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+sparse = lazy_import('scipy.sparse')
 
 # Configuring logging
 logging.basicConfig(level=logging.DEBUG, format='%(levelname)s - %(message)s')
 
 
-def assign_classic_tags(cocktail, classic_definitions):
+@dataclass
+class TagRules:
+    """
+    Tag definitions compiled into an inverted index.
+
+    Every defined tag gets its own bit, so the tags of an ingredient are a single
+    integer bitmask and a cocktail is tagged with one dict lookup per ingredient,
+    regardless of how many tags or ingredients per tag are defined.
+
+    Attributes:
+    tags (list): Tag names, the tag at position i is represented by bit i.
+    index (dict): Ingredient name -> bitmask of the tags listing that ingredient.
+    classic_mask (int): Bit of the 'Classic' definition in classic_tags.
+    new_era_mask (int): Bit of the 'NewEra' definition in classic_tags.
+    non_vegan_mask (int): Bit of the 'NonVegan' definition in vegan_vegetarian_tags.
+    non_vegetarian_mask (int): Bit of the 'NonVegetarian' definition in vegan_vegetarian_tags.
+    other_mask (int): Bits of all definitions in other_tags.
+    combination_mask (int): Bits of all definitions in combination_tags.
+    combination_sizes (dict): Bit of every combination_tags definition -> number of distinct
+                              ingredients a cocktail must all contain to get its tag.
+    """
+    tags: list
+    index: dict
+    classic_mask: int = 0
+    new_era_mask: int = 0
+    non_vegan_mask: int = 0
+    non_vegetarian_mask: int = 0
+    other_mask: int = 0
+    combination_mask: int = 0
+    combination_sizes: dict = field(default_factory=dict)
+
+
+@instrumented
+def compile_tag_rules(tags_definitions):
+    """
+    Compile the tag definitions from the config into an inverted index.
+
+    The definitions of other_tags match a cocktail containing any of their
+    ingredients, the definitions of combination_tags a cocktail containing all of them.
+
+    Parameters:
+    tags_definitions (DictConfig): The 'tags_definitions' section of tagging_config.yaml.
+
+    Returns:
+    TagRules: The compiled rules.
+    """
+    tags = []
+    index = {}
+    group_bits = {}
+    combination_sizes = {}
+
+    for group in ('classic_tags', 'vegan_vegetarian_tags', 'other_tags', 'combination_tags'):
+        group_bits[group] = {}
+        for definition in tags_definitions.get(group) or []:
+            bit = 1 << len(tags)
+            if group == 'combination_tags':
+                combination_sizes[len(tags)] = len(set(definition['ingredients']))
+            tags.append(definition['tag'])
+            group_bits[group][definition['tag']] = group_bits[group].get(definition['tag'], 0) | bit
+            for name in definition['ingredients']:
+                index[name] = index.get(name, 0) | bit
+
+    return TagRules(
+        tags=tags,
+        index=index,
+        classic_mask=group_bits['classic_tags'].get('Classic', 0),
+        new_era_mask=group_bits['classic_tags'].get('NewEra', 0),
+        non_vegan_mask=group_bits['vegan_vegetarian_tags'].get('NonVegan', 0),
+        non_vegetarian_mask=group_bits['vegan_vegetarian_tags'].get('NonVegetarian', 0),
+        other_mask=sum(group_bits['other_tags'].values()),
+        combination_mask=sum(group_bits['combination_tags'].values()),
+        combination_sizes=combination_sizes,
+    )
+
+
+def mask_bits(mask):
+    """
+    List the positions of the bits set in a bitmask.
+
+    Parameters:
+    mask (int): Bitmask of tags.
+
+    Returns:
+    list: Bit positions in ascending order.
+    """
+    bits = []
+    while mask:
+        lowest_bit = mask & -mask
+        bits.append(lowest_bit.bit_length() - 1)
+        mask ^= lowest_bit
+    return bits
+
+
+def decode_tags(mask, rules):
+    """
+    Convert a bitmask back to the list of tag names.
+
+    Parameters:
+    mask (int): Bitmask of tags.
+    rules (TagRules): The compiled rules.
+
+    Returns:
+    list: Tag names in definition order.
+    """
+    return [rules.tags[bit] for bit in mask_bits(mask)]
+
+
+def assign_classic_tags(cocktail, rules):
     """
     Assign classic, contemporary classic, or new era tags to a cocktail based on ingredient structure.
 
     Parameters:
     cocktail (dict): The cocktail data.
-    classic_definitions (list): Definitions for classic tags.
+    rules (TagRules): The compiled tag rules.
     
     Returns:
     list: List of assigned tags.
     """
-    ingredients_map = {definition['tag']: definition['ingredients'] for definition in classic_definitions}
-
-    classic_ingredients = ingredients_map.get('Classic', [])
-    new_era_ingredients = ingredients_map.get('NewEra', [])
-
     classic_count = 0
     new_era_count = 0
 
     for ingredient in cocktail['ingredients']:
-        if ingredient.get('name') in classic_ingredients:
+        mask = rules.index.get(ingredient.get('name'), 0)
+        if mask & rules.classic_mask:
             classic_count += 1
-        elif ingredient.get('name') in new_era_ingredients:
+        elif mask & rules.new_era_mask:
             new_era_count += 1
 
     if classic_count > 0 and new_era_count == 0:
@@ -42,120 +158,469 @@ def assign_classic_tags(cocktail, classic_definitions):
     return []
 
 
-def assign_vegan_vegetarian_tags(cocktail, vegan_definitions):
+def ingredients_mask(cocktail, rules):
     """
-    Assign vegan or vegetarian tags by excluding non-vegan/vegetarian ingredients.
+    Combine the tag bitmasks of all ingredients of a cocktail.
 
     Parameters:
     cocktail (dict): The cocktail data.
-    vegan_definitions (list): Definitions for vegan and vegetarian tags.
-    
+    rules (TagRules): The compiled tag rules.
+
     Returns:
-    list: List of assigned tags.
+    int: Bitmask of every tag listing at least one of the cocktail's ingredients.
     """
-    vegan_map = {definition['tag']: definition['ingredients'] for definition in vegan_definitions}
+    mask = 0
+    for ingredient in cocktail['ingredients']:
+        mask |= rules.index.get(ingredient.get('name'), 0)
+    return mask
 
-    non_vegan_ingredients = vegan_map.get('NonVegan', [])
-    non_vegetarian_ingredients = vegan_map.get('NonVegetarian', [])
 
-    vegan = True
-    vegetarian = True
+def assign_vegan_vegetarian_tags(cocktail, rules, mask=None):
+    """
+    Assign vegan or vegetarian tags by excluding non-vegan/vegetarian ingredients.
 
-    for ingredient in cocktail['ingredients']:
-        if ingredient.get('name') in non_vegan_ingredients:
-            vegan = False
-        if ingredient.get('name') in non_vegetarian_ingredients:
-            vegetarian = False
+    Parameters:
+    cocktail (dict): The cocktail data.
+    rules (TagRules): The compiled tag rules.
+    mask (int): Precomputed ingredients_mask of the cocktail, computed if None.
+    
+    Returns:
+    list: List of assigned tags.
+    """
+    if mask is None:
+        mask = ingredients_mask(cocktail, rules)
 
     tags = []
-    if vegan:
+    if not mask & rules.non_vegan_mask:
         tags.append('Vegan')
-    if vegetarian:
+    if not mask & rules.non_vegetarian_mask:
         tags.append('Vegetarian')
 
     return tags
 
 
-def assign_other_tags(cocktail, other_definitions):
+def assign_other_tags(cocktail, rules, mask=None):
     """
     Assign other tags based on additional definitions.
 
     Parameters:
     cocktail (dict): The cocktail data.
-    other_definitions (list): Definitions for other tags.
+    rules (TagRules): The compiled tag rules.
+    mask (int): Precomputed ingredients_mask of the cocktail, computed if None.
     
     Returns:
     list: List of assigned tags.
     """
-    other_tags_map = {definition['tag']: definition['ingredients'] for definition in other_definitions}
+    if mask is None:
+        mask = ingredients_mask(cocktail, rules)
+
+    return decode_tags(mask & rules.other_mask, rules)
+
+
+def assign_combination_tags(cocktail, rules):
+    """
+    Assign the tags whose definition lists ingredients that the cocktail all contains.
+
+    Parameters:
+    cocktail (dict): The cocktail data.
+    rules (TagRules): The compiled tag rules.
+
+    Returns:
+    list: List of assigned tags.
+    """
+    counts = {}
+    for name in {ingredient.get('name') for ingredient in cocktail['ingredients']}:
+        for bit in mask_bits(rules.index.get(name, 0) & rules.combination_mask):
+            counts[bit] = counts.get(bit, 0) + 1
 
+    return [rules.tags[bit] for bit in sorted(counts) if counts[bit] == rules.combination_sizes[bit]]
+
+
+def assign_tags(cocktail, rules, functions):
+    """
+    Assign all enabled tags to a single cocktail.
+
+    Parameters:
+    cocktail (dict): The cocktail data.
+    rules (TagRules): The compiled tag rules.
+    functions (DictConfig): The 'functions' section of tagging_config.yaml.
+
+    Returns:
+    list: List of unique assigned tags.
+    """
     tags = []
-    for ingredient in cocktail['ingredients']:
-        for tag, ingredients in other_tags_map.items():
-            if ingredient.get('name') in ingredients:
-                tags.append(tag)
+    mask = ingredients_mask(cocktail, rules)
 
-    return tags
+    # Assign classic tags if enabled in config
+    if functions.assign_classic_tags:
+        tags.extend(assign_classic_tags(cocktail, rules))
+
+    # Assign vegan and vegetarian tags if enabled in config
+    if functions.assign_vegan_vegetarian_tags:
+        tags.extend(assign_vegan_vegetarian_tags(cocktail, rules, mask))
+
+    # Assign other tags if enabled in config
+    if functions.assign_other_tags:
+        tags.extend(assign_other_tags(cocktail, rules, mask))
+
+    # Assign combination tags if enabled in config
+    if functions.assign_combination_tags:
+        tags.extend(assign_combination_tags(cocktail, rules))
+
+    # Remove duplicate tags
+    return list(dict.fromkeys(tags))
+
+
+def build_rule_matrix(rules):
+    """
+    Build the sparse ingredient x tag matrix of the compiled rules.
 
+    Parameters:
+    rules (TagRules): The compiled tag rules.
+
+    Returns:
+    tuple: (vocabulary, matrix) - ingredient names and a CSR matrix with a 1 where
+           the ingredient is listed in the tag definition.
+    """
+    vocabulary = list(rules.index)
+    rows, cols = [], []
+    for row, name in enumerate(vocabulary):
+        bits = mask_bits(rules.index[name])
+        rows.extend([row] * len(bits))
+        cols.extend(bits)
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+        shape=(len(vocabulary), len(rules.tags)),
+    )
+    return vocabulary, matrix
 
-def save_simplified_data(df, file_path):
+
+def build_incidence_matrix(ingredients_column, vocabulary):
     """
-    Save the simplified DataFrame to a JSON file.
+    Explode the ingredients once into a sparse cocktail x ingredient count matrix.
+
+    Ingredients that are not part of any tag definition are dropped, since they
+    cannot contribute to any tag.
+
+    Parameters:
+    ingredients_column (pd.Series): Column with the list of ingredient dicts of every cocktail.
+    vocabulary (list): Ingredient names, one per matrix column.
+
+    Returns:
+    sparse.csr_matrix: Number of times each ingredient appears in each cocktail.
+    """
+    ingredients = ingredients_column.reset_index(drop=True).explode().dropna()
+    codes = pd.Categorical(ingredients.str.get('name'), categories=vocabulary).codes
+    known = codes >= 0
+
+    # Duplicate (cocktail, ingredient) pairs are summed when converting to CSR
+    return sparse.coo_matrix(
+        (np.ones(known.sum(), dtype=np.int32), (ingredients.index.to_numpy()[known], codes[known])),
+        shape=(len(ingredients_column), len(vocabulary)),
+    ).tocsr()
+
+
+def build_index_incidence(index, vocabulary):
+    """
+    Build the cocktail x ingredient count matrix from the integer edges of the ingredient index.
+
+    Only the names of the dimension table are matched against the vocabulary,
+    once per distinct ingredient, the edges are joined by integer id.
+
+    Parameters:
+    index (IngredientIndex): Ingredient index aligned to the cocktails.
+    vocabulary (list): Ingredient names, one per matrix column.
+
+    Returns:
+    sparse.csr_matrix: Number of times each ingredient appears in each cocktail.
+    """
+    codes = pd.Index(vocabulary).get_indexer(index.table['name'])
+    known = np.flatnonzero(codes >= 0)
+    # Maps every row of the dimension table to its vocabulary column
+    selector = sparse.csr_matrix(
+        (np.ones(len(known), dtype=np.int32), (known, codes[known])),
+        shape=(len(index.table), len(vocabulary)),
+    )
+    return (index.incidence_matrix() @ selector).tocsr()
+
+
+def tag_dataset(ingredients_column, rules, functions, index=None):
+    """
+    Tag the whole dataset at once with sparse matrix products.
+
+    The cocktail x ingredient incidence matrix is multiplied by the ingredient x tag
+    rule matrix, giving for every cocktail the number of its ingredients listed in
+    each tag definition. Tags are then assigned by thresholding these counts with the
+    same rules as assign_classic_tags, assign_vegan_vegetarian_tags, assign_other_tags
+    and assign_combination_tags.
+
+    Parameters:
+    ingredients_column (pd.Series): Column with the list of ingredient dicts of every cocktail.
+    rules (TagRules): The compiled tag rules.
+    functions (DictConfig): The 'functions' section of tagging_config.yaml.
+    index (IngredientIndex): Ingredient index aligned to the cocktails. If given, the incidence
+                             matrix is built from it and ingredients_column is not used.
+
+    Returns:
+    list: List of unique assigned tags for every cocktail.
+    """
+    if (index.n_cocktails if index is not None else len(ingredients_column)) == 0:
+        return []
+
+    vocabulary, rule_matrix = build_rule_matrix(rules)
+    if index is not None:
+        incidence = build_index_incidence(index, vocabulary)
+    else:
+        incidence = build_incidence_matrix(ingredients_column, vocabulary)
+    counts = (incidence @ rule_matrix).tocsc()
+    n_cocktails = incidence.shape[0]
+
+    def count_of(mask):
+        bits = mask_bits(mask)
+        if not bits:
+            return np.zeros(n_cocktails, dtype=np.int32)
+        return np.asarray(counts[:, bits].sum(axis=1)).ravel()
+
+    tag_names = []
+    tag_columns = []
+
+    # Assign classic tags if enabled in config
+    if functions.assign_classic_tags:
+        is_classic = np.asarray(rule_matrix[:, mask_bits(rules.classic_mask)].sum(axis=1)).ravel() > 0
+        is_new_era = np.asarray(rule_matrix[:, mask_bits(rules.new_era_mask)].sum(axis=1)).ravel() > 0
+
+        # An ingredient listed in both definitions only counts as classic
+        classic_count = incidence @ is_classic.astype(np.int32)
+        new_era_count = incidence @ (is_new_era & ~is_classic).astype(np.int32)
+
+        tag_names.extend(['Classic', 'ContemporaryClassic', 'NewEra'])
+        tag_columns.extend([
+            (classic_count > 0) & (new_era_count == 0),
+            (classic_count > 0) & (new_era_count == 1),
+            new_era_count >= 2,
+        ])
+
+    # Assign vegan and vegetarian tags if enabled in config
+    if functions.assign_vegan_vegetarian_tags:
+        tag_names.extend(['Vegan', 'Vegetarian'])
+        tag_columns.extend([
+            count_of(rules.non_vegan_mask) == 0,
+            count_of(rules.non_vegetarian_mask) == 0,
+        ])
+
+    assigned = sparse.csr_matrix(np.column_stack(tag_columns)) if tag_columns else \
+        sparse.csr_matrix((n_cocktails, 0), dtype=bool)
+
+    # Assign other tags if enabled in config
+    if functions.assign_other_tags:
+        other_bits = mask_bits(rules.other_mask)
+        tag_names.extend(rules.tags[bit] for bit in other_bits)
+        assigned = sparse.hstack([assigned, counts[:, other_bits] > 0], format='csr')
+
+    # Assign combination tags if enabled in config
+    if functions.assign_combination_tags:
+        combination_bits = mask_bits(rules.combination_mask)
+        sizes = np.array([rules.combination_sizes[bit] for bit in combination_bits], dtype=np.int32)
+        # An ingredient listed several times in a cocktail only counts once
+        found = ((incidence > 0).astype(np.int32) @ rule_matrix[:, combination_bits]).tocsr()
+        found.data = found.data == sizes[found.indices]
+        tag_names.extend(rules.tags[bit] for bit in combination_bits)
+        assigned = sparse.hstack([assigned, found.astype(bool)], format='csr')
+
+    # Merge columns sharing the same tag name to remove duplicate tags
+    unique_names = list(dict.fromkeys(tag_names))
+    merge = sparse.csr_matrix(
+        (np.ones(len(tag_names), dtype=np.int32),
+         (np.arange(len(tag_names)), [unique_names.index(name) for name in tag_names])),
+        shape=(len(tag_names), len(unique_names)),
+    )
+    assigned = (assigned.astype(np.int32) @ merge).tocsr()
+    assigned.eliminate_zeros()
+    assigned.sort_indices()
+
+    # Split the flat array of tag names into one list per cocktail
+    names = np.array(unique_names, dtype=object)[assigned.indices]
+    return [tags.tolist() for tags in np.split(names, assigned.indptr[1:-1])]
+
+
+@instrumented
+def tag_cocktails(ingredients_column, rules, cfg, index=None):
+    """
+    Tag cocktails with the mode selected in the config.
+
+    Parameters:
+    ingredients_column (pd.Series): Column with the list of ingredient dicts of every cocktail,
+                                    None if the cocktails are stored without it.
+    rules (TagRules): The compiled tag rules.
+    cfg (DictConfig): The tagging configuration.
+    index (IngredientIndex): Ingredient index aligned to the cocktails, joined by integer id in batch mode.
+
+    Returns:
+    list: List of unique assigned tags for every cocktail.
+    """
+    if cfg.mode == 'batch':
+        # Tag the whole dataset with sparse matrix products
+        if index is not None:
+            logging.info("Tagging %d cocktails in batch mode on the ingredient index", index.n_cocktails)
+        else:
+            logging.info("Tagging %d cocktails in batch mode", len(ingredients_column))
+        return tag_dataset(ingredients_column, rules, cfg.functions, index)
+
+    if ingredients_column is None:
+        ingredients_column = index.nested_ingredients()
+
+    # Process each cocktail in the dataset
+    logging.info("Tagging %d cocktails one by one", len(ingredients_column))
+    return [assign_tags({'ingredients': ingredients}, rules, cfg.functions)
+            for ingredients in ingredients_column]
+
+
+def ingredient_signature(name, rules):
+    """
+    Describe everything the rules use to tag a cocktail containing an ingredient.
+
+    Parameters:
+    name (str): Ingredient name.
+    rules (TagRules): The compiled tag rules.
+
+    Returns:
+    tuple: Classic/NewEra/NonVegan/NonVegetarian membership, the set of other tags and
+           the set of combination tags with their number of ingredients.
+    """
+    mask = rules.index.get(name, 0)
+    return (bool(mask & rules.classic_mask), bool(mask & rules.new_era_mask),
+            bool(mask & rules.non_vegan_mask), bool(mask & rules.non_vegetarian_mask),
+            frozenset(decode_tags(mask & rules.other_mask, rules)),
+            frozenset((rules.tags[bit], rules.combination_sizes[bit])
+                      for bit in mask_bits(mask & rules.combination_mask)))
+
+
+def affected_ingredients(previous_definitions, rules):
+    """
+    Find the ingredients whose tagging changed between two versions of the definitions.
+
+    Parameters:
+    previous_definitions (dict): 'tags_definitions' used by the previous run.
+    rules (TagRules): The compiled current rules.
+
+    Returns:
+    set: Names of the ingredients whose tags changed.
+    """
+    previous_rules = compile_tag_rules(previous_definitions)
+    names = set(previous_rules.index) | set(rules.index)
+    return {name for name in names
+            if ingredient_signature(name, previous_rules) != ingredient_signature(name, rules)}
+
+
+@instrumented
+def tag_incrementally(cocktails, rules, cfg):
+    """
+    Re-tag only new, updated or rule-affected cocktails.
+
+    A cocktail is re-tagged when its ingredient names or tags differ from the ones
+    recorded in the manifest of the previous run (new cocktails, cocktails updated
+    by simplify_data), or when it contains an ingredient whose definitions changed.
+    Everything is re-tagged if the enabled tagging functions changed.
+
+    Parameters:
+    cocktails (pd.DataFrame): DataFrame containing cocktail data with existing tags.
+    rules (TagRules): The compiled tag rules.
+    cfg (DictConfig): The tagging configuration.
+
+    Returns:
+    pd.DataFrame: The DataFrame with updated tags.
+    """
+    config = OmegaConf.to_container(cfg)
+    config = {'functions': config['functions'], 'tags_definitions': config['tags_definitions']}
+    manifest = load_manifest('tagging')
+
+    names_column = [[ingredient.get('name') for ingredient in ingredients] for ingredients in cocktails['ingredients']]
+    existing_tags = cocktails['tags'].tolist() if 'tags' in cocktails.columns else [None] * len(cocktails)
+    hashes = [stable_hash([names, tags]) for names, tags in zip(names_column, existing_tags)]
+    changed, _ = diff_records(cocktails['id'], hashes, manifest)
+
+    previous = manifest['config']
+    if previous is None or previous['functions'] != config['functions']:
+        changed[:] = True
+    elif previous['tags_definitions'] != config['tags_definitions']:
+        affected = affected_ingredients(previous['tags_definitions'], rules)
+        logging.info("Tag definitions changed for %d ingredients", len(affected))
+        changed |= np.fromiter((not affected.isdisjoint(names) for names in names_column),
+                               dtype=bool, count=len(names_column))
+
+    positions = np.flatnonzero(changed)
+    logging.info("Re-tagging %d of %d cocktails", len(positions), len(cocktails))
+    if len(positions):
+        new_tags = tag_cocktails(cocktails['ingredients'].iloc[positions], rules, cfg)
+        for position, tags in zip(positions, new_tags):
+            existing_tags[position] = tags
+    cocktails['tags'] = existing_tags
+
+    save_manifest('tagging', config, cocktails['id'],
+                  [stable_hash([names, tags]) for names, tags in zip(names_column, existing_tags)])
+    return cocktails
+
+
+@instrumented
+def save_simplified_data(df, file_path, storage, indexed=False):
+    """
+    Save the tagged DataFrame to the processed dataset store and keep its ingredient index in sync.
 
     Parameters:
     df (DataFrame): The DataFrame to save.
-    file_path (str): The file path to save the JSON file.
+    file_path (str): The file path to save the data to. The format follows the extension.
+    storage (DictConfig): The 'storage' section of the global config. With
+                          normalize_ingredients, the nested ingredients are not stored.
+    indexed (bool): The ingredients of df are the ones of the ingredient index matching the
+                    dataset it was read from, so the index is kept instead of rebuilt from df.
     """
-    df.to_json(file_path, orient='records', indent=4)
+    stored = df.drop(columns=['ingredients'], errors='ignore') if storage.normalize_ingredients else df
+    write_dataset(stored, file_path)
+    update_ingredient_index(df, file_path, indexed, storage_format=storage.format)
 
 
 @hydra.main(version_base=None, config_path="../../configs/preprocessing_configs", config_name="tagging_config")
+@instrumented_main
 def main(cfg: DictConfig):
     global_config = OmegaConf.load("configs/global_configs.yaml")
 
     # Select data file based on data type in global config
-    input_file = 'data/raw/cocktail_dataset.json' if global_config.data_type == 'raw' else 'data/processed/processed_cocktail_dataset.json'
-    output_file = 'data/processed/processed_cocktail_dataset.json'
+    input_file = input_dataset_path(global_config)
+    output_file = dataset_path(PROCESSED_DATASET, global_config.storage.format)
 
     # Load data
     try:
-        cocktails = pd.read_json(input_file)
+        with measure('load_data') as stage:
+            cocktails = read_dataset(input_file)
+            stage.rows = len(cocktails)
     except Exception as e:
         logging.critical(f"Error loading data: {e}")
         return None
 
-    # Process each cocktail in the dataset
-    tags_column = []
-    for _, cocktail in cocktails.iterrows():
-        # Clear existing tags for the cocktail
-        cocktail['tags'] = []
-
-        # Assign tags
-        tags = []
-
-        # Assign classic tags if enabled in config
-        if cfg.functions.assign_classic_tags:
-            tags.extend(assign_classic_tags(cocktail, cfg.tags_definitions.classic_tags))
-
-        # Assign vegan and vegetarian tags if enabled in config
-        if cfg.functions.assign_vegan_vegetarian_tags:
-            tags.extend(assign_vegan_vegetarian_tags(cocktail, cfg.tags_definitions.vegan_vegetarian_tags))
-
-        # Assign other tags if enabled in config
-        if cfg.functions.assign_other_tags:
-            tags.extend(assign_other_tags(cocktail, cfg.tags_definitions.other_tags))
-
-        # Remove duplicate tags and add to cocktail's tags
-        unique_tags = list(set(tags))
-        cocktail['tags'] = unique_tags
-        tags_column.append(unique_tags)
-
-    # Assign the tags to the DataFrame
-    cocktails['tags'] = tags_column
+    # Join the ingredients by id from the index written by simplify_data.py
+    with measure('read_ingredient_index'):
+        index = read_aligned_index(cocktails['id'], input_file) if global_config.data_type == 'processed' else None
+    if 'ingredients' not in cocktails.columns:
+        if index is None:
+            logging.critical("The dataset has no ingredients column and no matching ingredient index.")
+            return None
+        if global_config.incremental:
+            cocktails = attach_ingredients(cocktails, index)
+
+    # Compile the tag definitions once for the whole dataset
+    rules = compile_tag_rules(cfg.tags_definitions)
+
+    if global_config.incremental:
+        # Only re-tag new, updated or rule-affected cocktails
+        cocktails = tag_incrementally(cocktails, rules, cfg)
+    else:
+        # Assign the tags to the DataFrame
+        cocktails['tags'] = tag_cocktails(cocktails.get('ingredients'), rules, cfg, index)
 
     # Save updated data
     logging.info("Saving tagged data to %s", output_file)
-    save_simplified_data(cocktails, output_file)
+    save_simplified_data(cocktails, output_file, global_config.storage, indexed=index is not None)
     logging.info("Data processing complete!")
 
 
@@ -0,0 +1,174 @@
+import numpy as np
+
+# Number of bits set in every byte value
+POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+# A sorted uint32 array takes 32 bits per row and the packed bits 1 bit per row of the universe,
+# so sets with fewer than universe / ARRAY_RATIO rows are stored as arrays (like Roaring containers)
+ARRAY_RATIO = 32
+
+
+def pack_rows(rows, n):
+    """
+    Pack a set of row numbers into a little-endian bitset.
+
+    Parameters:
+    rows (np.ndarray): Row numbers below n.
+    n (int): Size of the universe.
+
+    Returns:
+    np.ndarray: uint8 bitset of (n + 7) // 8 bytes.
+    """
+    mask = np.zeros(n, dtype=bool)
+    mask[rows] = True
+    return np.packbits(mask, bitorder='little')
+
+
+class Bitmap:
+    """
+    Compressed set of row numbers in [0, n), with AND/OR/NOT operations.
+
+    Sparse sets are stored as a sorted uint32 array of rows and dense sets as
+    a packed bitset, whichever is smaller, so a rare ingredient costs a few
+    bytes and a common tag n / 8 bytes. Operations pick the cheapest algorithm
+    for the representations of their operands, e.g. a sparse set AND a dense
+    one tests the bits of the sparse rows only.
+
+    Parameters:
+    n (int): Size of the universe.
+    rows (np.ndarray): Sorted unique uint32 rows, for an array bitmap.
+    bits (np.ndarray): uint8 little-endian bitset of (n + 7) // 8 bytes, for a dense bitmap.
+    """
+    __slots__ = ('n', 'rows', 'bits', '_count')
+
+    def __init__(self, n, rows=None, bits=None):
+        self.n = n
+        self.rows = rows
+        self.bits = bits
+        self._count = len(rows) if rows is not None else None
+
+    @classmethod
+    def from_rows(cls, rows, n):
+        """
+        Build a bitmap from sorted unique row numbers, choosing its representation.
+
+        Parameters:
+        rows (array-like): Sorted unique row numbers below n.
+        n (int): Size of the universe.
+
+        Returns:
+        Bitmap: The bitmap.
+        """
+        rows = np.asarray(rows, dtype=np.uint32)
+        if len(rows) * ARRAY_RATIO < n:
+            return cls(n, rows=rows)
+        bitmap = cls(n, bits=pack_rows(rows, n))
+        bitmap._count = len(rows)
+        return bitmap
+
+    @classmethod
+    def from_bits(cls, bits, n):
+        """
+        Build a bitmap from a packed bitset, converting it to an array if it is sparse.
+
+        Parameters:
+        bits (np.ndarray): uint8 little-endian bitset, bits past n must be 0.
+        n (int): Size of the universe.
+
+        Returns:
+        Bitmap: The bitmap.
+        """
+        bitmap = cls(n, bits=bits)
+        if bitmap.count() * ARRAY_RATIO < n:
+            return cls(n, rows=bitmap.to_rows())
+        return bitmap
+
+    @classmethod
+    def empty(cls, n):
+        return cls(n, rows=np.empty(0, dtype=np.uint32))
+
+    @classmethod
+    def full(cls, n):
+        return cls.from_bits(pack_rows(slice(None), n), n)
+
+    @property
+    def is_dense(self):
+        return self.bits is not None
+
+    def count(self):
+        """Number of rows in the set."""
+        if self._count is None:
+            self._count = int(POPCOUNT[self.bits].sum(dtype=np.int64))
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def to_rows(self):
+        """
+        List the rows in the set.
+
+        Returns:
+        np.ndarray: Sorted row numbers.
+        """
+        if self.rows is not None:
+            return np.asarray(self.rows)
+        return np.flatnonzero(np.unpackbits(self.bits, count=self.n, bitorder='little')).astype(np.uint32)
+
+    def to_bits(self):
+        """Packed bitset of the set, shared with the bitmap if it is dense."""
+        return self.bits if self.bits is not None else pack_rows(self.rows, self.n)
+
+    def contains(self, rows):
+        """
+        Test which rows are in the set.
+
+        Parameters:
+        rows (np.ndarray): Row numbers below n.
+
+        Returns:
+        np.ndarray: Boolean array, True for the rows in the set.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if self.bits is not None:
+            return ((self.bits[rows >> 3] >> (rows & 7).astype(np.uint8)) & 1).astype(bool)
+        positions = np.minimum(np.searchsorted(self.rows, rows), max(len(self.rows) - 1, 0))
+        return (self.rows[positions] == rows) if len(self.rows) else np.zeros(len(rows), dtype=bool)
+
+    def _check(self, other):
+        if self.n != other.n:
+            raise ValueError(f"Bitmaps over {self.n} and {other.n} rows cannot be combined.")
+
+    def __and__(self, other):
+        self._check(other)
+        if self.rows is not None and other.rows is not None:
+            return Bitmap(self.n, rows=np.intersect1d(self.rows, other.rows, assume_unique=True))
+        if self.rows is not None:
+            return Bitmap(self.n, rows=self.rows[other.contains(self.rows)])
+        if other.rows is not None:
+            return Bitmap(self.n, rows=other.rows[self.contains(other.rows)])
+        return Bitmap.from_bits(self.bits & other.bits, self.n)
+
+    def __or__(self, other):
+        self._check(other)
+        if self.rows is not None and other.rows is not None:
+            return Bitmap.from_rows(np.union1d(self.rows, other.rows), self.n)
+        # The union is at least as dense as the dense operand
+        return Bitmap(self.n, bits=self.to_bits() | other.to_bits())
+
+    def __sub__(self, other):
+        """Rows of self not in other, AND NOT without building the complement of other."""
+        self._check(other)
+        if self.rows is not None:
+            return Bitmap(self.n, rows=self.rows[~other.contains(self.rows)])
+        return Bitmap.from_bits(self.bits & ~other.to_bits(), self.n)
+
+    def __invert__(self):
+        bits = ~self.to_bits()
+        if self.n % 8:
+            # Keep the padding bits of the last byte unset
+            bits[-1] &= np.uint8((1 << (self.n % 8)) - 1)
+        return Bitmap.from_bits(bits, self.n)
+
+    def __repr__(self):
+        return f"Bitmap({self.count()} of {self.n} rows, {'dense' if self.is_dense else 'array'})"
@@ -0,0 +1,501 @@
+from __future__ import annotations
+
+import os
+import re
+import sys
+import json
+import logging
+from dataclasses import dataclass
+import hydra
+from omegaconf import DictConfig, OmegaConf
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from bitmap import Bitmap
+from utils.data_storage import PROCESSED_DATASET, read_dataset, resolve_dataset_path
+from utils.incremental import file_hash, stable_hash
+from utils.ingredient_index import INGREDIENT_INDEX, build_ingredient_index, read_aligned_index
+from utils.instrumentation import instrumented, instrumented_main
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+QUERY_INDEX = 'data/processed/query_index'
+
+# Columns of the processed dataset indexed by value, the ingredients are indexed by id
+VALUE_FIELDS = {'tag': 'tags', 'category': 'category', 'glass': 'glass', 'alcoholic': 'alcoholic'}
+FIELDS = ['ingredient'] + list(VALUE_FIELDS)
+
+INGREDIENT_INDEX_FILES = ['ids.npy', 'offsets.npy', 'ingredient_ids.npy', 'meta.json']
+
+# Labels of the 0/1 'alcoholic' values
+ALCOHOLIC_LABELS = {True: 'true', False: 'false'}
+
+
+@dataclass
+class Posting:
+    """
+    Bitmaps of the cocktails having every value of one field.
+
+    Attributes:
+    keys (list): Indexed values (ingredient ids for 'ingredient').
+    labels (list): Name of every key matched by queries, case-insensitively.
+    bitmaps (list): Bitmap of the rows having every key.
+    """
+    keys: list
+    labels: list
+    bitmaps: list
+
+    def __post_init__(self):
+        self._lookup = {}
+        for position, (key, label) in enumerate(zip(self.keys, self.labels)):
+            for name in {str(key).casefold(), str(label).casefold()}:
+                self._lookup.setdefault(name, []).append(position)
+
+    def positions(self, value):
+        """Positions of the keys whose value or label is value, ignoring case."""
+        return self._lookup.get(str(value).casefold(), [])
+
+
+@dataclass
+class QueryIndex:
+    """
+    Inverted indexes of the processed cocktails, evaluating boolean queries with bitmap operations.
+
+    Attributes:
+    ids (np.ndarray): Cocktail id of every row.
+    names (list): Cocktail name of every row.
+    postings (dict): Field name -> Posting.
+    fingerprint (str): Hash of the processed dataset and ingredient index the index was built from.
+    """
+    ids: np.ndarray
+    names: list
+    postings: dict
+    fingerprint: str = None
+
+    @property
+    def n_cocktails(self):
+        return len(self.ids)
+
+    def lookup(self, field, value):
+        """
+        Get the bitmap of the cocktails having a value of a field.
+
+        Parameters:
+        field (str): One of FIELDS.
+        value: The value, an ingredient name or id for 'ingredient'.
+
+        Returns:
+        Bitmap: The matching rows, empty for unknown values.
+        """
+        if field not in self.postings:
+            raise ValueError(f"Unknown query field '{field}'. Use one of {FIELDS}.")
+        posting = self.postings[field]
+        positions = posting.positions(value)
+        if not positions:
+            logging.warning("No cocktail has %s '%s'.", field, value)
+            return Bitmap.empty(self.n_cocktails)
+        result = posting.bitmaps[positions[0]]
+        # Ingredient names are not unique across ids
+        for position in positions[1:]:
+            result = result | posting.bitmaps[position]
+        return result
+
+    def evaluate(self, query):
+        """
+        Evaluate a query.
+
+        Parameters:
+        query (Query or str): Query expression, strings are parsed with parse_query.
+
+        Returns:
+        Bitmap: The matching rows.
+        """
+        if isinstance(query, str):
+            query = parse_query(query)
+        return query.evaluate(self)
+
+    def count(self, query):
+        """Number of cocktails matching a query."""
+        return self.evaluate(query).count()
+
+    def select(self, query):
+        """
+        List the cocktails matching a query.
+
+        Parameters:
+        query (Query or str): Query expression.
+
+        Returns:
+        pd.DataFrame: 'id' and 'name' of the matching cocktails.
+        """
+        rows = self.evaluate(query).to_rows()
+        return pd.DataFrame({'id': np.asarray(self.ids)[rows], 'name': np.asarray(self.names, dtype=object)[rows]})
+
+    def facet_counts(self, query, field):
+        """
+        Count the cocktails matching a query by value of a field.
+
+        Parameters:
+        query (Query or str): Query expression.
+        field (str): One of FIELDS.
+
+        Returns:
+        pd.Series: Number of matching cocktails by label, descending, without zero counts.
+        """
+        result = self.evaluate(query)
+        posting = self.postings[field]
+        counts = pd.Series([(result & bitmap).count() for bitmap in posting.bitmaps],
+                           index=[str(label) for label in posting.labels])
+        return counts[counts > 0].sort_values(ascending=False, kind='stable')
+
+
+class Query:
+    """Node of a boolean query, combined with &, | and ~."""
+
+    def __and__(self, other):
+        return And([self, other])
+
+    def __or__(self, other):
+        return Or([self, other])
+
+    def __invert__(self):
+        return Not(self)
+
+
+class Term(Query):
+    """Cocktails having a value of a field, e.g. Term('ingredient', 'Gin')."""
+
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def evaluate(self, index):
+        return index.lookup(self.field, self.value)
+
+    def __repr__(self):
+        return f"{self.field}:{self.value!r}"
+
+
+class And(Query):
+    """Cocktails matching all the operands."""
+
+    def __init__(self, operands):
+        self.operands = operands
+
+    def evaluate(self, index):
+        positive = [operand.evaluate(index) for operand in self.operands if not isinstance(operand, Not)]
+        negative = [operand.operand.evaluate(index) for operand in self.operands if isinstance(operand, Not)]
+        if not positive:
+            result = Bitmap.full(index.n_cocktails)
+        else:
+            # Intersect from the smallest set, the intermediate results only shrink
+            positive.sort(key=len)
+            result = positive[0]
+            for bitmap in positive[1:]:
+                result = result & bitmap
+        # NOT operands are subtracted instead of complemented
+        for bitmap in negative:
+            result = result - bitmap
+        return result
+
+    def __repr__(self):
+        return '(' + ' AND '.join(map(repr, self.operands)) + ')'
+
+
+class Or(Query):
+    """Cocktails matching any of the operands."""
+
+    def __init__(self, operands):
+        self.operands = operands
+
+    def evaluate(self, index):
+        result = self.operands[0].evaluate(index)
+        for operand in self.operands[1:]:
+            result = result | operand.evaluate(index)
+        return result
+
+    def __repr__(self):
+        return '(' + ' OR '.join(map(repr, self.operands)) + ')'
+
+
+class Not(Query):
+    """Cocktails not matching the operand."""
+
+    def __init__(self, operand):
+        self.operand = operand
+
+    def evaluate(self, index):
+        return ~self.operand.evaluate(index)
+
+    def __repr__(self):
+        return f"NOT {self.operand!r}"
+
+
+TOKEN_PATTERN = re.compile(r'\s*(\(|\)|[\w-]+:"[^"]*"|[^\s()]+)')
+
+
+def parse_query(text):
+    """
+    Parse a query string.
+
+    Terms are written field:value, quoted if the value has spaces, and
+    combined with AND, OR, NOT and parentheses; AND binds tighter than OR, e.g.
+    'tag:Vegan AND ingredient:Gin AND tag:Citrus AND NOT ingredient:"Egg White"'.
+
+    Parameters:
+    text (str): The query.
+
+    Returns:
+    Query: The parsed query.
+    """
+    tokens = TOKEN_PATTERN.findall(text)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def take():
+        nonlocal position
+        position += 1
+        return tokens[position - 1]
+
+    def parse_or():
+        operands = [parse_and()]
+        while peek() is not None and peek().upper() == 'OR':
+            take()
+            operands.append(parse_and())
+        return operands[0] if len(operands) == 1 else Or(operands)
+
+    def parse_and():
+        operands = [parse_not()]
+        while peek() is not None and peek().upper() == 'AND':
+            take()
+            operands.append(parse_not())
+        return operands[0] if len(operands) == 1 else And(operands)
+
+    def parse_not():
+        if peek() is not None and peek().upper() == 'NOT':
+            take()
+            return Not(parse_not())
+        return parse_atom()
+
+    def parse_atom():
+        token = peek()
+        if token is None:
+            raise ValueError(f"Unexpected end of query '{text}'.")
+        take()
+        if token == '(':
+            query = parse_or()
+            if peek() != ')':
+                raise ValueError(f"Missing closing parenthesis in query '{text}'.")
+            take()
+            return query
+        field, separator, value = token.partition(':')
+        if not separator or not value:
+            raise ValueError(f"Expected field:value in query '{text}', got '{token}'.")
+        return Term(field.lower(), value.strip('"'))
+
+    query = parse_or()
+    if peek() is not None:
+        raise ValueError(f"Unexpected '{peek()}' in query '{text}'.")
+    return query
+
+
+def build_posting(rows, keys, n, labels=None):
+    """
+    Group (row, key) pairs into one bitmap per distinct key.
+
+    Parameters:
+    rows (np.ndarray): Row of every pair.
+    keys (array-like): Key of every pair, missing keys are skipped.
+    n (int): Number of rows.
+    labels (dict): Optional label of every key, the key itself by default.
+
+    Returns:
+    Posting: The bitmaps by key, keys sorted.
+    """
+    codes, uniques = pd.factorize(pd.Series(keys), sort=True)
+    present = codes >= 0
+    # Sort the pairs by key and row, then drop the duplicates (a tag or ingredient listed twice)
+    pairs = np.sort(codes[present].astype(np.int64) * n + np.asarray(rows)[present])
+    pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])]
+    pair_codes, pair_rows = np.divmod(pairs, n)
+    bounds = np.searchsorted(pair_codes, np.arange(len(uniques) + 1))
+
+    keys = [key.item() if hasattr(key, 'item') else key for key in uniques]
+    return Posting(
+        keys=keys,
+        labels=[labels.get(key, key) for key in keys] if labels else keys,
+        bitmaps=[Bitmap.from_rows(pair_rows[start:stop], n) for start, stop in zip(bounds[:-1], bounds[1:])],
+    )
+
+
+@instrumented(rows=lambda index: index.n_cocktails)
+def build_query_index(cocktails, ingredient_index, fingerprint=None):
+    """
+    Build the inverted indexes of the processed cocktails.
+
+    Parameters:
+    cocktails (pd.DataFrame): Processed dataset with 'id', 'name', 'tags', 'category', 'glass' and 'alcoholic'.
+    ingredient_index (IngredientIndex): Ingredient index aligned to the cocktails.
+    fingerprint (str): Fingerprint of the inputs, stored with the index.
+
+    Returns:
+    QueryIndex: The index.
+    """
+    n = len(cocktails)
+    postings = {}
+
+    table = ingredient_index.table
+    edge_rows = np.repeat(np.arange(n), np.diff(np.asarray(ingredient_index.offsets)))
+    postings['ingredient'] = build_posting(edge_rows, np.asarray(ingredient_index.ingredient_ids), n,
+                                           labels=dict(zip(table['id'].tolist(), table['name'].tolist())))
+
+    for field, column in VALUE_FIELDS.items():
+        values = cocktails[column].reset_index(drop=True)
+        if column == 'tags':
+            values = values.explode()
+        postings[field] = build_posting(values.index.to_numpy(), values.to_numpy(), n,
+                                        labels=ALCOHOLIC_LABELS if field == 'alcoholic' else None)
+
+    return QueryIndex(cocktails['id'].to_numpy(), cocktails['name'].tolist(), postings, fingerprint)
+
+
+def write_query_index(index, directory=QUERY_INDEX):
+    """
+    Save a query index as a directory of .npy arrays.
+
+    For every field, the array bitmaps are concatenated in <field>_rows.npy
+    (CSR layout with <field>_offsets.npy) and the dense bitmaps stacked in
+    <field>_bits.npy. Keys, labels and the fingerprint are stored in meta.json, written last.
+
+    Parameters:
+    index (QueryIndex): The index.
+    directory (str): Output directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'ids.npy'), np.asarray(index.ids))
+    fields = {}
+    for field, posting in index.postings.items():
+        arrays = [bitmap.rows if not bitmap.is_dense else np.empty(0, dtype=np.uint32) for bitmap in posting.bitmaps]
+        dense = [bitmap.bits for bitmap in posting.bitmaps if bitmap.is_dense]
+        np.save(os.path.join(directory, f"{field}_rows.npy"),
+                np.concatenate(arrays) if arrays else np.empty(0, dtype=np.uint32))
+        np.save(os.path.join(directory, f"{field}_offsets.npy"),
+                np.concatenate([[0], np.cumsum([len(rows) for rows in arrays], dtype=np.int64)]))
+        np.save(os.path.join(directory, f"{field}_bits.npy"),
+                np.stack(dense) if dense else np.empty((0, (index.n_cocktails + 7) // 8), dtype=np.uint8))
+        slots = np.cumsum([bitmap.is_dense for bitmap in posting.bitmaps]) - 1
+        fields[field] = {
+            'keys': posting.keys,
+            'labels': posting.labels,
+            # Row of the bitmap in <field>_bits.npy, -1 for array bitmaps
+            'dense_slots': [int(slot) if bitmap.is_dense else -1 for slot, bitmap in zip(slots, posting.bitmaps)],
+        }
+
+    with open(os.path.join(directory, 'meta.json'), 'w') as meta_file:
+        json.dump({'n_cocktails': index.n_cocktails, 'names': index.names, 'fingerprint': index.fingerprint,
+                   'fields': fields}, meta_file)
+    logging.info("Query index of %d cocktails written to %s", index.n_cocktails, directory)
+
+
+def read_query_index(directory=QUERY_INDEX, mmap=True):
+    """
+    Load a query index saved by write_query_index.
+
+    Parameters:
+    directory (str): Directory of the index.
+    mmap (bool): Memory-map the bitmaps instead of reading them into memory.
+
+    Returns:
+    QueryIndex: The index.
+    """
+    mmap_mode = 'r' if mmap else None
+    with open(os.path.join(directory, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+
+    n = meta['n_cocktails']
+    postings = {}
+    for field, field_meta in meta['fields'].items():
+        rows = np.load(os.path.join(directory, f"{field}_rows.npy"), mmap_mode=mmap_mode)
+        offsets = np.load(os.path.join(directory, f"{field}_offsets.npy"))
+        bits = np.load(os.path.join(directory, f"{field}_bits.npy"), mmap_mode=mmap_mode)
+        bitmaps = [Bitmap(n, bits=bits[slot]) if slot >= 0 else Bitmap(n, rows=rows[offsets[key]:offsets[key + 1]])
+                   for key, slot in enumerate(field_meta['dense_slots'])]
+        postings[field] = Posting(field_meta['keys'], field_meta['labels'], bitmaps)
+
+    ids = np.load(os.path.join(directory, 'ids.npy'), mmap_mode=mmap_mode)
+    return QueryIndex(ids, meta['names'], postings, meta['fingerprint'])
+
+
+def input_fingerprint(dataset_file, ingredients_dir=INGREDIENT_INDEX):
+    """Content hash of the processed dataset and of its ingredient index, if any."""
+    paths = [dataset_file] + [os.path.join(ingredients_dir, name) for name in INGREDIENT_INDEX_FILES]
+    return stable_hash([file_hash(path) if os.path.exists(path) else None for path in paths])
+
+
+def load_query_index(storage_format='parquet', directory=QUERY_INDEX, rebuild=False):
+    """
+    Load the query index, building it if it is missing or the processed data changed.
+
+    Parameters:
+    storage_format (str): The storage format of the datasets.
+    directory (str): Directory of the index.
+    rebuild (bool): Build the index even if it is up to date.
+
+    Returns:
+    QueryIndex: The index.
+    """
+    dataset_file = resolve_dataset_path(PROCESSED_DATASET, storage_format)
+    fingerprint = input_fingerprint(dataset_file)
+    if not rebuild and os.path.exists(os.path.join(directory, 'meta.json')):
+        index = read_query_index(directory)
+        if index.fingerprint == fingerprint:
+            return index
+        logging.info("The processed data changed since the query index was built, rebuilding it.")
+
+    cocktails = read_dataset(dataset_file)
+    ingredient_index = read_aligned_index(cocktails['id'], dataset_file)
+    if ingredient_index is None:
+        # Datasets stored with the nested ingredients may have no index yet
+        ingredient_index = build_ingredient_index(cocktails['id'].to_numpy(), cocktails['ingredients'])
+
+    index = build_query_index(cocktails, ingredient_index, fingerprint)
+    write_query_index(index, directory)
+    return index
+
+
+@hydra.main(version_base=None, config_path="../../configs/query_configs", config_name="query_config")
+@instrumented_main
+def main(cfg: DictConfig):
+    """
+    Evaluate boolean queries over the processed cocktails.
+
+    Parameters:
+    cfg (DictConfig): Query configuration.
+    """
+    global_config = OmegaConf.load("configs/global_configs.yaml")
+    index = load_query_index(global_config.storage.format, cfg.index.path, cfg.index.rebuild)
+
+    for text in cfg.queries:
+        try:
+            query = parse_query(text)
+            result = index.evaluate(query)
+        except ValueError as e:
+            logging.error("Invalid query: %s", e)
+            continue
+
+        logging.info("%s: %d cocktails", text, result.count())
+        if cfg.show_cocktails:
+            for cocktail in index.select(query).head(cfg.max_cocktails).itertuples():
+                logging.info("  %s (%s)", cocktail.name, cocktail.id)
+        for field in cfg.facets:
+            counts = index.facet_counts(query, field)
+            logging.info("  By %s: %s", field, ', '.join(f"{label} {count}" for label, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
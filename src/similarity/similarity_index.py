@@ -0,0 +1,507 @@
+from __future__ import annotations
+
+import os
+import sys
+import json
+import logging
+from dataclasses import dataclass
+import hydra
+from omegaconf import DictConfig, OmegaConf
+
+sys.path[:0] = [os.path.abspath(os.path.join(os.path.dirname(__file__), '..')),
+                os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'clustering'))]
+from clustering import compute_weights, normalize_tags
+from utils.data_storage import (CLUSTERED_DATASET, ONE_HOT_FEATURES, PROCESSED_DATASET, iter_row_batches,
+                                one_hot_features_path, read_dataset, read_feature_matrix, resolve_dataset_path,
+                                write_dataset)
+from utils.incremental import file_hash, stable_hash
+from utils.instrumentation import instrumented, instrumented_main, measure
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s - %(message)s')
+
+SIMILARITY_INDEX = 'data/processed/similarity'
+METRICS = ['cosine', 'jaccard']
+
+# Tag sets are encoded as bits of unsigned 64-bit words, column j in bit j % 64 of word j // 64
+WORD_BITS = 64
+
+FEATURE_FILES = ['data.npy', 'indices.npy', 'indptr.npy', 'ids.npy', 'meta.json']
+
+
+def signature_masks(tags_matrix, batch_size=2 ** 20):
+    """
+    Encode the tag set of every row of the one-hot matrix as a multi-word bitmask.
+
+    Parameters:
+    tags_matrix (scipy.sparse.csr_matrix): One-hot encoded tags, in memory or memory-mapped.
+    batch_size (int): Rows per batch read from the matrix.
+
+    Returns:
+    np.ndarray: uint64 array of rows x words (at least one), bit j % 64 of word j // 64 set
+                if column j is present.
+    """
+    n_words = max(1, -(-tags_matrix.shape[1] // WORD_BITS))
+    masks = np.empty((tags_matrix.shape[0], n_words), dtype=np.uint64)
+    for start, batch in zip(range(0, tags_matrix.shape[0], batch_size), iter_row_batches(tags_matrix, batch_size)):
+        words = batch.indices // WORD_BITS
+        bits = np.left_shift(np.uint64(1), (batch.indices % WORD_BITS).astype(np.uint64))
+        for word in range(n_words):
+            # A row has every column at most once, so the sum of its bits is their union. The
+            # cumulative sum may wrap around, differences of it modulo 2**64 are still exact.
+            word_bits = np.where(words == word, bits, np.uint64(0)) if n_words > 1 else bits
+            cumulative = np.concatenate([[np.uint64(0)], np.cumsum(word_bits, dtype=np.uint64)])
+            masks[start:start + batch.shape[0], word] = (cumulative[batch.indptr[1:]]
+                                                         - cumulative[batch.indptr[:-1]])
+    return masks
+
+
+def mask_bits(masks, n_columns):
+    """
+    Decode multi-word bitmasks to a dense indicator matrix.
+
+    Parameters:
+    masks (np.ndarray): uint64 bitmasks, rows x words, see signature_masks.
+    n_columns (int): Number of columns.
+
+    Returns:
+    np.ndarray: float32 array with one row per mask, 1 where the bit is set.
+    """
+    columns = np.arange(n_columns)
+    shifts = (columns % WORD_BITS).astype(np.uint64)
+    return ((masks[:, columns // WORD_BITS] >> shifts) & np.uint64(1)).astype(np.float32)
+
+
+def feature_fingerprint(directory=ONE_HOT_FEATURES):
+    """Content hash of a feature matrix saved by write_feature_matrix, None if it does not exist."""
+    paths = [os.path.join(directory, name) for name in FEATURE_FILES]
+    if not all(os.path.exists(path) for path in paths):
+        return None
+    return stable_hash([file_hash(path) for path in paths])
+
+
+@dataclass
+class SimilarityIndex:
+    """
+    Index of the cocktails by their set of tags, for exact top-k similarity queries.
+
+    The weighted one-hot features of a cocktail (normalize_tags and apply_weights)
+    only depend on its set of tags, and far fewer distinct tag sets (signatures)
+    than cocktails exist in a catalog. A query scores the distinct signatures
+    with one matrix product and expands the best ones to their cocktails, which
+    are stored grouped by signature (members[offsets[s]:offsets[s + 1]]).
+
+    Attributes:
+    signatures (np.ndarray): uint64 multi-word bitmask of every distinct tag set (signatures x words), sorted.
+    offsets (np.ndarray): int64 start of the cocktails of every signature in members, plus the total.
+    members (np.ndarray): int64 rows of the cocktails, grouped by signature.
+    row_signatures (np.ndarray): int32 signature of every row.
+    ids (np.ndarray): Cocktail id of every row.
+    id_order (np.ndarray): Rows sorted by cocktail id, to look up ids.
+    column_values (np.ndarray): float32 weighted feature value of every tag column when present.
+    columns (list): Tag name of every column.
+    fingerprint (str): Content hash of the feature matrix the index was built from.
+    """
+    signatures: np.ndarray
+    offsets: np.ndarray
+    members: np.ndarray
+    row_signatures: np.ndarray
+    ids: np.ndarray
+    id_order: np.ndarray
+    column_values: np.ndarray
+    columns: list
+    fingerprint: str = None
+
+    def __post_init__(self):
+        self._features = None
+        self._sorted_ids = None
+        self._prepared = {}
+
+    @property
+    def n_signatures(self):
+        return len(self.signatures)
+
+    def signature_features(self):
+        """
+        Weighted features of every signature, as clustered by clustering.py.
+
+        Returns:
+        np.ndarray: float32 array with one row per signature.
+        """
+        if self._features is None:
+            self._features = mask_bits(np.asarray(self.signatures), len(self.columns)) * self.column_values
+        return self._features
+
+    def transform(self, tags_matrix):
+        """
+        Compute the weighted features of one-hot encoded tags, e.g. of cocktails not in the catalog.
+
+        Parameters:
+        tags_matrix (scipy.sparse.csr_matrix): One-hot encoded tags with the columns of the index.
+
+        Returns:
+        np.ndarray: float32 array with one row per row of tags_matrix.
+        """
+        return mask_bits(signature_masks(tags_matrix), len(self.columns)) * self.column_values
+
+    def rows_of(self, ids):
+        """
+        Find the rows of cocktail ids.
+
+        Parameters:
+        ids (array-like): Cocktail ids.
+
+        Returns:
+        np.ndarray: Row of every id, -1 for ids not in the index.
+        """
+        ids = np.asarray(ids)
+        if self._sorted_ids is None:
+            self._sorted_ids = np.asarray(self.ids)[self.id_order]
+        sorted_ids = self._sorted_ids
+        positions = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        found = sorted_ids[positions] == ids
+        return np.where(found, np.asarray(self.id_order)[positions], -1)
+
+    def scores(self, features, metric='cosine'):
+        """
+        Similarity of query features to every signature.
+
+        Parameters:
+        features (np.ndarray): Weighted features of the queries.
+        metric (str): 'cosine', or 'jaccard' for the weighted Jaccard similarity of the tag sets.
+
+        Returns:
+        np.ndarray: float32 array of queries x signatures, 0 for empty tag sets.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown similarity metric '{metric}'. Use one of {METRICS}.")
+        if metric not in self._prepared:
+            signatures = self.signature_features()
+            if metric == 'cosine':
+                self._prepared[metric] = (np.ascontiguousarray(signatures.T), np.linalg.norm(signatures, axis=1))
+            else:
+                # Features are 0 or the weight of their column, so the weighted intersection is a matrix product
+                self._prepared[metric] = (np.ascontiguousarray((signatures > 0).T, dtype=np.float32),
+                                          signatures.sum(axis=1))
+        matrix, totals = self._prepared[metric]
+
+        features = np.asarray(features, dtype=np.float32)
+        products = features @ matrix
+        if metric == 'cosine':
+            denominator = np.outer(np.linalg.norm(features, axis=1), totals)
+        else:
+            denominator = features.sum(axis=1)[:, None] + totals[None, :] - products
+        return np.divide(products, denominator, out=np.zeros_like(products), where=denominator > 0)
+
+    def query(self, features, k=10, metric='cosine', exclude_rows=None):
+        """
+        Find the k most similar cocktails of every query.
+
+        Parameters:
+        features (np.ndarray): Weighted features of the queries, see transform.
+        k (int): Number of cocktails per query.
+        metric (str): Similarity metric, see scores.
+        exclude_rows (np.ndarray): Row excluded from the results of every query (e.g. the queried
+                                   cocktail itself), -1 to exclude nothing.
+
+        Returns:
+        tuple: (ids, scores) - arrays of queries x k with the ids of the most similar cocktails
+               by decreasing similarity (ties in row order) and their similarity, padded with -1 and NaN.
+        """
+        scores = self.scores(features, metric)
+        n_queries = len(scores)
+        exclude_rows = np.full(n_queries, -1) if exclude_rows is None else np.asarray(exclude_rows)
+
+        # Every signature has a cocktail, so the k + 1 best signatures hold k cocktails besides an excluded one
+        n_candidates = min(self.n_signatures, k + 1)
+        if n_candidates < self.n_signatures:
+            candidates = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates]
+        else:
+            candidates = np.broadcast_to(np.arange(self.n_signatures), (n_queries, self.n_signatures))
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.lexsort((candidates, -candidate_scores))
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        candidate_scores = np.take_along_axis(candidate_scores, order, axis=1)
+
+        result_rows = np.full((n_queries, k), -1, dtype=np.int64)
+        result_scores = np.full((n_queries, k), np.nan, dtype=np.float32)
+        for query, (signatures, signature_scores) in enumerate(zip(candidates, candidate_scores)):
+            found = 0
+            for signature, score in zip(signatures, signature_scores):
+                rows = self.members[self.offsets[signature]:self.offsets[signature + 1]]
+                rows = rows[rows != exclude_rows[query]][:k - found]
+                result_rows[query, found:found + len(rows)] = rows
+                result_scores[query, found:found + len(rows)] = score
+                found += len(rows)
+                if found == k:
+                    break
+
+        result_ids = np.where(result_rows >= 0, np.asarray(self.ids)[result_rows], -1)
+        return result_ids, result_scores
+
+    def query_ids(self, ids, k=10, metric='cosine', batch_size=1024):
+        """
+        Find the k most similar cocktails of cocktails of the catalog, in batches of queries.
+
+        Parameters:
+        ids (array-like): Ids of the queried cocktails, all must be in the index.
+        k (int): Number of cocktails per query, the queried cocktail is excluded.
+        metric (str): Similarity metric, see scores.
+        batch_size (int): Number of queries scored at once.
+
+        Returns:
+        tuple: (ids, scores) - see query.
+        """
+        rows = self.rows_of(ids)
+        if (rows < 0).any():
+            raise KeyError(f"Cocktails {np.asarray(ids)[rows < 0].tolist()} are not in the similarity index.")
+
+        features = self.signature_features()
+        batches = [self.query(features[np.asarray(self.row_signatures)[rows[start:start + batch_size]]], k, metric,
+                              exclude_rows=rows[start:start + batch_size])
+                   for start in range(0, len(rows), batch_size)]
+        if not batches:
+            return np.empty((0, k), dtype=np.int64), np.empty((0, k), dtype=np.float32)
+        return np.concatenate([ids for ids, _ in batches]), np.concatenate([scores for _, scores in batches])
+
+
+@instrumented(rows=lambda index: len(index.ids))
+def build_similarity_index(tags_matrix, ids, columns, fingerprint=None):
+    """
+    Build the similarity index of a one-hot matrix.
+
+    The tag weights are derived like in clustering.py: the MinMax scaling and
+    the column sums of the normalized tags only depend on the distinct tag sets
+    and how many cocktails have each of them.
+
+    Parameters:
+    tags_matrix (scipy.sparse.csr_matrix): One-hot encoded tags, in memory or memory-mapped.
+    ids (array-like): Cocktail id of every row.
+    columns (list): Tag name of every column.
+    fingerprint (str): Content hash of the feature matrix, stored to detect a stale index.
+
+    Returns:
+    SimilarityIndex: The index.
+    """
+    signatures, row_signatures, counts = np.unique(signature_masks(tags_matrix), axis=0, return_inverse=True,
+                                                   return_counts=True)
+    row_signatures = row_signatures.reshape(-1).astype(np.int32)
+    ids = np.asarray(ids)
+
+    # Normalized like the full matrix, the scaler only depends on the distinct rows
+    normalized = normalize_tags(mask_bits(signatures, tags_matrix.shape[1]))
+    weights = np.asarray(compute_weights(counts @ normalized), dtype=np.float32)
+    # Value of a present tag: 1 after scaling (0 for a tag every cocktail has), times its weight
+    column_values = normalized.max(axis=0) * weights
+
+    logging.info("Similarity index of %d cocktails with %d distinct tag sets", len(ids), len(signatures))
+    return SimilarityIndex(
+        signatures=signatures,
+        offsets=np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+        members=np.argsort(row_signatures, kind='stable').astype(np.int64),
+        row_signatures=row_signatures,
+        ids=ids,
+        id_order=np.argsort(ids, kind='stable').astype(np.int64),
+        column_values=column_values.astype(np.float32),
+        columns=list(columns),
+        fingerprint=fingerprint,
+    )
+
+
+def write_similarity_index(index, directory=SIMILARITY_INDEX):
+    """
+    Save a similarity index as a directory of .npy arrays, memory-mapped on read.
+
+    Parameters:
+    index (SimilarityIndex): The index to save.
+    directory (str): Output directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in ['signatures', 'offsets', 'members', 'row_signatures', 'ids', 'id_order', 'column_values']:
+        np.save(os.path.join(directory, f"{name}.npy"), getattr(index, name))
+
+    # Written last, an index without meta.json is incomplete
+    with open(os.path.join(directory, 'meta.json'), 'w') as meta_file:
+        json.dump({'columns': index.columns, 'fingerprint': index.fingerprint}, meta_file, indent=4)
+    logging.info("Similarity index written to %s", directory)
+
+
+def read_similarity_index(directory=SIMILARITY_INDEX, mmap=True):
+    """
+    Load a similarity index saved by write_similarity_index.
+
+    Parameters:
+    directory (str): Directory of the index.
+    mmap (bool): Memory-map the arrays instead of reading them into memory.
+
+    Returns:
+    SimilarityIndex: The loaded index.
+    """
+    mmap_mode = 'r' if mmap else None
+    with open(os.path.join(directory, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+
+    def load(name):
+        return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+
+    signatures = np.load(os.path.join(directory, 'signatures.npy'))
+    if signatures.ndim == 1:
+        # Index written with single-word signatures
+        signatures = signatures[:, None]
+
+    return SimilarityIndex(
+        signatures=signatures,
+        offsets=load('offsets'),
+        members=load('members'),
+        row_signatures=load('row_signatures'),
+        ids=load('ids'),
+        id_order=load('id_order'),
+        column_values=np.load(os.path.join(directory, 'column_values.npy')),
+        columns=meta['columns'],
+        fingerprint=meta['fingerprint'],
+    )
+
+
+def load_similarity_index(features_dir=ONE_HOT_FEATURES, directory=SIMILARITY_INDEX, rebuild=False):
+    """
+    Load the similarity index, building it if it is missing or the one-hot matrix changed.
+
+    Parameters:
+    features_dir (str): Directory of the one-hot matrix written by one_hot_encode_tags.py.
+    directory (str): Directory of the index.
+    rebuild (bool): Build the index even if it is up to date.
+
+    Returns:
+    SimilarityIndex: The index, None if there is no one-hot matrix.
+    """
+    fingerprint = feature_fingerprint(features_dir)
+    if fingerprint is None:
+        logging.critical("No one-hot matrix in %s. Run one_hot_encode_tags.py first.", features_dir)
+        return None
+
+    if not rebuild and os.path.exists(os.path.join(directory, 'meta.json')):
+        index = read_similarity_index(directory)
+        if index.fingerprint == fingerprint:
+            return index
+        logging.info("The one-hot matrix changed since the similarity index was built, rebuilding it.")
+
+    tags_matrix, ids, columns = read_feature_matrix(features_dir)
+    index = build_similarity_index(tags_matrix, ids, columns, fingerprint)
+    write_similarity_index(index, directory)
+    return index
+
+
+def load_catalog(storage_format):
+    """
+    Load the names and cluster labels of the cocktails, used to display the results.
+
+    Parameters:
+    storage_format (str): The storage format of the datasets.
+
+    Returns:
+    pd.DataFrame: 'name' and the cluster label columns by cocktail id, the processed dataset if it is not clustered yet.
+    """
+    try:
+        return read_dataset(resolve_dataset_path(CLUSTERED_DATASET, storage_format),
+                            columns=['id', 'name', 'kmeans_cluster', 'agg_cluster']).set_index('id')
+    except (OSError, KeyError, ValueError) as e:
+        logging.warning("Clustered dataset not available (%s), showing cocktails without clusters.", e)
+        return read_dataset(resolve_dataset_path(PROCESSED_DATASET, storage_format), columns=['id', 'name']).set_index('id')
+
+
+def log_similar(query_id, result_ids, result_scores, catalog, metric):
+    """
+    Log the most similar cocktails of a query.
+
+    Parameters:
+    query_id (int): Id of the queried cocktail.
+    result_ids (np.ndarray): Ids of the most similar cocktails, -1 for padding.
+    result_scores (np.ndarray): Their similarity.
+    catalog (pd.DataFrame): Names and cluster labels by cocktail id.
+    metric (str): The similarity metric.
+    """
+    logging.info(f"Cocktails similar to {catalog['name'].get(query_id, query_id)} ({query_id}):")
+    for rank, (cocktail_id, score) in enumerate(zip(result_ids, result_scores), start=1):
+        if cocktail_id < 0:
+            break
+        clusters = ''
+        if 'kmeans_cluster' in catalog.columns:
+            clusters = (f", K-means cluster {catalog.at[cocktail_id, 'kmeans_cluster']}"
+                        f", Agglomerative cluster {catalog.at[cocktail_id, 'agg_cluster']}")
+        logging.info(f"  {rank}. {catalog['name'].get(cocktail_id, cocktail_id)} ({cocktail_id}) - "
+                     f"{metric} {score:.3f}{clusters}")
+
+
+def similar_table(query_ids, result_ids, result_scores):
+    """
+    Convert query results to one row per (query, rank).
+
+    Parameters:
+    query_ids (np.ndarray): Id of every query.
+    result_ids (np.ndarray): queries x k ids of the similar cocktails, -1 for padding.
+    result_scores (np.ndarray): queries x k similarities.
+
+    Returns:
+    pd.DataFrame: Columns 'id', 'rank', 'similar_id' and 'similarity'.
+    """
+    k = result_ids.shape[1]
+    table = pd.DataFrame({
+        'id': np.repeat(np.asarray(query_ids), k),
+        'rank': np.tile(np.arange(1, k + 1), len(query_ids)),
+        'similar_id': result_ids.ravel(),
+        'similarity': result_scores.ravel(),
+    })
+    return table[table['similar_id'] >= 0].reset_index(drop=True)
+
+
+@hydra.main(version_base=None, config_path="../../configs/similarity_configs", config_name="similarity_config")
+@instrumented_main
+def main(cfg: DictConfig):
+    """
+    Build the similarity index if needed and find the cocktails most similar to the queried ones.
+
+    Parameters:
+    cfg (DictConfig): Similarity configuration.
+    """
+    global_config = OmegaConf.load("configs/global_configs.yaml")
+    if cfg.similarity.metric not in METRICS:
+        logging.critical("Unknown similarity metric '%s'. Use one of %s.", cfg.similarity.metric, METRICS)
+        return None
+
+    index = load_similarity_index(one_hot_features_path(cfg.similarity.features_path), cfg.similarity.index_path,
+                                  cfg.similarity.rebuild)
+    if index is None:
+        return None
+
+    catalog = load_catalog(global_config.storage.format)
+    if cfg.query.all:
+        query_ids = np.asarray(index.ids)
+    else:
+        names = catalog.index[catalog['name'].isin(list(cfg.query.names))].tolist()
+        missing_names = set(cfg.query.names) - set(catalog['name'])
+        if missing_names:
+            logging.warning("Cocktails %s not found.", sorted(missing_names))
+        query_ids = np.asarray(list(cfg.query.ids) + names, dtype=np.int64)
+
+    found = index.rows_of(query_ids) >= 0
+    if not found.all():
+        logging.warning("Cocktails %s are not in the similarity index.", query_ids[~found].tolist())
+        query_ids = query_ids[found]
+
+    with measure('query') as stage:
+        result_ids, result_scores = index.query_ids(query_ids, cfg.query.k, cfg.similarity.metric,
+                                                    cfg.query.batch_size)
+        stage.rows = len(query_ids)
+
+    if cfg.query.output_path:
+        write_dataset(similar_table(query_ids, result_ids, result_scores), cfg.query.output_path)
+    if not cfg.query.all:
+        for query_id, ids, scores in zip(query_ids, result_ids, result_scores):
+            log_similar(query_id, ids, scores, catalog, cfg.similarity.metric)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Shared helpers used by the analysis, preprocessing and clustering scripts."""
@@ -0,0 +1,533 @@
+import os
+import json
+import logging
+from itertools import chain, islice
+
+from omegaconf import OmegaConf
+
+from utils.ingestion import is_sharded, iter_shard_records, read_records
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+pa = lazy_import('pyarrow')
+pq = lazy_import('pyarrow.parquet')
+sparse = lazy_import('scipy.sparse')
+
+logger = logging.getLogger(__name__)
+
+RAW_DATASET = 'data/raw/cocktail_dataset.json'
+PROCESSED_DATASET = 'data/processed/processed_cocktail_dataset'
+CLUSTERED_DATASET = 'data/processed/clustered_cocktail_dataset'
+ONE_HOT_FEATURES = 'data/processed/one_hot_tags'
+
+# Config of one_hot_encode_tags.py, whose one_hot.output_path locates the one-hot matrix
+ONE_HOT_CONFIG = 'configs/preprocessing_configs/one_hot_encoding_config.yaml'
+
+# File extension used for every supported storage format
+FORMAT_EXTENSIONS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+    'json': '.json',
+}
+
+
+def dataset_path(stem, storage_format='parquet'):
+    """
+    Build the path of a stored dataset for the given storage format.
+
+    Parameters:
+    stem (str): Path of the dataset without extension.
+    storage_format (str): One of 'parquet', 'arrow' or 'json'.
+
+    Returns:
+    str: Path of the dataset file.
+    """
+    if storage_format not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Unknown storage format '{storage_format}'. Use one of {list(FORMAT_EXTENSIONS)}.")
+    return stem + FORMAT_EXTENSIONS[storage_format]
+
+
+def resolve_dataset_path(stem, storage_format='parquet'):
+    """
+    Find an existing dataset, falling back to its JSON export.
+
+    The columnar file is preferred. If it has not been written yet but a JSON
+    file with the same stem exists (e.g. the bundled processed dataset), the
+    JSON file is used instead.
+
+    Parameters:
+    stem (str): Path of the dataset without extension.
+    storage_format (str): Preferred storage format.
+
+    Returns:
+    str: Path of the dataset file to read.
+    """
+    path = dataset_path(stem, storage_format)
+    json_path = dataset_path(stem, 'json')
+    if not os.path.exists(path) and os.path.exists(json_path):
+        logger.info("%s not found, falling back to %s", path, json_path)
+        return json_path
+    return path
+
+
+def raw_input_path(global_config):
+    """
+    Source of the raw dataset set in the global config.
+
+    Parameters:
+    global_config (DictConfig): Global configuration with an optional 'ingestion' section.
+
+    Returns:
+    str: A JSON file, a glob of JSON shards, a directory or a manifest (see utils.ingestion), RAW_DATASET by default.
+    """
+    return (global_config.get('ingestion') or {}).get('raw_input') or RAW_DATASET
+
+
+def one_hot_features_path(path=None):
+    """
+    Directory of the one-hot matrix read by the scripts using the tag features.
+
+    Parameters:
+    path (str): Directory set in the config of the script, None to follow one_hot_encode_tags.py.
+
+    Returns:
+    str: path, or one_hot.output_path of the one-hot encoding config, ONE_HOT_FEATURES if it sets none.
+    """
+    if path:
+        return path
+    if not os.path.exists(ONE_HOT_CONFIG):
+        return ONE_HOT_FEATURES
+    return OmegaConf.load(ONE_HOT_CONFIG).one_hot.get('output_path') or ONE_HOT_FEATURES
+
+
+def input_dataset_path(global_config):
+    """
+    Select the input dataset based on the data type in the global config.
+
+    Parameters:
+    global_config (DictConfig): Global configuration with 'data_type' and 'storage' keys.
+
+    Returns:
+    str: Path of the dataset to read, or None if the data type is invalid.
+    """
+    if global_config.data_type == 'raw':
+        return raw_input_path(global_config)
+    if global_config.data_type == 'processed':
+        return resolve_dataset_path(PROCESSED_DATASET, global_config.storage.format)
+    return None
+
+
+def _table_to_frame(table):
+    """
+    Convert an Arrow table to a DataFrame.
+
+    List columns (e.g. 'tags' and the list-of-struct 'ingredients') are
+    converted to Python lists of dicts, matching what pd.read_json returns.
+    """
+    list_columns = [field.name for field in table.schema
+                    if pa.types.is_list(field.type) or pa.types.is_large_list(field.type)]
+    flat_columns = [name for name in table.column_names if name not in list_columns]
+
+    df = table.select(flat_columns).to_pandas()
+    for name in list_columns:
+        df[name] = table.column(name).to_pylist()
+    return df[table.column_names]
+
+
+def read_dataset(file_path, columns=None):
+    """
+    Read a dataset stored as Parquet, Arrow IPC or JSON.
+
+    Columnar files are memory-mapped and only the requested columns are
+    materialized. Sharded raw JSON datasets are decoded in a process pool.
+
+    Parameters:
+    file_path (str): Path to the dataset file, or a glob, directory or manifest of JSON shards.
+    columns (list): Optional list of columns to load. All columns are loaded if None.
+
+    Returns:
+    pd.DataFrame: The loaded data.
+    """
+    if is_sharded(file_path):
+        data = pd.DataFrame(read_records(file_path))
+        return data[columns] if columns is not None else data
+
+    extension = os.path.splitext(file_path)[1]
+
+    if extension == FORMAT_EXTENSIONS['parquet']:
+        table = pq.read_table(file_path, columns=columns, memory_map=True)
+    elif extension == FORMAT_EXTENSIONS['arrow']:
+        with pa.memory_map(file_path, 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(columns)
+    else:
+        data = pd.read_json(file_path)
+        return data[columns] if columns is not None else data
+
+    return _table_to_frame(table)
+
+
+def iter_dataset_batches(file_path, batch_size, columns=None):
+    """
+    Read a dataset stored as Parquet, Arrow IPC or JSON in batches of rows.
+
+    Parquet files are read row group by row group and Arrow files are
+    memory-mapped, JSON arrays are parsed incrementally with iter_json_array,
+    so only one batch is materialized at a time. JSON shards are decoded a few
+    at a time in a process pool.
+
+    Parameters:
+    file_path (str): Path to the dataset file, or a glob, directory or manifest of JSON shards.
+    batch_size (int): Number of rows per batch.
+    columns (list): Optional list of columns to load. All columns are loaded if None.
+
+    Yields:
+    pd.DataFrame: The next batch of rows.
+    """
+    extension = os.path.splitext(file_path)[1]
+
+    if extension == FORMAT_EXTENSIONS['parquet']:
+        parquet_file = pq.ParquetFile(file_path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            yield _table_to_frame(pa.Table.from_batches([batch]))
+    elif extension == FORMAT_EXTENSIONS['arrow']:
+        with pa.memory_map(file_path, 'r') as source:
+            table = pa.ipc.open_file(source).read_all()
+            if columns is not None:
+                table = table.select(columns)
+            for start in range(0, table.num_rows, batch_size):
+                yield _table_to_frame(table.slice(start, batch_size))
+    else:
+        records = chain.from_iterable(iter_shard_records(file_path)) if is_sharded(file_path) else \
+            iter_json_array(file_path)
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                return
+            batch = pd.DataFrame(batch)
+            yield batch[columns] if columns is not None else batch
+
+
+def read_schema(file_path):
+    """
+    Read the Arrow schema of a dataset without reading its rows.
+
+    Parameters:
+    file_path (str): Path to the dataset file.
+
+    Returns:
+    pa.Schema: The schema of a Parquet or Arrow file, None for JSON.
+    """
+    extension = os.path.splitext(file_path)[1]
+    if extension == FORMAT_EXTENSIONS['parquet']:
+        return pq.read_schema(file_path)
+    if extension == FORMAT_EXTENSIONS['arrow']:
+        with pa.memory_map(file_path, 'r') as source:
+            return pa.ipc.open_file(source).schema
+    return None
+
+
+def write_dataset(df, file_path):
+    """
+    Write a dataset as Parquet, Arrow IPC or JSON based on the file extension.
+
+    Nested columns such as 'ingredients' are stored as list-of-struct columns.
+    Columnar files are written to a temporary file that then replaces the old
+    file, so data memory-mapped from the old file stays valid.
+
+    Parameters:
+    df (pd.DataFrame): The DataFrame to save.
+    file_path (str): Path to the output file.
+    """
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    extension = os.path.splitext(file_path)[1]
+
+    if extension == FORMAT_EXTENSIONS['json']:
+        export_json(df, file_path)
+        return
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    temporary_path = file_path + '.tmp'
+    if extension == FORMAT_EXTENSIONS['parquet']:
+        pq.write_table(table, temporary_path)
+    elif extension == FORMAT_EXTENSIONS['arrow']:
+        with pa.OSFile(temporary_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    else:
+        raise ValueError(f"Unsupported dataset extension '{extension}' for {file_path}")
+    os.replace(temporary_path, file_path)
+
+    logger.info("Dataset written to %s", file_path)
+
+
+def iter_json_array(file_path, buffer_size=2 ** 16):
+    """
+    Iterate over the elements of a top-level JSON array without loading the whole file.
+
+    The file is read in buffers and the elements are decoded one at a time with
+    json.JSONDecoder.raw_decode, so memory is bounded by the buffer and the
+    largest element.
+
+    Parameters:
+    file_path (str): Path to a JSON file containing an array.
+    buffer_size (int): Number of characters read at a time.
+
+    Yields:
+    The next decoded element (a dict for the cocktail datasets).
+    """
+    decoder = json.JSONDecoder()
+    with open(file_path, encoding='utf-8') as source:
+        buffer, position, eof = '', 0, False
+        # '[' before the array, 'first' after '[', 'value' after ',' and 'separator' after an element
+        state = '['
+
+        def read_more(size):
+            nonlocal buffer, position, eof
+            if eof:
+                raise ValueError(f"Unexpected end of the JSON array in {file_path}")
+            chunk = source.read(size)
+            eof = not chunk
+            buffer, position = buffer[position:] + chunk, 0
+
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position == len(buffer):
+                read_more(buffer_size)
+                continue
+
+            character = buffer[position]
+            if state == '[':
+                if character != '[':
+                    raise ValueError(f"{file_path} does not contain a JSON array")
+                position += 1
+                state = 'first'
+            elif character == ']' and state in ('first', 'separator'):
+                return
+            elif state == 'separator':
+                if character != ',':
+                    raise ValueError(f"Expected ',' or ']' between the elements of the JSON array in {file_path}")
+                position += 1
+                state = 'value'
+            else:
+                try:
+                    element, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    end = None
+                # The element continues in the next buffer (a cut number like "2." decodes as 2), read
+                # as much again as is buffered so long elements are not decoded over and over
+                if end is None or not eof and (end == len(buffer) or buffer[end] not in ' \t\n\r,]'):
+                    read_more(max(buffer_size, len(buffer) - position))
+                    continue
+                yield element
+                position, state = end, 'separator'
+
+
+def merge_arrow_types(left, right):
+    """
+    Find an Arrow type holding the values of both types.
+
+    Null types (columns or fields without any value yet) take the other type,
+    struct fields are united and integers are widened to floats.
+
+    Parameters:
+    left (pa.DataType): First type.
+    right (pa.DataType): Second type.
+
+    Returns:
+    pa.DataType: The merged type.
+    """
+    if pa.types.is_null(left):
+        return right
+    if pa.types.is_null(right) or left == right:
+        return left
+    if pa.types.is_list(left) and pa.types.is_list(right):
+        return pa.list_(merge_arrow_types(left.value_type, right.value_type))
+    if pa.types.is_struct(left) and pa.types.is_struct(right):
+        fields = {field.name: field.type for field in left}
+        for field in right:
+            fields[field.name] = merge_arrow_types(fields.get(field.name, pa.null()), field.type)
+        return pa.struct(list(fields.items()))
+    numeric = (pa.types.is_integer, pa.types.is_floating)
+    if any(check(left) for check in numeric) and any(check(right) for check in numeric):
+        return pa.float64()
+    raise TypeError(f"Incompatible column types {left} and {right}")
+
+
+def merge_schemas(schemas):
+    """
+    Merge the schemas of record batches into one fitting all of them, see merge_arrow_types.
+
+    Parameters:
+    schemas (iterable): Arrow schemas.
+
+    Returns:
+    pa.Schema: The merged schema.
+    """
+    record_type = pa.struct([])
+    for schema in schemas:
+        record_type = merge_arrow_types(record_type, pa.struct(list(schema)))
+    return pa.schema(list(record_type))
+
+
+def write_record_chunks(chunks, file_path, schema=None):
+    """
+    Write a dataset from chunks of records without holding all of them in memory.
+
+    For columnar formats chunks is iterated twice: the first pass infers a
+    schema that fits every chunk (e.g. a field that is null in the first chunk
+    but not later), the second pass writes the chunks with it. JSON is written
+    in a single pass.
+
+    Parameters:
+    chunks (callable): Returns a new iterator over lists of record dicts.
+    file_path (str): Path to the output file. The format follows the extension.
+    schema (pa.Schema): Schema fitting every chunk, e.g. merged from the shard schemas. If
+                        given, chunks is only iterated once.
+
+    Returns:
+    int: Number of records written.
+    """
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    extension = os.path.splitext(file_path)[1]
+    temporary_path = file_path + '.tmp'
+    n_records = 0
+
+    if extension == FORMAT_EXTENSIONS['json']:
+        with open(temporary_path, 'w', encoding='utf-8') as sink:
+            sink.write('[')
+            for chunk in chunks():
+                for record in chunk:
+                    sink.write(',\n' if n_records else '\n')
+                    json.dump(record, sink, indent=4)
+                    n_records += 1
+            sink.write('\n]')
+        os.replace(temporary_path, file_path)
+        logger.info("Dataset written to %s", file_path)
+        return n_records
+
+    if extension not in (FORMAT_EXTENSIONS['parquet'], FORMAT_EXTENSIONS['arrow']):
+        raise ValueError(f"Unsupported dataset extension '{extension}' for {file_path}")
+
+    if schema is None:
+        schema = merge_schemas(pa.Table.from_pylist(chunk).schema for chunk in chunks())
+
+    if extension == FORMAT_EXTENSIONS['parquet']:
+        writer = pq.ParquetWriter(temporary_path, schema)
+    else:
+        writer = pa.ipc.new_file(pa.OSFile(temporary_path, 'wb'), schema)
+    try:
+        for chunk in chunks():
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+            n_records += len(chunk)
+    finally:
+        writer.close()
+    os.replace(temporary_path, file_path)
+
+    logger.info("Dataset written to %s in chunks", file_path)
+    return n_records
+
+
+def export_json(df, file_path):
+    """
+    Export a dataset to an indented JSON file.
+
+    Parameters:
+    df (pd.DataFrame): The DataFrame to export.
+    file_path (str): Path to the output JSON file.
+    """
+    df.to_json(file_path, orient='records', indent=4)
+    logger.info("JSON export written to %s", file_path)
+
+
+def write_feature_matrix(matrix, ids, columns, directory):
+    """
+    Save a sparse feature matrix as a directory of .npy arrays.
+
+    The CSR arrays (data, indices, indptr) and the cocktail ids are stored as raw
+    .npy files so they can be memory-mapped on read, the shape and column names
+    are stored in meta.json.
+
+    Parameters:
+    matrix (scipy.sparse.csr_matrix): Feature matrix with one row per cocktail.
+    ids (array-like): Cocktail id of every row.
+    columns (list): Name of every column (None for unused positions).
+    directory (str): Output directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    np.save(os.path.join(directory, 'data.npy'), matrix.data)
+    np.save(os.path.join(directory, 'indices.npy'), matrix.indices)
+    np.save(os.path.join(directory, 'indptr.npy'), matrix.indptr)
+    np.save(os.path.join(directory, 'ids.npy'), np.asarray(ids))
+
+    with open(os.path.join(directory, 'meta.json'), 'w') as meta_file:
+        json.dump({'shape': list(matrix.shape), 'columns': list(columns)}, meta_file, indent=4)
+
+    logger.info("Feature matrix %s written to %s", matrix.shape, directory)
+
+
+def read_feature_matrix(directory, mmap=True):
+    """
+    Load a sparse feature matrix saved by write_feature_matrix.
+
+    Parameters:
+    directory (str): Directory of the feature matrix.
+    mmap (bool): Memory-map the arrays instead of reading them into memory.
+
+    Returns:
+    tuple: (matrix, ids, columns) - CSR matrix, cocktail ids and column names.
+    """
+    mmap_mode = 'r' if mmap else None
+    with open(os.path.join(directory, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+
+    matrix = sparse.csr_matrix(
+        (np.load(os.path.join(directory, 'data.npy'), mmap_mode=mmap_mode),
+         np.load(os.path.join(directory, 'indices.npy'), mmap_mode=mmap_mode),
+         np.load(os.path.join(directory, 'indptr.npy'), mmap_mode=mmap_mode)),
+        shape=tuple(meta['shape']),
+        copy=False,
+    )
+    ids = np.load(os.path.join(directory, 'ids.npy'), mmap_mode=mmap_mode)
+    return matrix, ids, meta['columns']
+
+
+def iter_row_batches(matrix, batch_size):
+    """
+    Iterate over a sparse matrix in row batches.
+
+    For a matrix loaded with read_feature_matrix(mmap=True), only the rows of
+    the current batch are read from disk.
+
+    Parameters:
+    matrix (scipy.sparse.csr_matrix): Feature matrix, in memory or memory-mapped.
+    batch_size (int): Number of rows per batch.
+
+    Yields:
+    scipy.sparse.csr_matrix: The next batch of rows.
+    """
+    for start in range(0, matrix.shape[0], batch_size):
+        yield matrix[start:start + batch_size]
+
+
+def iter_feature_batches(directory, batch_size):
+    """
+    Iterate over a feature matrix saved by write_feature_matrix in row batches.
+
+    The arrays are memory-mapped, so only the rows of the current batch are
+    read from disk.
+
+    Parameters:
+    directory (str): Directory of the feature matrix.
+    batch_size (int): Number of rows per batch.
+
+    Yields:
+    scipy.sparse.csr_matrix: The next batch of rows.
+    """
+    matrix, _, _ = read_feature_matrix(directory, mmap=True)
+    yield from iter_row_batches(matrix, batch_size)
@@ -0,0 +1,133 @@
+import os
+import json
+import hashlib
+import logging
+
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_DIR = 'data/processed/manifests'
+
+
+def stable_hash(value):
+    """
+    Hash a JSON-serializable value independently of dict key order.
+
+    Parameters:
+    value: Any JSON-serializable value (dicts, lists, strings, numbers).
+
+    Returns:
+    str: 16 character hex digest.
+    """
+    payload = json.dumps(value, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def file_hash(path, chunk_size=2 ** 20):
+    """
+    Hash the content of a file, reading it in chunks.
+
+    Parameters:
+    path (str): Path to the file.
+    chunk_size (int): Bytes read at a time.
+
+    Returns:
+    str: 16 character hex digest.
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(stage, manifest_dir=MANIFEST_DIR):
+    """
+    Load the manifest of a pipeline stage.
+
+    The manifest stores the hash of the stage config, the config itself and the
+    content hash of every cocktail processed by the last run.
+
+    Parameters:
+    stage (str): Name of the stage, e.g. 'simplify', 'tagging' or 'one_hot'.
+    manifest_dir (str): Directory of the manifests.
+
+    Returns:
+    dict: Manifest with 'config_hash', 'config' and 'records' (id -> hash) keys.
+          Empty if the stage has not been run incrementally yet.
+    """
+    path = os.path.join(manifest_dir, f"{stage}.json")
+    if not os.path.exists(path):
+        return {'config_hash': None, 'config': None, 'records': {}}
+    with open(path) as manifest_file:
+        return json.load(manifest_file)
+
+
+def save_manifest(stage, config, ids, hashes, manifest_dir=MANIFEST_DIR):
+    """
+    Save the manifest of a pipeline stage.
+
+    Parameters:
+    stage (str): Name of the stage.
+    config (dict): Plain container with the stage config.
+    ids (array-like): Cocktail ids.
+    hashes (list): Content hash of every cocktail.
+    manifest_dir (str): Directory of the manifests.
+    """
+    os.makedirs(manifest_dir, exist_ok=True)
+    manifest = {
+        'config_hash': stable_hash(config),
+        'config': config,
+        'records': dict(zip((str(cocktail_id) for cocktail_id in ids), hashes)),
+    }
+    with open(os.path.join(manifest_dir, f"{stage}.json"), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    logger.info("Manifest of stage '%s' saved with %d records", stage, len(hashes))
+
+
+def diff_records(ids, hashes, manifest):
+    """
+    Compare content hashes with the manifest of the previous run.
+
+    Parameters:
+    ids (array-like): Cocktail ids of the current input.
+    hashes (list): Content hash of every cocktail of the current input.
+    manifest (dict): Manifest loaded with load_manifest.
+
+    Returns:
+    tuple: (changed, removed) - boolean array marking new or updated cocktails,
+           and the set of ids processed last time that are no longer in the input.
+    """
+    previous = manifest['records']
+    keys = [str(cocktail_id) for cocktail_id in ids]
+    changed = np.fromiter((previous.get(key) != value for key, value in zip(keys, hashes)),
+                          dtype=bool, count=len(keys))
+    removed = set(previous) - set(keys)
+    return changed, removed
+
+
+def merge_by_id(existing, updated, ids):
+    """
+    Merge updated rows into an existing dataset.
+
+    Rows of updated replace the rows of existing with the same id, and the result
+    follows the order of ids (the ids missing from it are dropped).
+
+    Parameters:
+    existing (pd.DataFrame): Previously processed dataset.
+    updated (pd.DataFrame): Newly processed rows.
+    ids (array-like): Ids of the result, in order.
+
+    Returns:
+    pd.DataFrame: Merged dataset.
+    """
+    if updated.empty:
+        merged = existing
+    else:
+        kept = existing[~existing['id'].isin(updated['id'])]
+        merged = pd.concat([kept, updated], ignore_index=True)
+    return merged.set_index('id').loc[list(ids)].reset_index()
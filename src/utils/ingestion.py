@@ -0,0 +1,197 @@
+import os
+import glob
+import json
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+try:
+    import orjson
+except ImportError:  # Optional, decodes JSON several times faster than the json module
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Files listing one shard path per line
+MANIFEST_EXTENSIONS = ('.txt', '.lst')
+GLOB_CHARACTERS = '*?['
+
+
+def is_sharded(source):
+    """
+    Check whether a raw dataset source names several shards rather than one file.
+
+    Parameters:
+    source (str): A file, a glob pattern, a directory or a manifest.
+
+    Returns:
+    bool: True for a glob pattern, a directory or a manifest file.
+    """
+    return (any(character in source for character in GLOB_CHARACTERS) or os.path.isdir(source)
+            or source.endswith(MANIFEST_EXTENSIONS))
+
+
+def resolve_shards(source):
+    """
+    List the JSON shards of a raw dataset source.
+
+    Parameters:
+    source (str): A JSON file, a glob pattern (e.g. 'data/raw/shards/*.json', '**' is recursive),
+                  a directory of .json files, or a manifest (.txt or .lst) listing one shard
+                  per line, relative to the manifest, with '#' comments.
+
+    Returns:
+    list: Paths to the shards, sorted unless listed by a manifest.
+    """
+    if os.path.isdir(source):
+        paths = sorted(glob.glob(os.path.join(source, '*.json')))
+    elif source.endswith(MANIFEST_EXTENSIONS):
+        with open(source) as manifest:
+            lines = [line.split('#', 1)[0].strip() for line in manifest]
+        paths = [os.path.join(os.path.dirname(source), line) for line in lines if line]
+    elif any(character in source for character in GLOB_CHARACTERS):
+        paths = sorted(glob.glob(source, recursive=True))
+    else:
+        paths = [source]
+
+    if not paths:
+        raise FileNotFoundError(f"No raw dataset shards match {source}")
+    return paths
+
+
+def load_json(file_path):
+    """Decode a JSON file, with orjson if it is installed."""
+    if orjson is not None:
+        with open(file_path, 'rb') as source:
+            return orjson.loads(source.read())
+    with open(file_path, encoding='utf-8') as source:
+        return json.load(source)
+
+
+def parse_shard(file_path, transform=None):
+    """
+    Decode a shard containing a JSON array of records.
+
+    Parameters:
+    file_path (str): Path to the shard.
+    transform (callable): Applied to every record in the worker, e.g. simplify_record,
+                          so dropped fields are never sent back to the main process.
+
+    Returns:
+    list: The records of the shard.
+    """
+    records = load_json(file_path)
+    if not isinstance(records, list):
+        raise ValueError(f"{file_path} does not contain a JSON array")
+    return [transform(record) for record in records] if transform is not None else records
+
+
+def shard_schema(file_path, transform=None):
+    """
+    Infer the Arrow schema of the records of a shard.
+
+    Parameters:
+    file_path (str): Path to the shard.
+    transform (callable): Applied to every record first, see parse_shard.
+
+    Returns:
+    pa.Schema: The schema, None for an empty shard.
+    """
+    import pyarrow as pa
+    records = parse_shard(file_path, transform)
+    return pa.Table.from_pylist(records).schema if records else None
+
+
+def n_workers(n_jobs, n_tasks):
+    """Number of worker processes for n_tasks tasks, n_jobs -1 or None uses all cores."""
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    return max(1, min(n_jobs, n_tasks))
+
+
+def map_shards(function, shards, n_jobs=-1, max_pending=2):
+    """
+    Apply a function to every shard in a process pool, yielding the results in shard order.
+
+    At most max_pending shards per worker are submitted ahead of the one being
+    consumed, so memory is bounded by the size of a few shards whatever the
+    total size of the dataset.
+
+    Parameters:
+    function (callable): function(path), must be picklable (a module-level function or a partial of one).
+    shards (list): Paths to the shards.
+    n_jobs (int): Number of worker processes, -1 uses all cores, 1 runs in the main process.
+    max_pending (int): Shards in flight per worker.
+
+    Yields:
+    The result of function for every shard.
+    """
+    workers = n_workers(n_jobs, len(shards))
+    if workers == 1:
+        for path in shards:
+            yield function(path)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for path in shards:
+            if len(pending) >= workers * max_pending:
+                yield pending.popleft().result()
+            pending.append(pool.submit(function, path))
+        while pending:
+            yield pending.popleft().result()
+
+
+def iter_shard_records(source, transform=None, n_jobs=-1, max_pending=2):
+    """
+    Decode the shards of a raw dataset concurrently.
+
+    Parameters:
+    source (str): A file, glob pattern, directory or manifest, see resolve_shards.
+    transform (callable): Applied to every record in the workers, see parse_shard.
+    n_jobs (int): Number of worker processes, -1 uses all cores.
+    max_pending (int): Shards in flight per worker.
+
+    Yields:
+    list: The records of the next shard, in shard order.
+    """
+    shards = resolve_shards(source)
+    logger.info("Reading %d shards from %s", len(shards), source)
+    yield from map_shards(partial(parse_shard, transform=transform), shards, n_jobs, max_pending)
+
+
+def iter_shard_schemas(source, transform=None, n_jobs=-1, max_pending=2):
+    """
+    Infer the Arrow schema of every shard of a raw dataset concurrently.
+
+    Only the schemas are sent back to the main process, not the records.
+
+    Parameters:
+    source (str): A file, glob pattern, directory or manifest, see resolve_shards.
+    transform (callable): Applied to every record in the workers, see parse_shard.
+    n_jobs (int): Number of worker processes, -1 uses all cores.
+    max_pending (int): Shards in flight per worker.
+
+    Yields:
+    pa.Schema: The schema of the next non-empty shard.
+    """
+    for schema in map_shards(partial(shard_schema, transform=transform), resolve_shards(source), n_jobs, max_pending):
+        if schema is not None:
+            yield schema
+
+
+def read_records(source, transform=None, n_jobs=-1, max_pending=2):
+    """
+    Decode all the records of a raw dataset, concurrently if it is sharded.
+
+    Parameters:
+    source (str): A file, glob pattern, directory or manifest, see resolve_shards.
+    transform (callable): Applied to every record in the workers, see parse_shard.
+    n_jobs (int): Number of worker processes, -1 uses all cores.
+    max_pending (int): Shards in flight per worker.
+
+    Returns:
+    list: The records of all shards, in shard order.
+    """
+    return [record for records in iter_shard_records(source, transform, n_jobs, max_pending) for record in records]
@@ -0,0 +1,421 @@
+from __future__ import annotations
+
+import os
+import json
+import logging
+from dataclasses import dataclass
+
+from utils.data_storage import dataset_path, read_dataset, write_dataset
+from utils.incremental import file_hash
+from utils.lazy_imports import lazy_import
+
+np = lazy_import('numpy')
+pd = lazy_import('pandas')
+sparse = lazy_import('scipy.sparse')
+
+logger = logging.getLogger(__name__)
+
+INGREDIENT_INDEX = 'data/processed/ingredients'
+
+# Key of the ingredient dicts that depends on the cocktail, stored on the edges instead of the dimension table
+MEASURE = 'measure'
+
+
+@dataclass
+class IngredientIndex:
+    """
+    Ingredients of every cocktail, normalized into a dimension table and integer edges.
+
+    Every ingredient is stored once in the dimension table, keyed by its
+    integer id. The ingredients of cocktail i are ingredient_ids[offsets[i]:offsets[i + 1]]
+    (CSR layout), with the measure of each of them dictionary-encoded in measure_codes.
+
+    Attributes:
+    table (pd.DataFrame): One row per ingredient, sorted by 'id', without the measure.
+    ids (np.ndarray): Cocktail id of every row.
+    offsets (np.ndarray): int64 start of the ingredients of every cocktail, plus the total.
+    ingredient_ids (np.ndarray): int32 ingredient id of every edge.
+    measure_codes (np.ndarray): int32 position of the measure of every edge in measures, -1 without measure.
+    measures (list): Distinct measures.
+    columns (list): Keys of the ingredient dicts, in their original order.
+    """
+    table: pd.DataFrame
+    ids: np.ndarray
+    offsets: np.ndarray
+    ingredient_ids: np.ndarray
+    measure_codes: np.ndarray
+    measures: list
+    columns: list
+
+    @property
+    def n_cocktails(self):
+        return len(self.ids)
+
+    def ingredient_rows(self, start=0, stop=None):
+        """
+        Join edges to the dimension table by integer id.
+
+        Parameters:
+        start (int): Position of the first edge.
+        stop (int): Position after the last edge, all remaining edges if None.
+
+        Returns:
+        np.ndarray: Row of the dimension table of every edge.
+        """
+        return np.searchsorted(self.table['id'].to_numpy(dtype=np.int64), self.ingredient_ids[start:stop])
+
+    def incidence_matrix(self):
+        """
+        Build the sparse cocktail x ingredient count matrix.
+
+        Returns:
+        sparse.csr_matrix: int32 matrix with one column per row of the dimension table.
+        """
+        matrix = sparse.csr_matrix(
+            (np.ones(len(self.ingredient_ids), dtype=np.int32), self.ingredient_rows(), np.asarray(self.offsets)),
+            shape=(self.n_cocktails, len(self.table)),
+        )
+        # An ingredient listed twice in a cocktail is counted twice
+        matrix.sum_duplicates()
+        return matrix
+
+    def edges(self, start=0, stop=None):
+        """
+        Flatten the ingredients of a range of cocktails, like json_normalize of the exploded ingredients.
+
+        Parameters:
+        start (int): Row of the first cocktail.
+        stop (int): Row after the last cocktail, all remaining cocktails if None.
+
+        Returns:
+        pd.DataFrame: One row per ingredient of a cocktail, with the keys of the ingredient dicts as columns.
+        """
+        stop = self.n_cocktails if stop is None else stop
+        first, last = int(self.offsets[start]), int(self.offsets[stop])
+        flat = self.table.iloc[self.ingredient_rows(first, last)].reset_index(drop=True)
+        if MEASURE in self.columns:
+            # Code -1 picks the trailing None
+            measures = np.array(list(self.measures) + [None], dtype=object)
+            flat[MEASURE] = measures[self.measure_codes[first:last]]
+        return flat[self.columns]
+
+    def iter_edge_batches(self, batch_size):
+        """
+        Flatten the ingredients batch by batch of cocktails.
+
+        Parameters:
+        batch_size (int): Number of cocktails per batch.
+
+        Yields:
+        pd.DataFrame: The flat ingredients of the next batch of cocktails.
+        """
+        for start in range(0, self.n_cocktails, batch_size):
+            yield self.edges(start, min(start + batch_size, self.n_cocktails))
+
+    def nested_ingredients(self):
+        """
+        Rebuild the list of ingredient dicts of every cocktail.
+
+        Returns:
+        list: List of ingredient dicts of every cocktail, missing values as None.
+        """
+        flat = self.edges().astype(object)
+        records = flat.where(flat.notna(), None).to_dict('records')
+        return [records[self.offsets[row]:self.offsets[row + 1]] for row in range(self.n_cocktails)]
+
+    def align(self, ids):
+        """
+        Reorder the index to follow the rows of a dataset.
+
+        Parameters:
+        ids (array-like): Cocktail id of every row of the dataset.
+
+        Returns:
+        IngredientIndex: The index with one row per id, None if an id is not indexed.
+        """
+        ids = np.asarray(ids)
+        if len(ids) == self.n_cocktails and np.array_equal(ids, self.ids):
+            return self
+
+        positions = pd.Index(self.ids).get_indexer(ids)
+        if (positions < 0).any():
+            return None
+        lengths = np.diff(self.offsets)[positions]
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        # Position of every edge in the current arrays, cocktail by cocktail
+        edges = np.repeat(np.asarray(self.offsets)[positions] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return IngredientIndex(self.table, ids, offsets, self.ingredient_ids[edges], self.measure_codes[edges],
+                               self.measures, self.columns)
+
+
+class IngredientIndexBuilder:
+    """
+    Build an IngredientIndex from cocktails added chunk by chunk.
+
+    Only the edges and the ingredients not seen in previous chunks are kept,
+    so the nested ingredient dicts of a chunk can be released once it is added.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.lengths = []
+        self.ingredient_ids = []
+        self.measure_codes = []
+        self.tables = []
+        self.seen = set()
+        self.measures = {}
+        self.columns = {}
+
+    def add(self, ids, ingredient_lists):
+        """
+        Add a chunk of cocktails.
+
+        Parameters:
+        ids (array-like): Cocktail ids.
+        ingredient_lists (iterable): List of ingredient dicts of every cocktail.
+        """
+        ingredient_lists = [ingredients if isinstance(ingredients, (list, tuple, np.ndarray)) else []
+                            for ingredients in ingredient_lists]
+        self.ids.append(np.asarray(ids))
+        self.lengths.append(np.fromiter(map(len, ingredient_lists), dtype=np.int64, count=len(ingredient_lists)))
+
+        flat = pd.json_normalize([ingredient for ingredients in ingredient_lists for ingredient in ingredients])
+        if flat.empty:
+            return
+        if 'id' not in flat.columns or flat['id'].isna().any():
+            raise ValueError("Every ingredient needs an integer 'id' to be indexed.")
+        self.columns.update(dict.fromkeys(flat.columns))
+
+        ingredient_ids = flat['id'].to_numpy(dtype=np.int64)
+        if ingredient_ids.min() < 0 or ingredient_ids.max() > np.iinfo(np.int32).max:
+            raise ValueError("Ingredient ids must fit in int32.")
+        self.ingredient_ids.append(ingredient_ids.astype(np.int32))
+
+        codes = np.full(len(flat), -1, dtype=np.int32)
+        if MEASURE in flat.columns:
+            measures = flat.pop(MEASURE)
+            present = measures.notna().to_numpy()
+            codes[present] = [self.measures.setdefault(measure, len(self.measures)) for measure in measures[present]]
+        self.measure_codes.append(codes)
+
+        new = flat.drop_duplicates(subset='id')
+        new = new[~new['id'].isin(self.seen)]
+        self.seen.update(new['id'].tolist())
+        self.tables.append(new)
+
+    def build(self):
+        """
+        Build the index of all added cocktails.
+
+        Returns:
+        IngredientIndex: The index, in the order the cocktails were added.
+        """
+        table_columns = [column for column in self.columns if column != MEASURE] or ['id']
+        if self.tables:
+            table = pd.concat(self.tables, ignore_index=True).sort_values('id', ignore_index=True)[table_columns]
+        else:
+            table = pd.DataFrame(columns=table_columns)
+
+        def concat(arrays, dtype):
+            return np.concatenate(arrays).astype(dtype, copy=False) if arrays else np.empty(0, dtype=dtype)
+
+        lengths = concat(self.lengths, np.int64)
+        return IngredientIndex(
+            table=table,
+            ids=concat(self.ids, np.int64),
+            offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            ingredient_ids=concat(self.ingredient_ids, np.int32),
+            measure_codes=concat(self.measure_codes, np.int32),
+            measures=list(self.measures),
+            columns=list(self.columns),
+        )
+
+
+def build_ingredient_index(ids, ingredient_lists):
+    """
+    Normalize the nested ingredients of a dataset into an IngredientIndex.
+
+    Parameters:
+    ids (array-like): Cocktail id of every row.
+    ingredient_lists (iterable): List of ingredient dicts of every row.
+
+    Returns:
+    IngredientIndex: The index, one row per cocktail.
+    """
+    builder = IngredientIndexBuilder()
+    builder.add(ids, ingredient_lists)
+    return builder.build()
+
+
+def write_ingredient_index(index, directory=INGREDIENT_INDEX, storage_format='parquet', dataset_file=None):
+    """
+    Save an ingredient index as a dimension table and a directory of .npy arrays.
+
+    The edge arrays are stored as raw .npy files so they can be memory-mapped on
+    read, the measures and column order are stored in meta.json, written last.
+
+    Parameters:
+    index (IngredientIndex): The index to save.
+    directory (str): Output directory.
+    storage_format (str): Format of the dimension table: 'parquet', 'arrow' or 'json'.
+    dataset_file (str): Dataset holding the indexed cocktails, already written. Its content hash is
+                        stored so the index is only used with that version of the dataset.
+    """
+    os.makedirs(directory, exist_ok=True)
+    table_path = dataset_path(os.path.join(directory, 'ingredients'), storage_format)
+    write_dataset(index.table, table_path)
+    np.save(os.path.join(directory, 'ids.npy'), index.ids)
+    np.save(os.path.join(directory, 'offsets.npy'), index.offsets)
+    np.save(os.path.join(directory, 'ingredient_ids.npy'), index.ingredient_ids)
+    np.save(os.path.join(directory, 'measure_codes.npy'), index.measure_codes)
+
+    with open(os.path.join(directory, 'meta.json'), 'w') as meta_file:
+        json.dump({'table': os.path.basename(table_path), 'columns': index.columns, 'measures': index.measures,
+                   'dataset': file_hash(dataset_file) if dataset_file else None}, meta_file, indent=4)
+
+    logger.info("Ingredient index with %d ingredients and %d edges written to %s",
+                len(index.table), len(index.ingredient_ids), directory)
+
+
+def read_ingredient_index(directory=INGREDIENT_INDEX, mmap=True):
+    """
+    Load an ingredient index saved by write_ingredient_index.
+
+    Parameters:
+    directory (str): Directory of the index.
+    mmap (bool): Memory-map the edge arrays instead of reading them into memory.
+
+    Returns:
+    IngredientIndex: The loaded index.
+    """
+    mmap_mode = 'r' if mmap else None
+    with open(os.path.join(directory, 'meta.json')) as meta_file:
+        meta = json.load(meta_file)
+
+    def load(name):
+        return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+
+    return IngredientIndex(
+        table=read_dataset(os.path.join(directory, meta['table'])),
+        ids=load('ids'),
+        offsets=load('offsets'),
+        ingredient_ids=load('ingredient_ids'),
+        measure_codes=load('measure_codes'),
+        measures=meta['measures'],
+        columns=meta['columns'],
+    )
+
+
+def index_files(directory=INGREDIENT_INDEX):
+    """
+    List the files of an ingredient index, e.g. to fingerprint it.
+
+    Parameters:
+    directory (str): Directory of the index.
+
+    Returns:
+    list: Sorted paths of the files in the directory, empty if it does not exist.
+    """
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+
+
+def index_matches(dataset_file, directory=INGREDIENT_INDEX):
+    """
+    Check whether the ingredient index was written for the current content of a dataset.
+
+    Parameters:
+    dataset_file (str): Path to the dataset.
+    directory (str): Directory of the index.
+
+    Returns:
+    bool: True if the index exists and its recorded dataset hash matches the file.
+    """
+    meta_path = os.path.join(directory, 'meta.json')
+    if not os.path.exists(meta_path) or not os.path.exists(dataset_file):
+        return False
+    with open(meta_path) as meta_file:
+        recorded = json.load(meta_file).get('dataset')
+    return recorded is not None and recorded == file_hash(dataset_file)
+
+
+def stamp_ingredient_index(dataset_file, directory=INGREDIENT_INDEX):
+    """
+    Record that a dataset rewritten without changing its ingredients (e.g. with new tags) is indexed.
+
+    Parameters:
+    dataset_file (str): Path to the rewritten dataset.
+    directory (str): Directory of the index.
+    """
+    meta_path = os.path.join(directory, 'meta.json')
+    with open(meta_path) as meta_file:
+        meta = json.load(meta_file)
+    meta['dataset'] = file_hash(dataset_file)
+    with open(meta_path, 'w') as meta_file:
+        json.dump(meta, meta_file, indent=4)
+
+
+def update_ingredient_index(cocktails, dataset_file, indexed=False, directory=INGREDIENT_INDEX,
+                            storage_format='parquet'):
+    """
+    Keep the ingredient index in sync with a dataset that was just rewritten.
+
+    Parameters:
+    cocktails (pd.DataFrame): The cocktails written to dataset_file, with their nested
+                              'ingredients' column if they have one.
+    dataset_file (str): Path to the written dataset.
+    indexed (bool): The ingredients of cocktails are the ones of the stored index, checked against
+                    the dataset before it was rewritten. The stored index is then kept as is.
+    directory (str): Directory of the index.
+    storage_format (str): Format of the dimension table if the index is rebuilt.
+    """
+    if indexed:
+        stamp_ingredient_index(dataset_file, directory)
+    elif 'ingredients' in cocktails.columns:
+        write_ingredient_index(build_ingredient_index(cocktails['id'], cocktails['ingredients']), directory,
+                               storage_format, dataset_file)
+    elif os.path.exists(os.path.join(directory, 'meta.json')):
+        # Nothing to rebuild it from, a stale index must not be joined to the new dataset
+        os.remove(os.path.join(directory, 'meta.json'))
+        logger.warning("Removed the ingredient index in %s, it does not match %s.", directory, dataset_file)
+
+
+def read_aligned_index(ids, dataset_file, directory=INGREDIENT_INDEX):
+    """
+    Load the ingredient index of a processed dataset, aligned to its rows.
+
+    Parameters:
+    ids (array-like): Cocktail id of every row of the dataset.
+    dataset_file (str): Path to the dataset, the index must have been written for its current content.
+    directory (str): Directory of the index.
+
+    Returns:
+    IngredientIndex: The aligned index, None if there is no index, it was written for another
+                     version of the dataset or it does not cover the dataset.
+    """
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        return None
+    if not index_matches(dataset_file, directory):
+        logger.warning("Ingredient index in %s was not written for %s, using the dataset's ingredients instead. "
+                       "Run simplify_data.py to rebuild it.", directory, dataset_file)
+        return None
+    index = read_ingredient_index(directory).align(ids)
+    if index is None:
+        logger.warning("Ingredient index in %s does not cover the dataset, run simplify_data.py to rebuild it.",
+                       directory)
+    return index
+
+
+def attach_ingredients(cocktails, index):
+    """
+    Add the nested 'ingredients' column back to a dataset stored without it.
+
+    Parameters:
+    cocktails (pd.DataFrame): Dataset with an 'id' column.
+    index (IngredientIndex): Index aligned to the rows of cocktails.
+
+    Returns:
+    pd.DataFrame: The dataset with an 'ingredients' column.
+    """
+    return cocktails.assign(ingredients=index.nested_ingredients())
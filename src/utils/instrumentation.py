@@ -0,0 +1,312 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import functools
+import tracemalloc
+import logging
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from omegaconf import OmegaConf
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_CONFIG = 'configs/global_configs.yaml'
+METRICS_FILE = 'metrics.json'
+PROFILES_DIR = 'profiles'
+
+
+def max_rss_mb():
+    """Peak resident memory of the process so far in MB, None where it is not available."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, KB on Linux
+    return max_rss / 2 ** 20 if sys.platform == 'darwin' else max_rss / 2 ** 10
+
+
+def count_rows(value):
+    """
+    Number of rows of a stage output.
+
+    Parameters:
+    value: Output of an instrumented function.
+
+    Returns:
+    int: Length of a DataFrame, Series or list, number of rows of an array or sparse matrix, None otherwise.
+    """
+    shape = getattr(value, 'shape', None)
+    if shape:
+        return int(shape[0])
+    if isinstance(value, list):
+        return len(value)
+    return None
+
+
+class StageMetrics:
+    """
+    Measurements of one instrumented stage.
+
+    Attributes:
+    name (str): Name of the stage.
+    path (str): Names of the enclosing stages and of this stage, separated by '/'.
+    rows (int): Number of rows processed or produced, set by the instrumented code.
+    """
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.rows = None
+        self.traced_peak = 0
+        self.values = {}
+
+
+class MetricsRun:
+    """
+    Metrics of the stages of one script run, written to metrics.json in the Hydra run directory.
+
+    Every stage records its wall and CPU time, the peak resident memory of
+    the process when it ends and how much the stage raised it, and its row
+    count. With tracemalloc, the peak traced memory of every stage is recorded
+    as well (per stage from Python 3.9, since the start of the run before).
+    With a profiler, every top-level stage is profiled to profiles/.
+
+    Parameters:
+    output_dir (str): Directory of metrics.json and the profiles.
+    trace_memory (bool): Record the peak memory traced by tracemalloc, slows down Python code.
+    profiler (str): None, 'cprofile' or 'pyinstrument'.
+    """
+
+    def __init__(self, output_dir, trace_memory=False, profiler=None):
+        self.output_dir = output_dir
+        self.trace_memory = trace_memory
+        self.profiler = profiler
+        self.start = time.perf_counter()
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self.stages = []
+        self.stack = []
+        self.profiles = 0
+
+    @contextmanager
+    def stage(self, name):
+        parent = self.stack[-1] if self.stack else None
+        current = StageMetrics(name, f"{parent.path}/{name}" if parent else name)
+        if self.trace_memory and hasattr(tracemalloc, 'reset_peak'):
+            # The peak of the enclosing stage so far is kept on it, the counter then restarts for this stage
+            if parent is not None:
+                parent.traced_peak = max(parent.traced_peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+
+        self.stack.append(current)
+        profile = self.start_profile() if self.profiler and len(self.stack) == 2 else None
+        rss_before = max_rss_mb()
+        start_offset = time.perf_counter() - self.start
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        try:
+            yield current
+        finally:
+            wall_seconds = time.perf_counter() - wall_start
+            cpu_seconds = time.process_time() - cpu_start
+            rss_after = max_rss_mb()
+            if profile is not None:
+                self.save_profile(profile, current.path)
+            self.stack.pop()
+
+            entry = {
+                'name': name,
+                'path': current.path,
+                'start_seconds': start_offset,
+                'wall_seconds': wall_seconds,
+                'cpu_seconds': cpu_seconds,
+                'max_rss_mb': rss_after,
+                'max_rss_growth_mb': rss_after - rss_before if rss_after is not None else None,
+                'rows': current.rows,
+            }
+            if self.trace_memory:
+                traced_peak = max(current.traced_peak, tracemalloc.get_traced_memory()[1])
+                entry['traced_peak_mb'] = traced_peak / 2 ** 20
+                if hasattr(tracemalloc, 'reset_peak'):
+                    if parent is not None:
+                        parent.traced_peak = max(parent.traced_peak, traced_peak)
+                    tracemalloc.reset_peak()
+            entry.update(current.values)
+            self.stages.append(entry)
+
+    def record(self, name, **values):
+        """
+        Add a stage measured elsewhere, e.g. in a worker process.
+
+        Parameters:
+        name (str): Name of the stage, nested in the current stage.
+        values: Measurements of the stage, e.g. wall_seconds.
+        """
+        parent = self.stack[-1] if self.stack else None
+        self.stages.append({'name': name, 'path': f"{parent.path}/{name}" if parent else name, **values})
+
+    def start_profile(self):
+        if self.profiler == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                logger.warning("pyinstrument is not installed, profiling with cProfile instead.")
+                self.profiler = 'cprofile'
+            else:
+                profile = Profiler()
+                profile.start()
+                return profile
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def save_profile(self, profile, path):
+        directory = os.path.join(self.output_dir, PROFILES_DIR)
+        os.makedirs(directory, exist_ok=True)
+        # Numbered in the order the stages ran, a stage can run several times
+        self.profiles += 1
+        file_stem = os.path.join(directory, f"{self.profiles:02d}_{path.rsplit('/', 1)[-1]}")
+        if isinstance(profile, cProfile.Profile):
+            profile.disable()
+            profile.dump_stats(file_stem + '.prof')
+        else:
+            profile.stop()
+            with open(file_stem + '.html', 'w') as profile_file:
+                profile_file.write(profile.output_html())
+
+    def write(self, script):
+        """
+        Write metrics.json.
+
+        Parameters:
+        script (str): Name of the script.
+
+        Returns:
+        str: Path to the written file.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        file_path = os.path.join(self.output_dir, METRICS_FILE)
+        with open(file_path, 'w') as metrics_file:
+            json.dump({
+                'script': script,
+                'started_at': self.started_at,
+                'wall_seconds': time.perf_counter() - self.start,
+                'max_rss_mb': max_rss_mb(),
+                'stages': self.stages,
+            }, metrics_file, indent=4)
+        return file_path
+
+
+# Metrics of the running script, None if it is not instrumented
+_run = None
+
+
+@contextmanager
+def measure(name):
+    """
+    Measure a block of code as a stage of the running script.
+
+    Does nothing outside an instrumented script (see instrumented_main).
+
+    Parameters:
+    name (str): Name of the stage.
+
+    Yields:
+    StageMetrics: Set its rows attribute to record the number of rows processed.
+    """
+    if _run is None:
+        yield StageMetrics(name, name)
+        return
+    with _run.stage(name) as stage:
+        yield stage
+
+
+def instrumented(function=None, name=None, rows=count_rows):
+    """
+    Decorator measuring every call of a function as a stage of the running script.
+
+    Parameters:
+    function (callable): The decorated function.
+    name (str): Name of the stage, the name of the function if None.
+    rows (callable): rows(result) returns the number of rows of the result, see count_rows.
+
+    Returns:
+    callable: The decorated function.
+    """
+    if function is None:
+        return functools.partial(instrumented, name=name, rows=rows)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if _run is None:
+            return function(*args, **kwargs)
+        with _run.stage(name or function.__name__) as stage:
+            result = function(*args, **kwargs)
+            stage.rows = rows(result)
+            return result
+
+    return wrapper
+
+
+def record(name, **values):
+    """
+    Record a stage measured elsewhere, e.g. in a worker process, in the running script.
+
+    Parameters:
+    name (str): Name of the stage.
+    values: Measurements of the stage, e.g. wall_seconds.
+    """
+    if _run is not None:
+        _run.record(name, **values)
+
+
+def hydra_output_dir():
+    """Run directory of the current Hydra job, None outside Hydra."""
+    from hydra.core.hydra_config import HydraConfig
+    try:
+        return HydraConfig.get().runtime.output_dir
+    except ValueError:
+        return None
+
+
+def instrumented_main(main):
+    """
+    Decorator of the Hydra main functions writing the metrics of their stages to metrics.json.
+
+    The 'instrumentation' section of the global config enables the metrics,
+    tracemalloc and the profiler. Place it below @hydra.main.
+
+    Parameters:
+    main (callable): The main function of a script.
+
+    Returns:
+    callable: The decorated main function.
+    """
+    @functools.wraps(main)
+    def wrapper(cfg):
+        global _run
+        settings = OmegaConf.load(GLOBAL_CONFIG).get('instrumentation') or {}
+        output_dir = hydra_output_dir()
+        if not settings.get('enabled', False) or output_dir is None or _run is not None:
+            return main(cfg)
+
+        _run = MetricsRun(output_dir, trace_memory=bool(settings.get('tracemalloc', False)),
+                          profiler=settings.get('profile'))
+        if _run.trace_memory:
+            tracemalloc.start()
+        script = os.path.splitext(os.path.basename(sys.argv[0]))[0] or main.__module__
+        try:
+            with _run.stage(script):
+                return main(cfg)
+        finally:
+            if _run.trace_memory:
+                tracemalloc.stop()
+            logger.info("Stage metrics written to %s", _run.write(script))
+            _run = None
+
+    return wrapper
@@ -0,0 +1,58 @@
+import sys
+import importlib
+
+
+class LazyModule:
+    """
+    Module imported on its first attribute access.
+
+    The scripts import pandas, numpy, pyarrow and scipy this way, so runs that
+    do not use them (--help, an analysis with every function disabled or
+    replayed from the result cache) do not pay their import time. Attributes
+    are cached on the proxy once read, so later accesses cost the same as on
+    the module itself.
+
+    Parameters:
+    name (str): Full name of the module, e.g. 'pyarrow.parquet'.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        if attribute in ('_name', '_module'):
+            # Not set yet, e.g. on an instance being unpickled
+            raise AttributeError(attribute)
+        value = getattr(self._load(), attribute)
+        setattr(self, attribute, value)
+        return value
+
+    def __reduce__(self):
+        # Functions pickled by value (joblib workers running a __main__ function) carry their globals
+        return lazy_import, (self._name,)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = 'imported' if self._module is not None else 'not imported yet'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    Import a module on first use.
+
+    Parameters:
+    name (str): Full name of the module.
+
+    Returns:
+    The module if it is already imported, a LazyModule importing it on first attribute access otherwise.
+    """
+    return sys.modules.get(name) or LazyModule(name)
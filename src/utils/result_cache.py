@@ -0,0 +1,305 @@
+import os
+import json
+import time
+import pickle
+import logging
+from omegaconf import OmegaConf
+
+from utils.incremental import file_hash, stable_hash
+from utils.ingestion import is_sharded, resolve_shards
+from utils.ingredient_index import INGREDIENT_INDEX, index_files
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = 'data/processed/cache'
+
+# Sections of an analysis config that do not change the result of a function
+UNKEYED_SECTIONS = ('functions', 'refresh_cache')
+
+# Modules the analyses read the data through, editing them invalidates every entry
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_SOURCES = [os.path.join(UTILS_DIR, name) for name in ('data_storage.py', 'ingestion.py', 'ingredient_index.py')]
+
+# Layout of the entry files, part of the keys so entries of another layout are never read
+ENTRY_FORMAT = 2
+
+
+class Lazy:
+    """
+    Compute a value on first use, e.g. load the dataset only on a cache miss.
+
+    A None result (failed load) is not kept, so the next use tries again and
+    logs the failure again. The records logged while computing the value are
+    not replayed by cache hits, as the value is not computed then.
+
+    Parameters:
+    compute (callable): Function without arguments computing the value.
+    """
+    depth = 0
+
+    def __init__(self, compute):
+        self.compute = compute
+        self.value = None
+
+    def __call__(self):
+        if self.value is None:
+            Lazy.depth += 1
+            try:
+                self.value = self.compute()
+            finally:
+                Lazy.depth -= 1
+        return self.value
+
+
+class LogCapture(logging.Handler):
+    """Collect the log records emitted while a cached function runs, so a cache hit can replay them."""
+
+    def __init__(self):
+        super().__init__(logging.NOTSET)
+        self.records = []
+        self.failed = False
+
+    def emit(self, record):
+        self.failed |= record.levelno >= logging.WARNING
+        if not Lazy.depth:
+            self.records.append((record.name, record.levelno, record.getMessage()))
+
+
+class ResultCache:
+    """
+    On-disk memoization of analysis results with size-bounded LRU eviction.
+
+    Every entry is a pickle of the log records a function emitted followed by
+    a pickle of its result, keyed by the function name and a context (content
+    hash of the dataset and of the ingredient index, config, source code).
+    index.json records the size and last access of every entry and the content
+    hash of the input files, which is only recomputed when their size or
+    modification time changes.
+
+    Parameters:
+    directory (str): Directory of the cache.
+    max_size_mb (float): Total size of the entries above which the least recently used are evicted.
+    enabled (bool): If False, functions are always computed and nothing is stored.
+    refresh (bool): Recompute the functions and replace their entries instead of reading them.
+    load_results (bool): If False, hits only replay the log records and return None, without
+                         unpickling the result (which imports pandas for a DataFrame).
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_size_mb=256, enabled=True, refresh=False, load_results=True):
+        self.directory = directory
+        self.max_size = max_size_mb * 2 ** 20
+        self.enabled = enabled
+        self.refresh = refresh
+        self.load_results = load_results
+        self.index_file = os.path.join(directory, 'index.json')
+        self.index = self.load_index() if enabled else {'entries': {}, 'files': {}}
+
+    def load_index(self):
+        if not os.path.exists(self.index_file):
+            return {'entries': {}, 'files': {}}
+        with open(self.index_file) as index_file:
+            return json.load(index_file)
+
+    def save_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self.index_file + '.tmp'
+        with open(temporary, 'w') as index_file:
+            json.dump(self.index, index_file)
+        os.replace(temporary, self.index_file)
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def fingerprint(self, path):
+        """
+        Content hash of a file, reused while its size and modification time are unchanged.
+
+        Parameters:
+        path (str): Path to the file.
+
+        Returns:
+        str: The content hash, None if the file does not exist.
+        """
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        recorded = self.index['files'].get(os.path.abspath(path))
+        if recorded and recorded['size'] == stat.st_size and recorded['mtime_ns'] == stat.st_mtime_ns:
+            return recorded['hash']
+
+        content_hash = file_hash(path)
+        self.index['files'][os.path.abspath(path)] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                                       'hash': content_hash}
+        self.save_index()
+        return content_hash
+
+    def context(self, file_path, cfg, sources=(), ingredients_dir=INGREDIENT_INDEX):
+        """
+        Build the context of the analysis functions of a script.
+
+        Parameters:
+        file_path (str): The analyzed dataset, or a glob, directory or manifest of JSON shards.
+        cfg (DictConfig): The config of the script, without the sections that do not change results.
+        sources (list): Source files of the script, editing them invalidates its entries. The modules
+                        in DATA_SOURCES are always included.
+        ingredients_dir (str): Directory of the ingredient index, which the analyses may read
+                               instead of the nested ingredients of the dataset.
+
+        Returns:
+        dict: The context, None if caching is disabled or the dataset does not exist.
+        """
+        if not self.enabled:
+            return None
+        if is_sharded(file_path):
+            shards = [self.fingerprint(path) for path in resolve_shards(file_path)]
+            fingerprint = stable_hash(shards) if None not in shards else None
+        else:
+            fingerprint = self.fingerprint(file_path)
+        if fingerprint is None:
+            return None
+        config = {section: value for section, value in OmegaConf.to_container(cfg).items()
+                  if section not in UNKEYED_SECTIONS}
+        ingredients = stable_hash([[os.path.basename(path), self.fingerprint(path)]
+                                   for path in index_files(ingredients_dir)])
+        return {'file': fingerprint, 'ingredients': ingredients, 'config': config,
+                'sources': [file_hash(path) for path in DATA_SOURCES + list(sources)]}
+
+    def cached(self, function_name, context, compute):
+        """
+        Return the cached result of a function, computing and storing it on a miss.
+
+        On a hit, the log records emitted by the function are replayed. Results
+        of runs that logged a warning or an error (e.g. the data could not be
+        loaded) are not stored.
+
+        Parameters:
+        function_name (str): Name of the function.
+        context (dict): Context from context(), None to compute without caching.
+        compute (callable): Function without arguments computing the result.
+
+        Returns:
+        The result of compute, None on a hit if load_results is False.
+        """
+        if context is None:
+            return compute()
+
+        key = stable_hash({'function': function_name, 'context': context, 'format': ENTRY_FORMAT})
+        entry = self.index['entries'].get(key)
+        if entry is not None and not self.refresh:
+            try:
+                with open(self.entry_path(key), 'rb') as entry_file:
+                    records = pickle.load(entry_file)
+                    result = pickle.load(entry_file) if self.load_results else None
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+                logger.warning("Cache entry of '%s' is unreadable, recomputing", function_name)
+            else:
+                for name, levelno, message in records:
+                    logging.getLogger(None if name == 'root' else name).log(levelno, message)
+                entry['last_access'] = time.time_ns()
+                self.save_index()
+                logger.debug("Cache hit for '%s'", function_name)
+                return result
+
+        capture = LogCapture()
+        logging.getLogger().addHandler(capture)
+        try:
+            result = compute()
+        finally:
+            logging.getLogger().removeHandler(capture)
+
+        if not capture.failed:
+            self.store(key, function_name, result, capture.records)
+        return result
+
+    def apply(self, function_name, context, function, data):
+        """
+        Cached function(data()), where data is only computed on a cache miss.
+
+        Parameters:
+        function_name (str): Name of the function.
+        context (dict): Context from context(), None to compute without caching.
+        function (callable): Function of the data.
+        data (Lazy): The data, e.g. the loaded dataset. Nothing is computed if it is None.
+
+        Returns:
+        The result of function, None if the data could not be computed or on a hit if load_results is False.
+        """
+        def compute():
+            value = data()
+            return function(value) if value is not None else None
+
+        return self.cached(function_name, context, compute)
+
+    def store(self, key, function_name, result, records):
+        """
+        Write an entry and evict the least recently used entries beyond the size limit.
+
+        Parameters:
+        key (str): Key of the entry.
+        function_name (str): Name of the function.
+        result: Picklable result.
+        records (list): (logger name, level, message) of the log records to replay.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        temporary = self.entry_path(key) + '.tmp'
+        with open(temporary, 'wb') as entry_file:
+            pickle.dump(records, entry_file, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(result, entry_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.entry_path(key))
+
+        self.index['entries'][key] = {'function': function_name, 'size': os.path.getsize(self.entry_path(key)),
+                                      'last_access': time.time_ns()}
+        self.evict()
+        self.save_index()
+
+    def evict(self):
+        """Remove the least recently used entries until the total size fits max_size_mb."""
+        entries = self.index['entries']
+        total = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda key: entries[key]['last_access']):
+            if total <= self.max_size:
+                break
+            total -= entries[key]['size']
+            logger.debug("Evicting cache entry of '%s'", entries[key]['function'])
+            self.remove(key)
+            del entries[key]
+
+    def remove(self, key):
+        if os.path.exists(self.entry_path(key)):
+            os.remove(self.entry_path(key))
+
+    def invalidate(self, function_names=None):
+        """
+        Remove entries explicitly.
+
+        Parameters:
+        function_names (list): Functions whose entries are removed, all entries if None.
+
+        Returns:
+        int: Number of removed entries.
+        """
+        removed = [key for key, entry in self.index['entries'].items()
+                   if function_names is None or entry['function'] in function_names]
+        for key in removed:
+            self.remove(key)
+            del self.index['entries'][key]
+        self.save_index()
+        logger.info("Removed %d cache entries", len(removed))
+        return len(removed)
+
+
+def open_cache(global_config, refresh=False, load_results=True):
+    """
+    Create the result cache from the 'cache' section of the global config.
+
+    Parameters:
+    global_config (DictConfig): The global configuration.
+    refresh (bool): Recompute the functions and replace their entries.
+    load_results (bool): Unpickle the results of hits, False when only their logs are needed.
+
+    Returns:
+    ResultCache: The cache, disabled if the section is missing or disabled.
+    """
+    cache_cfg = global_config.get('cache') or {}
+    return ResultCache(directory=cache_cfg.get('directory', CACHE_DIR), max_size_mb=cache_cfg.get('max_size_mb', 256),
+                       enabled=bool(cache_cfg.get('enabled', False)), refresh=refresh, load_results=load_results)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The scripts import their modules relative to src and their own directory, like when run from the repo root
+SRC = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+sys.path[:0] = [SRC] + [os.path.join(SRC, directory) for directory in ('query', 'analysis', 'cooccurrence', 'clustering')]
@@ -0,0 +1,100 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from bitmap import ARRAY_RATIO, Bitmap, pack_rows
+
+SIZES = [0, 1, 7, 8, 13, 64, 1001]
+DENSITIES = [0.0, 0.01, 0.5, 1.0]
+
+
+def random_rows(n, density, seed):
+    rng = np.random.default_rng(seed)
+    return np.flatnonzero(rng.random(n) < density).astype(np.uint32)
+
+
+def as_array(rows, n):
+    return Bitmap(n, rows=np.asarray(rows, dtype=np.uint32))
+
+
+def as_dense(rows, n):
+    return Bitmap(n, bits=pack_rows(rows, n))
+
+
+REPRESENTATIONS = {'array': as_array, 'dense': as_dense}
+
+
+def check(bitmap, expected, n):
+    expected = np.array(sorted(expected), dtype=np.uint32)
+    assert bitmap.n == n
+    np.testing.assert_array_equal(bitmap.to_rows(), expected)
+    assert bitmap.count() == len(expected)
+    # The padding bits of the last byte stay unset
+    np.testing.assert_array_equal(bitmap.to_bits(), pack_rows(expected, n))
+
+
+def operand_pairs():
+    for n, left_density, right_density in itertools.product(SIZES, DENSITIES, DENSITIES):
+        for left_kind, right_kind in itertools.product(REPRESENTATIONS, repeat=2):
+            yield n, left_density, right_density, left_kind, right_kind
+
+
+@pytest.mark.parametrize('n, left_density, right_density, left_kind, right_kind', list(operand_pairs()))
+@pytest.mark.parametrize('operator', ['&', '|', '-'])
+def test_binary_operators_match_sets(operator, n, left_density, right_density, left_kind, right_kind):
+    left_rows = random_rows(n, left_density, seed=1)
+    right_rows = random_rows(n, right_density, seed=2)
+    left = REPRESENTATIONS[left_kind](left_rows, n)
+    right = REPRESENTATIONS[right_kind](right_rows, n)
+
+    left_set, right_set = set(left_rows.tolist()), set(right_rows.tolist())
+    expected = {'&': left_set & right_set, '|': left_set | right_set, '-': left_set - right_set}[operator]
+    result = {'&': lambda: left & right, '|': lambda: left | right, '-': lambda: left - right}[operator]()
+    check(result, expected, n)
+
+
+@pytest.mark.parametrize('kind', REPRESENTATIONS)
+@pytest.mark.parametrize('density', DENSITIES)
+@pytest.mark.parametrize('n', SIZES)
+def test_invert_matches_complement(n, density, kind):
+    rows = random_rows(n, density, seed=3)
+    bitmap = REPRESENTATIONS[kind](rows, n)
+    complement = ~bitmap
+    check(complement, set(range(n)) - set(rows.tolist()), n)
+    check(~complement, set(rows.tolist()), n)
+
+
+@pytest.mark.parametrize('n', SIZES)
+def test_empty_and_full(n):
+    check(Bitmap.empty(n), set(), n)
+    check(Bitmap.full(n), set(range(n)), n)
+    check(~Bitmap.empty(n), set(range(n)), n)
+    check(~Bitmap.full(n), set(), n)
+
+
+@pytest.mark.parametrize('n', [13, 1001])
+def test_from_rows_and_from_bits_choose_the_smaller_representation(n):
+    sparse_rows = np.arange(0, n, 2 * ARRAY_RATIO, dtype=np.uint32)
+    dense_rows = np.arange(0, n, 2, dtype=np.uint32)
+    assert Bitmap.from_rows(dense_rows, n).is_dense
+    assert Bitmap.from_bits(pack_rows(sparse_rows, n), n).is_dense == (len(sparse_rows) * ARRAY_RATIO >= n)
+    check(Bitmap.from_rows(sparse_rows, n), set(sparse_rows.tolist()), n)
+    check(Bitmap.from_bits(pack_rows(dense_rows, n), n), set(dense_rows.tolist()), n)
+
+
+@pytest.mark.parametrize('kind', REPRESENTATIONS)
+def test_contains(kind):
+    n = 100
+    rows = random_rows(n, 0.3, seed=4)
+    bitmap = REPRESENTATIONS[kind](rows, n)
+    queried = np.arange(n)
+    np.testing.assert_array_equal(bitmap.contains(queried), np.isin(queried, rows))
+    assert not as_array([], n).contains([0, 99]).any()
+
+
+def test_operands_over_different_universes_are_rejected():
+    with pytest.raises(ValueError):
+        Bitmap.empty(8) & Bitmap.empty(9)
+    with pytest.raises(ValueError):
+        Bitmap.full(8) - Bitmap.empty(16)
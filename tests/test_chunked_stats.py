@@ -0,0 +1,114 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from chunked_stats import HyperLogLog, QuantileSketch, TopCounter
+
+
+def sketch_of(values, precision=14):
+    sketch = HyperLogLog(precision)
+    sketch.update(values)
+    return sketch
+
+
+def test_hll_merge_equals_sketch_of_the_union():
+    left, right = list(range(0, 30000)), [f"value {i}" for i in range(20000)] + list(range(25000, 40000))
+    merged = sketch_of(left)
+    merged.merge(sketch_of(right))
+    np.testing.assert_array_equal(merged.registers, sketch_of(left + right).registers)
+
+    # Merging is commutative and idempotent
+    reverse = sketch_of(right)
+    reverse.merge(sketch_of(left))
+    reverse.merge(sketch_of(left))
+    np.testing.assert_array_equal(reverse.registers, merged.registers)
+
+
+@pytest.mark.parametrize('n_distinct', [1, 100, 5000, 200000])
+def test_hll_merged_count_is_close_to_the_distinct_count(n_distinct):
+    # Chunks overlap by half, so every value is seen about twice
+    chunks = [list(range(start, min(start + 10000, n_distinct))) for start in range(0, n_distinct, 5000)]
+    merged = HyperLogLog()
+    for chunk in chunks:
+        merged.merge(sketch_of(chunk))
+    assert abs(merged.count() - n_distinct) <= max(2, 0.03 * n_distinct)
+
+
+def test_hll_empty_count():
+    assert HyperLogLog().count() == 0
+
+
+def test_quantile_merge_below_capacity_is_exact():
+    rng = np.random.default_rng(0)
+    batches = [rng.normal(size=size) for size in (10, 1000, 1, 2500)]
+    merged = QuantileSketch(capacity=5000)
+    for batch in batches:
+        part = QuantileSketch(capacity=5000)
+        part.update(batch)
+        merged.merge(part)
+    values = np.concatenate(batches)
+    assert merged.n_seen == len(values)
+    q = [0, 0.25, 0.5, 0.75, 1]
+    np.testing.assert_allclose(merged.quantiles(q), np.quantile(values, q))
+
+
+def test_quantile_without_capacity_keeps_every_value():
+    sketch = QuantileSketch(capacity=None)
+    for start in range(0, 100000, 30000):
+        sketch.update(np.arange(start, min(start + 30000, 100000), dtype=np.float64))
+    assert len(sketch.sample) == sketch.n_seen == 100000
+    assert sketch.quantiles([0.5])[0] == np.median(np.arange(100000))
+
+
+def test_quantile_merge_above_capacity_keeps_a_sample_of_the_values():
+    rng = np.random.default_rng(1)
+    values = rng.uniform(0, 100, size=200000)
+    merged = QuantileSketch(capacity=2000, random_state=2)
+    for index, batch in enumerate(np.array_split(values, 7)):
+        part = QuantileSketch(capacity=2000, random_state=index)
+        part.update(batch)
+        merged.merge(part)
+    assert merged.n_seen == len(values)
+    assert len(merged.sample) == 2000
+    assert np.isin(merged.sample, values).all()
+    np.testing.assert_allclose(merged.quantiles([0.25, 0.5, 0.75]), [25, 50, 75], atol=4)
+
+
+def test_quantile_merge_draws_in_proportion_to_the_values_seen():
+    capacity = 1000
+    common, rare = QuantileSketch(capacity, random_state=3), QuantileSketch(capacity, random_state=4)
+    common.update(np.zeros(90000))
+    rare.update(np.ones(10000))
+    common.merge(rare)
+    assert common.n_seen == 100000
+    assert len(common.sample) == capacity
+    assert 0.05 < common.sample.mean() < 0.15
+
+
+def counter_of(batches, capacity):
+    counter = TopCounter(capacity)
+    for batch in batches:
+        part = TopCounter(capacity)
+        part.update(Counter(batch.tolist()))
+        counter.merge(part)
+    return counter
+
+
+def test_top_counter_without_capacity_is_exact():
+    batches = np.array_split(np.random.default_rng(0).zipf(1.5, 20000) % 1000, 10)
+    counter = counter_of(batches, None)
+    assert counter.counts == Counter(np.concatenate(batches).tolist())
+    assert counter.error == 0
+
+
+@pytest.mark.parametrize('capacity', [5, 20, 100])
+def test_top_counter_counts_are_within_the_error_bound(capacity):
+    values = np.random.default_rng(1).zipf(1.3, 50000) % 2000
+    exact = Counter(values.tolist())
+    counter = counter_of(np.array_split(values, 25), capacity)
+    assert counter.error > 0
+    assert len(counter.counts) <= 2 * capacity
+    for value, count in exact.items():
+        kept = counter.counts.get(value, 0)
+        assert kept <= count <= kept + counter.error
@@ -0,0 +1,41 @@
+import numpy as np
+from omegaconf import OmegaConf
+
+from cluster_model import ClusterModel, read_cluster_model, tagging_fingerprint, write_cluster_model
+
+TAGGING = {
+    'mode': 'batch',
+    'functions': {'assign_other_tags': True},
+    'tags_definitions': {'other_tags': [{'tag': 'Citrus', 'ingredients': ['Lemon', 'Lime']}]},
+}
+
+
+def tagging_cfg(**overrides):
+    return OmegaConf.merge(TAGGING, overrides)
+
+
+def test_tagging_fingerprint_ignores_the_mode():
+    assert tagging_fingerprint(tagging_cfg(mode='per_cocktail')) == tagging_fingerprint(tagging_cfg())
+
+
+def test_tagging_fingerprint_changes_with_the_tags():
+    fingerprint = tagging_fingerprint(tagging_cfg())
+    assert tagging_fingerprint(tagging_cfg(functions={'assign_other_tags': False})) != fingerprint
+    definitions = {'other_tags': [{'tag': 'Citrus', 'ingredients': ['Lemon']}]}
+    assert tagging_fingerprint(tagging_cfg(tags_definitions=definitions)) != fingerprint
+
+
+def test_model_round_trip_keeps_the_vocabulary_and_tagging(tmp_path):
+    model = ClusterModel(columns=[None, 'Citrus', 'Strong'], scale=np.ones(3, dtype=np.float32),
+                         offset=np.zeros(3, dtype=np.float32), centers=np.eye(2, 3, dtype=np.float32),
+                         tagging=tagging_fingerprint(tagging_cfg()))
+    version = write_cluster_model(model, str(tmp_path))
+
+    loaded = read_cluster_model(str(tmp_path))
+    assert loaded.version == version
+    assert loaded.tags_indices == {'Citrus': 1, 'Strong': 2}
+    assert loaded.tagging == model.tagging
+
+    other = ClusterModel(columns=model.columns, scale=model.scale, offset=model.offset, centers=model.centers,
+                         tagging=tagging_fingerprint(tagging_cfg(functions={'assign_other_tags': False})))
+    assert write_cluster_model(other, str(tmp_path)) != version
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from omegaconf import OmegaConf
+
+from clustering import config_error, fit_minibatch_kmeans
+
+
+def batches_of(features, batch_size):
+    return lambda: (features[start:start + batch_size] for start in range(0, len(features), batch_size))
+
+
+@pytest.mark.parametrize('batch_size', [1, 7, 50, 500])
+def test_minibatch_kmeans_with_more_clusters_than_rows_per_batch(batch_size):
+    features = np.random.default_rng(0).random((300, 4), dtype=np.float32)
+    kmeans = fit_minibatch_kmeans(batches_of(features, batch_size), n_clusters=100, n_epochs=2)
+    assert kmeans.cluster_centers_.shape == (100, 4)
+    assert set(kmeans.predict(features)) <= set(range(100))
+
+
+def test_minibatch_kmeans_with_fewer_rows_than_clusters():
+    features = np.random.default_rng(0).random((20, 4), dtype=np.float32)
+    with pytest.raises(ValueError):
+        fit_minibatch_kmeans(batches_of(features, 8), n_clusters=30)
+
+
+@pytest.mark.parametrize('algorithm, hierarchical, valid', [
+    ('kmeans', 'agglomerative', True),
+    ('kmeans', 'birch', True),
+    ('minibatch', 'birch', True),
+    ('minibatch', 'centroid_agglomerative', True),
+    ('minibatch', 'agglomerative', False),
+    ('kmeans', 'ward', False),
+    ('spectral', 'birch', False),
+])
+def test_config_error(algorithm, hierarchical, valid):
+    error = config_error(OmegaConf.create({'algorithm': algorithm, 'hierarchical': hierarchical}))
+    assert (error is None) == valid
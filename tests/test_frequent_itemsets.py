@@ -0,0 +1,93 @@
+import itertools
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+from frequent_itemsets import (association_rules, frequent_partners, maximal_itemsets, mine_frequent_itemsets,
+                               vertical_bitmaps)
+
+
+def random_baskets(n_cocktails=400, n_items=12, seed=0):
+    """0/1 cocktail x item matrix with items of decreasing popularity and a few correlated groups."""
+    rng = np.random.default_rng(seed)
+    dense = rng.random((n_cocktails, n_items)) < np.linspace(0.5, 0.02, n_items)
+    group = rng.random(n_cocktails) < 0.2
+    dense[group, 3] = dense[group, 7] = dense[group, 9] = True
+    return sparse.csr_matrix(dense.astype(np.int32))
+
+
+def mine(incidence, min_count, max_length, n_jobs=1, batch_size=64):
+    """Mine like association_rules.main, returning itemsets of matrix columns."""
+    counts = (incidence.T @ incidence).tocsr()
+    counts.setdiag(0)
+    counts.eliminate_zeros()
+    item_counts = np.asarray(incidence.sum(axis=0)).ravel()
+    frequent = np.flatnonzero(item_counts >= min_count)
+    frequent = frequent[np.argsort(item_counts[frequent], kind='stable')]
+
+    batches = [incidence[start:start + batch_size] for start in range(0, incidence.shape[0], batch_size)]
+    bitmaps, n_cocktails = vertical_bitmaps(batches, frequent)
+    assert n_cocktails == incidence.shape[0]
+    partners, partner_counts = frequent_partners(counts, frequent, min_count)
+    positions = mine_frequent_itemsets(bitmaps, partners, partner_counts, min_count, max_length, n_jobs)
+    return {tuple(sorted(int(frequent[position]) for position in itemset)): count
+            for itemset, count in positions.items()}
+
+
+def brute_force(incidence, min_count, max_length):
+    dense = incidence.toarray().astype(bool)
+    itemsets = {}
+    for length in range(1, max_length + 1):
+        for itemset in itertools.combinations(range(dense.shape[1]), length):
+            count = int(dense[:, list(itemset)].all(axis=1).sum())
+            if count >= min_count:
+                itemsets[itemset] = count
+    return itemsets
+
+
+@pytest.mark.parametrize('min_count', [1, 10, 40, 1000])
+@pytest.mark.parametrize('max_length', [1, 2, 3, 5])
+def test_eclat_matches_brute_force(min_count, max_length):
+    incidence = random_baskets()
+    assert mine(incidence, min_count, max_length) == brute_force(incidence, min_count, max_length)
+
+
+def test_parallel_mining_matches_serial_mining():
+    incidence = random_baskets(seed=1)
+    assert mine(incidence, 8, 4, n_jobs=2) == mine(incidence, 8, 4, n_jobs=1)
+
+
+def test_no_cocktails():
+    assert mine(sparse.csr_matrix((0, 5), dtype=np.int32), 1, 3) == {}
+
+
+def test_association_rules_measures():
+    incidence = random_baskets(seed=2)
+    n_cocktails = incidence.shape[0]
+    itemsets = brute_force(incidence, 10, 3)
+    rules = association_rules(itemsets, n_cocktails, min_confidence=0.3, min_lift=1.1)
+
+    dense = incidence.toarray().astype(bool)
+    assert len(rules)
+    for rule in rules.itertuples():
+        both = dense[:, list(rule.antecedent) + [rule.consequent]].all(axis=1).sum()
+        antecedent = dense[:, list(rule.antecedent)].all(axis=1).sum()
+        confidence = both / antecedent
+        assert rule.count == both
+        assert rule.support == pytest.approx(both / n_cocktails)
+        assert rule.confidence == pytest.approx(confidence)
+        assert rule.lift == pytest.approx(confidence / dense[:, rule.consequent].mean())
+        assert rule.confidence >= 0.3 and rule.lift >= 1.1
+    assert rules['confidence'].is_monotonic_decreasing
+
+
+def test_maximal_itemsets_have_no_frequent_superset():
+    itemsets = brute_force(random_baskets(seed=3), 15, 4)
+    maximal = maximal_itemsets(itemsets)
+    assert maximal
+    for itemset, count in maximal.items():
+        assert count == itemsets[itemset]
+        assert not any(set(itemset) < set(other) for other in itemsets)
+    # Every frequent itemset is a subset of a maximal one
+    assert all(any(set(itemset) <= set(other) for other in maximal) for itemset in itemsets)
@@ -0,0 +1,60 @@
+import os
+import json
+
+import pytest
+
+from utils.data_storage import iter_json_array
+
+ELEMENTS = [
+    {'id': 1, 'name': 'Mojito', 'percentage': 2.5, 'tags': ['IBA', 'Classic']},
+    {'name': 'Brackets [in], {strings}, "quotes" and \\ escapes', 'empty': {}, 'nested': [[1, [2]], []]},
+    {'name': 'Piña Colada — \U0001F378', 'alcoholic': True, 'measure': None},
+    12345678901234567890,
+    -0.000125e-3,
+    'text',
+    [],
+]
+
+
+def write(tmp_path, text):
+    path = tmp_path / 'array.json'
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+@pytest.mark.parametrize('buffer_size', [1, 2, 3, 7, 64, 2 ** 16])
+@pytest.mark.parametrize('indent', [None, 4])
+def test_elements_match_json_load(tmp_path, buffer_size, indent):
+    path = write(tmp_path, json.dumps(ELEMENTS, indent=indent, ensure_ascii=False))
+    assert list(iter_json_array(path, buffer_size)) == ELEMENTS
+
+
+@pytest.mark.parametrize('buffer_size', [1, 2, 5])
+def test_numbers_cut_by_a_buffer_are_read_whole(tmp_path, buffer_size):
+    path = write(tmp_path, '[2.5,10,1e10,-3]')
+    assert list(iter_json_array(path, buffer_size)) == [2.5, 10, 1e10, -3]
+
+
+@pytest.mark.parametrize('text', ['[]', '  [ \n ]  ', '\n[\t]\n'])
+def test_empty_array(tmp_path, text):
+    assert list(iter_json_array(write(tmp_path, text), buffer_size=1)) == []
+
+
+def test_bundled_dataset_matches_json_load():
+    path = os.path.join(os.path.dirname(__file__), '..', 'data', 'raw', 'cocktail_dataset.json')
+    with open(path, encoding='utf-8') as source:
+        expected = json.load(source)
+    assert list(iter_json_array(path, buffer_size=1024)) == expected
+
+
+@pytest.mark.parametrize('text', [
+    '{"id": 1}',
+    '',
+    '[{"id": 1}, {"id": 2}',
+    '[{"id": 1} {"id": 2}]',
+    '[{"id": 1}, {"id": ',
+    '[1, ]',
+])
+def test_malformed_input_raises(tmp_path, text):
+    with pytest.raises(ValueError):
+        list(iter_json_array(write(tmp_path, text), buffer_size=4))